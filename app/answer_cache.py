@@ -0,0 +1,182 @@
+# app/answer_cache.py
+# کش پاسخ‌های مدل روی SQLite (WAL) به جای data/cache.json
+#
+# قبلاً هر generate_answer کل cache.json رو parse می‌کرد و هر miss کل فایل رو با indent=2
+# دوباره می‌نوشت؛ یعنی latency با اندازه‌ی کش بالا می‌رفت، workerهای uvicorn ورودی‌های هم رو
+# پاک می‌کردن و فایل هیچ‌وقت کوچیک نمی‌شد.
+#
+# اینجا:
+# - کلید = sha1 متن کلید (سؤال + کانتکست) → PRIMARY KEY، پس lookup با ایندکسه نه اسکن
+# - WAL + busy_timeout تا چند process هم‌زمان بخونن/بنویسن
+# - حذف بر اساس TTL (از زمان ساخت) و سقف تعداد (LRU روی accessed_at)
+# - بار اول، محتوای cache.json قدیمی یک بار منتقل می‌شه و فایل به .migrated تغییر نام می‌ده
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# به‌روزرسانی accessed_at روی هر hit یک write است؛ اگر تازه به‌روز شده باشه ازش می‌گذریم
+_TOUCH_INTERVAL_SEC = 60.0
+# هر چند put یک بار eviction اجرا می‌شه (نه روی هر درخواست)
+_EVICT_EVERY = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key         TEXT PRIMARY KEY,
+    answer      TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers(accessed_at);
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def cache_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10000,
+        ttl_sec: float = 30 * 24 * 3600.0,
+        legacy_json: Optional[str] = None,
+    ):
+        self.path = str(path)
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_sec = float(ttl_sec)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._hits = 0
+        self._misses = 0
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        if legacy_json:
+            self._migrate_json(legacy_json)
+
+    # ---------- اتصال (یکی برای هر thread) ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None → autocommit؛ تراکنش‌ها رو خودمون صریح باز می‌کنیم
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- API ----------
+    def get(self, text: str) -> Optional[str]:
+        key = cache_key(text)
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT answer, created_at, accessed_at FROM answers WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (self.ttl_sec > 0 and now - row[1] > self.ttl_sec):
+            with self._lock:
+                self._misses += 1
+            return None
+        if now - row[2] > _TOUCH_INTERVAL_SEC:
+            conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self._hits += 1
+        return row[0]
+
+    def put(self, text: str, answer: str) -> None:
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO answers (key, answer, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (cache_key(text), answer, now, now),
+        )
+        with self._lock:
+            self._puts += 1
+            run_evict = self._puts % _EVICT_EVERY == 1
+        if run_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """ورودی‌های منقضی و بعد قدیمی‌ترین‌ها (بر اساس accessed_at) تا سقف max_entries حذف می‌شن."""
+        conn = self._conn()
+        removed = 0
+        if self.ttl_sec > 0:
+            removed += conn.execute(
+                "DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_sec,)
+            ).rowcount
+        if self.max_entries > 0:
+            removed += conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        return removed
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM answers")
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "path": self.path,
+                "size": int(size),
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl_sec,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / total) if total else 0.0,
+            }
+
+    # ---------- انتقال از cache.json ----------
+    def _migrate_json(self, legacy_json: str) -> None:
+        if not os.path.isfile(legacy_json):
+            return
+        conn = self._conn()
+        # BEGIN IMMEDIATE قفل نوشتن رو می‌گیره تا فقط یک worker منتقل کنه
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE name = 'migrated_json'").fetchone()
+            if done is None:
+                try:
+                    with open(legacy_json, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception:
+                    data = {}
+                now = time.time()
+                rows = [
+                    (cache_key(k), v, now, now)
+                    for k, v in (data.items() if isinstance(data, dict) else [])
+                    if isinstance(v, str)
+                ]
+                conn.executemany(
+                    "INSERT OR IGNORE INTO answers (key, answer, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute(
+                    "INSERT INTO meta (name, value) VALUES ('migrated_json', ?)",
+                    (json.dumps({"source": legacy_json, "entries": len(rows), "at": now}),),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        try:
+            os.replace(legacy_json, legacy_json + ".migrated")
+        except OSError:
+            pass
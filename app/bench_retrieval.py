@@ -0,0 +1,323 @@
+"""
+bench_retrieval.py
+------------------
+بنچمارک قابل تکرار retriever روی corpusهای مصنوعی (۱x / ۱۰x / ۱۰۰x از data/abzaar.txt).
+
+برای هر مقیاس دو process جدا اجرا می‌شه تا اعداد با هم قاطی نشن:
+  1) build: کش امبدینگ خالی → زمان ساخت ایندکس (و artifact FAISS اگر backend=faiss)
+  2) query: کش گرم → cold start (import تا جواب اولین کوئری)، latency p50/p95/p99،
+     throughput حالت batch (retrieve_many)، RSS و recall@k نسبت به جست‌وجوی دقیق brute-force
+
+خروجی یک فایل JSON است تا اجراهای مختلف با هم مقایسه بشن. با --baseline و --max-recall-drop
+(یا --min-recall) اگر کیفیت افت کرده باشه exit code غیرصفر برمی‌گرده (برای CI).
+
+مثال:
+    python -m app.bench_retrieval --scales 1,10 --out bench_results/numpy.json
+    RETRIEVER_VECTOR_DTYPE=int8 python -m app.bench_retrieval --baseline bench_results/numpy.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# برای cold start: زمان از لحظه‌ی اجرای همین ماژول (قبل از import retriever / numpy) حساب می‌شه
+_PROCESS_T0 = time.perf_counter()
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+SOURCE_FILE = ROOT / "data" / "abzaar.txt"
+CHUNK_SEPARATOR = "\n\n"
+_SENTENCE_RE = re.compile(r"(?<=[.!?؟])\s+")
+
+
+# ---------- corpus مصنوعی ----------
+def make_corpus(scale: int, out_dir: str) -> str:
+    """
+    abzaar.txt رو scale بار تکرار می‌کنه؛ هر نسخه‌ی اضافه جمله‌های هر پاراگراف رو
+    می‌چرخونه و یک برچسب جلوش می‌ذاره تا متن (و hash کش امبدینگ) تکراری نباشه.
+    """
+    with open(SOURCE_FILE, "r", encoding="utf-8") as f:
+        paragraphs = [p.strip() for p in f.read().split(CHUNK_SEPARATOR) if p.strip()]
+
+    chunks: List[str] = []
+    for copy in range(scale):
+        for p in paragraphs:
+            if copy == 0:
+                chunks.append(p)
+                continue
+            sentences = _SENTENCE_RE.split(p)
+            shift = copy % len(sentences)
+            chunks.append(f"[{copy}] " + " ".join(sentences[shift:] + sentences[:shift]))
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"abzaar_x{scale}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(CHUNK_SEPARATOR.join(chunks))
+    return path
+
+
+def _queries_from_chunks(chunks: List[str], n: int, seed: int) -> List[str]:
+    # ابتدای یک جمله‌ی تصادفی از چانک‌های تصادفی (حدود ۱۲ کلمه) شبیه سوال کوتاه کاربره
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(chunks), size=n):
+        sentences = [s for s in _SENTENCE_RE.split(chunks[int(i)]) if s.strip()]
+        sentence = sentences[int(rng.integers(0, len(sentences)))]
+        queries.append(" ".join(sentence.split()[:12]))
+    return queries
+
+
+# ---------- اندازه‌گیری‌ها ----------
+def _rss_mb() -> Dict[str, float]:
+    current = 0.0
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024.0
+                    break
+    except OSError:
+        pass
+    # روی لینوکس ru_maxrss به کیلوبایته (روی macOS بایت)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    return {"rss_mb": round(current, 1), "peak_rss_mb": round(peak_mb, 1)}
+
+
+def _percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    import numpy as np
+
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "mean_ms": round(float(arr.mean()), 3),
+    }
+
+
+def _worker_build(args: argparse.Namespace) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    from app import retriever as r
+
+    r.CANDIDATE_DATA_DIRS = [args.data_dir]
+    if r.RETRIEVER_BACKEND == "faiss":
+        from ingest.build_faiss import build_index
+
+        chunks = [c for c, _, _ in r._load_raw_chunks_from_dirs()]
+        name = os.path.basename(r._list_data_files()[0])
+        build_index(
+            [{"text": c, "source": name} for c in chunks],
+            output_dir=r.FAISS_INDEX_DIR,
+            index_type=os.getenv("BENCH_FAISS_INDEX_TYPE", "flat"),
+        )
+
+    idx = r._get_index()
+    if args.mode != "lexical":
+        r._ensure_embeddings(idx)
+    took = time.perf_counter() - t0
+    out = {"chunks": len(idx["chunks"]), "build_sec": round(took, 3)}
+    out.update({f"build_{k}": v for k, v in _rss_mb().items()})
+    return out
+
+
+def _worker_query(args: argparse.Namespace, t_start: float) -> Dict[str, Any]:
+    import numpy as np
+    from app import retriever as r
+
+    r.CANDIDATE_DATA_DIRS = [args.data_dir]
+    idx = r._get_index()
+    queries = _queries_from_chunks(idx["chunks"], args.queries, args.seed)
+
+    # cold start: از شروع process تا جواب اولین کوئری (import + لود ایندکس/مدل از کش گرم)
+    r.retrieve(queries[0], top_k=args.top_k, mode=args.mode)
+    cold_start = time.perf_counter() - t_start
+
+    latencies = []
+    results = []
+    for q in queries:
+        t0 = time.perf_counter()
+        results.append(r.retrieve(q, top_k=args.top_k, mode=args.mode))
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    for start in range(0, len(queries), args.batch_size):
+        r.retrieve_many(queries[start:start + args.batch_size], top_k=args.top_k, mode=args.mode)
+    batch_sec = time.perf_counter() - t0
+
+    # recall@k نسبت به جست‌وجوی دقیق روی بردارهای float32 (همون مدل، همون چانک‌ها)
+    embs = r._ensure_embeddings(idx)
+    row_of = {s: i for i, s in enumerate(idx["sources"])}
+    k = min(args.top_k, len(idx["chunks"]))
+    hits = 0
+    for q, got in zip(queries, results):
+        exact = 1.0 - (np.asarray(embs) @ r.encode_query(q)).astype(np.float64)
+        truth = set(r._top_k(exact, k).tolist())
+        hits += len(truth & {row_of[h["source"]] for h in got[:k]})
+
+    out = {
+        "chunks": len(idx["chunks"]),
+        "cold_start_sec": round(cold_start, 3),
+        "queries": len(queries),
+        "latency": _percentiles(latencies),
+        "batch_size": args.batch_size,
+        "batch_qps": round(len(queries) / batch_sec, 2) if batch_sec > 0 else None,
+        f"recall@{k}": round(hits / float(len(queries) * k), 4),
+    }
+    out.update(_rss_mb())
+    return out
+
+
+# ---------- اجرای کامل ----------
+def _run_worker(phase: str, args: argparse.Namespace, data_dir: str, env: Dict[str, str]) -> Dict[str, Any]:
+    cmd = [
+        sys.executable, "-m", "app.bench_retrieval", "--worker", phase,
+        "--data-dir", data_dir,
+        "--mode", args.mode,
+        "--top-k", str(args.top_k),
+        "--queries", str(args.queries),
+        "--batch-size", str(args.batch_size),
+        "--seed", str(args.seed),
+    ]
+    proc = subprocess.run(cmd, cwd=str(ROOT), env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise RuntimeError(f"{phase} worker failed for {data_dir}")
+    # آخرین خط stdout خروجی JSON است؛ بقیه لاگ‌های [retriever] هستن
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "backend": os.getenv("RETRIEVER_BACKEND", "numpy"),
+            "mode": args.mode,
+            "vector_dtype": os.getenv("RETRIEVER_VECTOR_DTYPE", "float32"),
+            "faiss_index_type": os.getenv("BENCH_FAISS_INDEX_TYPE", "flat"),
+            "top_k": args.top_k,
+            "queries": args.queries,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+            "query_cache": bool(args.query_cache),
+        },
+        "scales": {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    try:
+        for scale in args.scales:
+            scale_dir = os.path.join(work_dir, f"x{scale}")
+            data_dir = make_corpus(scale, os.path.join(scale_dir, "data"))
+            env = dict(os.environ)
+            env["EMBED_CACHE_DIR"] = os.path.join(scale_dir, "emb_cache")
+            env["FAISS_INDEX_DIR"] = os.path.join(scale_dir, "faiss_index")
+            if not args.query_cache:
+                # هر کوئری واقعاً encode بشه، نه اینکه از LRU بیاد
+                env["QUERY_CACHE_SIZE"] = "0"
+
+            print(f"[bench] scale x{scale}: building...", flush=True)
+            build = _run_worker("build", args, os.path.dirname(data_dir), env)
+            print(f"[bench] scale x{scale}: {build['chunks']} chunks, querying...", flush=True)
+            query = _run_worker("query", args, os.path.dirname(data_dir), env)
+            report["scales"][f"x{scale}"] = {**build, **query}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def check_regression(report: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    """لیست خطاهای کیفیت (خالی یعنی همه چیز اوکیه)."""
+    failures = []
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    for name, res in report["scales"].items():
+        recall_key = next((k for k in res if k.startswith("recall@")), None)
+        if recall_key is None:
+            continue
+        recall = res[recall_key]
+        if args.min_recall is not None and recall < args.min_recall:
+            failures.append(f"{name}: {recall_key}={recall} < min {args.min_recall}")
+        if baseline is not None:
+            old = baseline.get("scales", {}).get(name, {}).get(recall_key)
+            if old is not None and recall < old - args.max_recall_drop:
+                failures.append(f"{name}: {recall_key}={recall} dropped from baseline {old}")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="بنچمارک و تست افت recall برای app.retriever")
+    parser.add_argument("--scales", default="1,10,100", help="ضریب‌های corpus، مثلاً 1,10,100")
+    parser.add_argument("--mode", default=os.getenv("RETRIEVER_MODE", "dense"))
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--query-cache", action="store_true", help="کش بردار کوئری فعال بمونه")
+    parser.add_argument("--out", default=os.path.join("bench_results", "retrieval.json"))
+    parser.add_argument("--baseline", default=None, help="فایل JSON اجرای قبلی برای مقایسه‌ی recall")
+    parser.add_argument("--max-recall-drop", type=float, default=0.01)
+    parser.add_argument("--min-recall", type=float, default=None)
+    # داخلی: اجرای یک فاز در process جدا
+    parser.add_argument("--worker", choices=("build", "query"), help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        if args.worker == "build":
+            out = _worker_build(args)
+        else:
+            out = _worker_query(args, _PROCESS_T0)
+        print(json.dumps(out))
+        return 0
+
+    args.scales = [int(s) for s in str(args.scales).split(",") if s.strip()]
+    report = run(args)
+    failures = check_regression(report, args)
+    report["failures"] = failures
+
+    out_path = Path(args.out)
+    if not out_path.is_absolute():
+        out_path = ROOT / out_path
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(report["scales"], ensure_ascii=False, indent=2))
+    print(f"[bench] results written to {out_path}")
+    for msg in failures:
+        print(f"[bench] REGRESSION: {msg}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
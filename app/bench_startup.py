@@ -0,0 +1,140 @@
+"""
+bench_startup.py
+----------------
+اندازه‌گیری هزینه‌ی سرد اپ: زمان import، زمان warm-up و time-to-first-answer.
+
+هر اجرا یک پروسه‌ی پایتون تازه است (تا کش‌های import و مدل از اجرای قبلی نمونن).
+دو حالت مقایسه می‌شن:
+  warm → مثل startup واقعی: اول warm-up (app/warmup.py)، بعد اولین درخواست
+  cold → بدون warm-up؛ اولین درخواست کل هزینه‌ی لود مدل/ایندکس/SDK رو می‌ده
+
+برای هر اجرا ثبت می‌شه:
+  process_sec       → کل عمر پروسه (مفسر + import + warm-up + اولین درخواست)
+  import_sec        → import app.main
+  warmup_sec        → کل warm-up (و زمان هر مرحله در steps)
+  first_request_ms  → latency اولین درخواست
+  first_answer_sec  → از شروع import تا اولین جواب موفق
+
+درخواست از httpx.ASGITransport داخل همون پروسه می‌ره (بدون شبکه). برای اینکه quota خرج
+نشه با MODEL_PROVIDER=fake اجرا کنید.
+
+مثال:
+    MODEL_PROVIDER=fake FAKE_LLM_LATENCY=fixed:0 python -m app.bench_startup --runs 3
+    python -X importtime -c "import app.main" 2> bench_results/importtime.txt   # جزئیات import
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def _child(args: argparse.Namespace) -> None:
+    import asyncio
+
+    t_import = time.perf_counter()
+    from app import warmup
+    import app.main as main_mod
+    import_sec = time.perf_counter() - t_import
+
+    if args.mode == "warm":
+        warmup.run_warmup()
+
+    async def _first_request() -> Dict[str, Any]:
+        import httpx
+
+        transport = httpx.ASGITransport(app=main_mod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            t0 = time.perf_counter()
+            r = await client.post(args.endpoint, json={"message": args.message}, timeout=args.timeout)
+            took = (time.perf_counter() - t0) * 1000
+        body: Any = {}
+        try:
+            body = r.json()
+        except ValueError:
+            pass
+        ok = (
+            r.status_code == 200
+            and not (isinstance(body, dict) and body.get("error"))
+            and "event: error" not in r.text
+        )
+        return {"status": r.status_code, "ok": ok, "first_request_ms": round(took, 1)}
+
+    req = asyncio.run(_first_request())
+    state = warmup.readiness()
+    print(json.dumps({
+        "import_sec": round(import_sec, 3),
+        "warmup_sec": state["warmup_sec"],
+        "steps": {k: v.get("sec") for k, v in state["steps"].items()},
+        "first_answer_sec": state["first_answer_sec"],
+        **req,
+    }))
+
+
+def _run_once(args: argparse.Namespace, mode: str) -> Dict[str, Any]:
+    cmd = [
+        sys.executable, "-m", "app.bench_startup", "--child", "--mode", mode,
+        "--endpoint", args.endpoint, "--message", args.message, "--timeout", str(args.timeout),
+    ]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=str(ROOT), capture_output=True, text=True, env=dict(os.environ))
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"child failed ({mode}):\n{proc.stderr[-2000:]}")
+    # خط آخر stdout همون JSON است؛ بقیه لاگ‌های [retriever] و ...
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    out["process_sec"] = round(wall, 3)
+    return out
+
+
+def _median(rows: List[Dict[str, Any]], key: str) -> Optional[float]:
+    vals = [r[key] for r in rows if r.get(key) is not None]
+    return round(statistics.median(vals), 3) if vals else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="زمان import، warm-up و اولین جواب در پروسه‌ی تازه")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", default="warm,cold", help="warm و/یا cold با کاما")
+    # /chat/stream کل مسیر رو می‌ره (بازیابی + کش‌ها + مدل)؛ /chat فقط مدل
+    parser.add_argument("--endpoint", default="/chat/stream")
+    parser.add_argument("--message", default="چطور اولین مشتری‌هامو پیدا کنم؟")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", default=os.path.join("bench_results", "startup.json"))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="warm", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args)
+        return 0
+
+    report: Dict[str, Any] = {"endpoint": args.endpoint, "runs": args.runs, "modes": {}}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        rows = [_run_once(args, mode) for _ in range(max(1, args.runs))]
+        summary = {
+            key: _median(rows, key)
+            for key in ("process_sec", "import_sec", "warmup_sec", "first_request_ms", "first_answer_sec")
+        }
+        summary["ok"] = all(r["ok"] for r in rows)
+        report["modes"][mode] = {"median": summary, "runs": rows}
+        print(f"[bench_startup] {mode}: {summary}")
+
+    out_path = ROOT / args.out
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[bench_startup] wrote {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
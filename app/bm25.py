@@ -0,0 +1,142 @@
+# app/bm25.py
+# ایندکس معکوس BM25 برای جست‌وجوی لغوی فارسی
+#
+# postingها به شکل CSR ذخیره می‌شن (بدون dict پایتونی برای هر ترم):
+#   offsets[t] : offsets[t+1]  → بازه‌ی ترم t در doc_ids / tfs
+#   doc_ids    → int32
+#   tfs        → uint16
+# فقط vocab (ترم → شماره) یک dict پایتونیه. فایل ذخیره‌شده یک .npz ساده است.
+from __future__ import annotations
+import hashlib
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.embed_cache import chunk_hash
+from app.text_norm import tokenize
+
+
+def corpus_fingerprint(texts: Sequence[str]) -> str:
+    """شناسه‌ی محتوای corpus (ترتیب‌دار) تا ایندکس ذخیره‌شده فقط برای همون چانک‌ها استفاده بشه."""
+    return hashlib.sha1("".join(chunk_hash(t) for t in texts).encode("ascii")).hexdigest()
+
+
+class BM25Index:
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        fingerprint: str = "",
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.fingerprint = fingerprint
+        self.k1 = k1
+        self.b = b
+
+        self.n_docs = int(doc_len.shape[0])
+        self.avgdl = float(doc_len.mean()) if self.n_docs else 0.0
+        df = np.diff(offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    # ---------- ساخت ----------
+    @classmethod
+    def build(cls, texts: Sequence[str], fingerprint: str = "") -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_len = np.zeros((len(texts),), dtype=np.int32)
+
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(postings)
+                    postings.append([])
+                postings[term_id].append((doc_id, tf))
+
+        offsets = np.zeros((len(postings) + 1,), dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.empty((int(offsets[-1]),), dtype=np.int32)
+        tfs = np.empty((int(offsets[-1]),), dtype=np.uint16)
+        for term_id, plist in enumerate(postings):
+            start = offsets[term_id]
+            for j, (d, tf) in enumerate(plist):
+                doc_ids[start + j] = d
+                tfs[start + j] = min(tf, 65535)
+
+        return cls(vocab, offsets, doc_ids, tfs, doc_len, fingerprint=fingerprint)
+
+    # ---------- ذخیره / بارگذاری ----------
+    def save(self, path: str) -> None:
+        terms = sorted(self.vocab, key=self.vocab.__getitem__)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                tfs=self.tfs,
+                doc_len=self.doc_len,
+                fingerprint=np.frombuffer(self.fingerprint.encode("ascii"), dtype=np.uint8),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as z:
+            raw_terms = z["terms"].tobytes().decode("utf-8")
+            terms = raw_terms.split("\n") if raw_terms else []
+            return cls(
+                {t: i for i, t in enumerate(terms)},
+                z["offsets"],
+                z["doc_ids"],
+                z["tfs"],
+                z["doc_len"],
+                fingerprint=z["fingerprint"].tobytes().decode("ascii"),
+            )
+
+    # ---------- جست‌وجو ----------
+    def scores(self, query: str) -> np.ndarray:
+        """امتیاز BM25 همه‌ی سندها برای query (آرایه‌ی float32 به طول n_docs)."""
+        out = np.zeros((self.n_docs,), dtype=np.float32)
+        if self.n_docs == 0:
+            return out
+        norm_len = self.k1 * (1.0 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # هر سند حداکثر یک بار در posting یک ترم هست، پس += با fancy index امنه
+            out[docs] += self.idf[term_id] * tf * (self.k1 + 1.0) / (tf + norm_len[docs])
+        return out
+
+    def search(self, query: str, top_k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        خروجی (ids, scores) مرتب‌شده از بیشترین امتیاز؛ سندهای با امتیاز صفر برنمی‌گردن.
+        rows (آرایه‌ی مرتب) کاندیدها رو به یک زیرمجموعه محدود می‌کنه.
+        """
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        if candidates.size == 0 or top_k <= 0:
+            return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.float32)
+        cand_scores = scores[candidates]
+        if candidates.size > top_k:
+            part = np.argpartition(-cand_scores, top_k - 1)[:top_k]
+            candidates, cand_scores = candidates[part], cand_scores[part]
+        order = np.lexsort((candidates, -cand_scores))
+        return candidates[order], cand_scores[order]
@@ -0,0 +1,243 @@
+# app/chunk_store.py
+# انبار باینری چانک‌ها و متادیتا با mmap (به جای meta.json و لیست‌های پایتونی تو هر worker)
+#
+# قبلاً meta.json کل متن‌ها رو تو یک JSON داشت که هر worker کامل parse می‌کرد و به صورت
+# لیست رشته‌های پایتون نگه می‌داشت (N شیء str و dict برای هر process). اینجا:
+#
+#   chunks.json            → manifest کوچیک: تعداد، fingerprint، اسم فایل‌ها، جدول‌های lookup
+#                            (اسم منبع‌ها و متادیتاهای یکتا — معمولاً چند ده تا، نه N تا)
+#   text-<digest>.bin      → همه‌ی متن‌ها پشت سر هم (UTF-8)
+#   offsets-<digest>.bin   → int64 با طول N+1؛ متن i = blob[offsets[i]:offsets[i+1]]
+#   table-<digest>.bin     → جدول عرض‌ثابت (source, chunk_idx, meta) با int32، یک سطر برای هر چانک
+#
+# هر سه فایل با np.memmap باز می‌شن: گرفتن متن یک id فقط یک برش و decode است (O(1)، بدون
+# parse کل فایل) و همه‌ی worker ها صفحه‌های یکسان رو از page cache سیستم‌عامل می‌خونن.
+# texts / sources / metadatas نماهای lazy با رابط Sequence هستن، پس کدی که با idx["chunks"][i]
+# و len() کار می‌کرد دست نمی‌خوره.
+#
+# نوشتن جریانیه (ChunkStoreWriter.add) و atomic: فایل‌های داده با اسم موقت نوشته و بعد
+# rename می‌شن و manifest آخر از همه جایگزین می‌شه، مثل embed_cache.
+from __future__ import annotations
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.embed_cache import chunk_hash
+
+MANIFEST_NAME = "chunks.json"
+STORE_VERSION = 1
+TABLE_DTYPE = np.dtype([("source", "<i4"), ("chunk_idx", "<i4"), ("meta", "<i4")])
+_ROW = struct.Struct("<iii")
+_OFFSET = struct.Struct("<q")
+
+
+def split_source_label(label: str) -> Tuple[str, Optional[int]]:
+    """"file.txt[chunk:3]" → ("file.txt", 3)؛ برچسب بدون شماره‌ی چانک → (label, None)."""
+    name, sep, rest = label.rpartition("[chunk:")
+    if sep and rest.endswith("]") and rest[:-1].isdigit():
+        return name, int(rest[:-1])
+    return label, None
+
+
+def is_chunk_store(store_dir: str) -> bool:
+    return os.path.isfile(os.path.join(store_dir, MANIFEST_NAME))
+
+
+def _memmap(path: Path, dtype: Any, count: int) -> np.ndarray:
+    # np.memmap فایل خالی رو باز نمی‌کنه
+    if count == 0:
+        return np.zeros((0,), dtype=dtype)
+    # view به ndarray ساده: همون صفحه‌های mmap، بدون سربار زیرکلاس memmap روی هر دسترسی
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,)).view(np.ndarray)
+
+
+class _Column(Sequence):
+    """نمای lazy یک ستون انبار؛ عضوها موقع دسترسی ساخته می‌شن."""
+
+    def __init__(self, store: "ChunkStore", getter):
+        self._store = store
+        self._get = getter
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._get(int(i))
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield self._get(i)
+
+
+class ChunkStore:
+    def __init__(self, store_dir: str, manifest: Dict[str, Any]):
+        self.dir = Path(store_dir)
+        self.manifest = manifest
+        self.count = int(manifest["count"])
+        self.fingerprint: str = manifest["fingerprint"]
+        self.source_names: List[str] = manifest["sources"]
+        self.metadata_values: List[Dict[str, Any]] = manifest["metadatas"]
+        self.blob = _memmap(self.dir / manifest["text"], np.uint8, int(manifest["text_bytes"]))
+        self.offsets = _memmap(self.dir / manifest["offsets"], np.int64, self.count + 1 if self.count else 0)
+        self.table = _memmap(self.dir / manifest["table"], TABLE_DTYPE, self.count)
+        # ستون‌ها جدا (view، بدون کپی) تا دسترسی به یک سطر از مسیر کند structured array نگذره
+        self._source_col = self.table["source"]
+        self._chunk_col = self.table["chunk_idx"]
+        self._meta_col = self.table["meta"]
+
+        self.texts = _Column(self, self.text)
+        self.sources = _Column(self, self.source)
+        self.metadatas = _Column(self, self.metadata)
+
+    @classmethod
+    def open(cls, store_dir: str) -> "ChunkStore":
+        manifest = json.loads((Path(store_dir) / MANIFEST_NAME).read_text(encoding="utf-8"))
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"unsupported chunk store version {manifest.get('version')!r} in {store_dir}")
+        return cls(store_dir, manifest)
+
+    def __len__(self) -> int:
+        return self.count
+
+    # ---------- دسترسی O(1) ----------
+    def text(self, i: int) -> str:
+        start, end = self.offsets[i:i + 2].tolist()
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def source(self, i: int) -> str:
+        name = self.source_names[self._source_col[i]]
+        chunk_idx = int(self._chunk_col[i])
+        # chunk_idx منفی یعنی برچسب منبع از قبل کامل بوده (مثل "file.txt[chunk:3]" در retriever)
+        return name if chunk_idx < 0 else f"{name}[chunk:{chunk_idx}]"
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        # کپی تا دست‌کاری hit ها جدول مشترک رو خراب نکنه
+        return dict(self.metadata_values[self._meta_col[i]])
+
+    @property
+    def meta_ids(self) -> np.ndarray:
+        """ستون شماره‌ی متادیتا (اندیس در metadata_values)؛ برای ساخت فیلترها بدون ساختن N تا dict."""
+        return self._meta_col
+
+
+class ChunkStoreWriter:
+    """
+    with ChunkStoreWriter(dir) as w:
+        w.add(text, source, chunk_idx, metadata)
+    store = w.store   # انبار نهایی، باز با mmap
+    """
+
+    def __init__(self, store_dir: str, extra: Optional[Dict[str, Any]] = None):
+        self.dir = Path(store_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.extra = dict(extra or {})
+        self.store: Optional[ChunkStore] = None
+        self._source_ids: Dict[str, int] = {}
+        self._meta_ids: Dict[str, int] = {json.dumps({}): 0}
+        self._metas: List[Dict[str, Any]] = [{}]
+        self._count = 0
+        self._offset = 0
+        self._digest = hashlib.sha1()
+        self._fingerprint = hashlib.sha1()
+        self._tmp: Dict[str, Path] = {}
+        self._files: Dict[str, Any] = {}
+        for kind in ("text", "offsets", "table"):
+            fd, tmp = tempfile.mkstemp(dir=str(self.dir), prefix=f"{kind}-", suffix=".tmp")
+            self._tmp[kind] = Path(tmp)
+            self._files[kind] = os.fdopen(fd, "wb")
+        self._files["offsets"].write(_OFFSET.pack(0))
+
+    def add(
+        self,
+        text: str,
+        source: str,
+        chunk_idx: Optional[int] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        data = text.encode("utf-8")
+        self._files["text"].write(data)
+        self._offset += len(data)
+        self._files["offsets"].write(_OFFSET.pack(self._offset))
+
+        source_id = self._source_ids.setdefault(source, len(self._source_ids))
+        key = json.dumps(metadata or {}, ensure_ascii=False, sort_keys=True)
+        meta_id = self._meta_ids.get(key)
+        if meta_id is None:
+            meta_id = self._meta_ids[key] = len(self._metas)
+            self._metas.append(dict(metadata or {}))
+        self._files["table"].write(_ROW.pack(source_id, -1 if chunk_idx is None else chunk_idx, meta_id))
+
+        self._digest.update(data)
+        self._fingerprint.update(chunk_hash(text).encode("ascii"))
+        self._count += 1
+        return self._count - 1
+
+    def close(self) -> ChunkStore:
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        digest = self._digest.hexdigest()[:16]
+        names = {}
+        for kind, tmp in self._tmp.items():
+            names[kind] = f"{kind}-{digest}.bin"
+            os.replace(tmp, self.dir / names[kind])
+
+        manifest = {
+            "version": STORE_VERSION,
+            "count": self._count,
+            "text_bytes": self._offset,
+            # همون corpus_fingerprint در app/bm25 (sha1 پشت سر هم sha1 چانک‌ها)
+            "fingerprint": self._fingerprint.hexdigest(),
+            **names,
+            "sources": list(self._source_ids),
+            "metadatas": self._metas,
+            **self.extra,
+        }
+        fd, tmp = tempfile.mkstemp(dir=str(self.dir), prefix=MANIFEST_NAME, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+        os.replace(tmp, self.dir / MANIFEST_NAME)
+
+        # فایل‌های داده‌ی نسخه‌های قبلی (اگه پروسه‌ای mmapشون کرده باشه، روی لینوکس مشکلی نیست)
+        for kind, name in names.items():
+            for old in self.dir.glob(f"{kind}-*.bin"):
+                if old.name != name:
+                    try:
+                        old.unlink()
+                    except OSError:
+                        pass
+
+        self.store = ChunkStore.open(str(self.dir))
+        return self.store
+
+    def abort(self) -> None:
+        for f in self._files.values():
+            f.close()
+        for tmp in self._tmp.values():
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,285 @@
+# app/context_builder.py
+# ساخت کانتکست پرامپت با بودجه‌ی توکن (به جای چسبوندن همه‌ی تکه‌ها و کل تاریخچه)
+#
+# قبلاً _clean_context_blocks همه‌ی تکه‌های بازیابی‌شده + ۸ پیام آخر گفتگو رو بدون سقف
+# پشت هم می‌ذاشت؛ تو چت‌های طولانی پرامپت چند هزار توکن می‌شد (هزینه و time-to-first-token).
+# اینجا:
+# - توکن‌ها با tokenizer همون مدل شمرده می‌شن (tiktoken اگر نصب باشه، وگرنه تخمین کاراکتری)
+# - هر tier بودجه‌ی خودش رو داره؛ بخشی از بودجه مال تاریخچه است (از جدیدترین پیام به عقب)
+# - تکه‌های دانش به ترتیب امتیاز بازیابی وارد می‌شن و تکه‌های تقریباً تکراری حذف می‌شن
+# - تکه‌ای که کامل جا نشه، سر مرز جمله کوتاه می‌شه
+# - برای هر درخواست گزارش می‌ده چند توکن پرامپت صرفه‌جویی شد
+from __future__ import annotations
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from app.text_norm import normalize_text
+
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None
+
+
+CONTEXT_BUDGET_TOKENS = {
+    "cheap": int(os.getenv("CONTEXT_BUDGET_CHEAP_TOKENS", "600")),
+    "deep": int(os.getenv("CONTEXT_BUDGET_DEEP_TOKENS", "2000")),
+}
+# سهم تاریخچه‌ی گفتگو از بودجه (اگر مصرف نشه به تکه‌های دانش می‌رسه)
+CONTEXT_HISTORY_SHARE = float(os.getenv("CONTEXT_HISTORY_SHARE", "0.35"))
+CONTEXT_HISTORY_TURNS = int(os.getenv("CONTEXT_HISTORY_TURNS", "8"))
+# شباهت Jaccard شینگل‌های سه‌کلمه‌ای که بالاترش دو تکه تکراری حساب می‌شن
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+CONTEXT_LOG = os.getenv("CONTEXT_LOG", "0").strip() in ("1", "true", "yes")
+
+# از این کمتر جا مونده باشه، کوتاه کردن تکه‌ی بعدی ارزشی نداره
+_MIN_TRUNCATED_TOKENS = 24
+# بدون tiktoken: هر توکن تقریباً ۳ کاراکتر (فارسی و انگلیسی مخلوط)
+_APPROX_CHARS_PER_TOKEN = 3.0
+
+# هر دو الگوی قبلی (منبع و براکت) در یک پاس
+_STRIP_RE = re.compile(r"\(منبع:[^)]+\)|\[[^\]]+\]")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?؟…])\s+|\n+")
+_WORD_RE = re.compile(r"\w+")
+
+_HEADER = (
+    "یادداشت کمکی (سابقه گفتگو و دانش داخلی):\n"
+    "از این اطلاعات فقط برای اینکه بهتر و دقیق‌تر جواب بدی استفاده کن. "
+    "این متن رو مستقیم تکرار نکن مگر لازم باشد.\n\n"
+)
+_HISTORY_TITLE = "گفتگو تا این لحظه:\n"
+_ROLE_LABELS = {"user": "کاربر", "assistant": "منتور"}
+
+
+# ---------- شمارش توکن ----------
+@lru_cache(maxsize=16)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None
+    try:
+        # مدل ناشناخته (یا اسم سفارشی) → encoding خانواده‌ی gpt-4o
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def tokenizer_name(model: str = "") -> str:
+    enc = _encoding(model or "")
+    return f"tiktoken:{enc.name}" if enc is not None else "approx"
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    if not text:
+        return 0
+    enc = _encoding(model or "")
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / _APPROX_CHARS_PER_TOKEN))
+
+
+# ---------- کمکی‌ها ----------
+def _clean(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    return _STRIP_RE.sub("", text).strip()
+
+
+def _relevance(item: Any) -> Optional[float]:
+    # score (BM25 / RRF) بزرگ‌تر بهتره، distance کوچیک‌تر؛ متن خام امتیاز نداره
+    if not isinstance(item, dict):
+        return None
+    if item.get("score") is not None:
+        return float(item["score"])
+    if item.get("distance") is not None:
+        return -float(item["distance"])
+    return None
+
+
+def _shingles(text: str) -> Set[str]:
+    words = _WORD_RE.findall(normalize_text(text))
+    if len(words) < 3:
+        return set(words)
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _is_near_duplicate(sh: Set[str], kept: List[Set[str]], threshold: float) -> bool:
+    if not sh:
+        return False
+    for other in kept:
+        if not other:
+            continue
+        inter = len(sh & other)
+        if inter and inter / float(len(sh | other)) >= threshold:
+            return True
+    return False
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "") -> str:
+    """تا جایی که جا بشه جمله‌های کامل نگه می‌داره؛ اگر جمله‌ی اول هم جا نشه، خالی برمی‌گردونه."""
+    out: List[str] = []
+    used = 0
+    for sent in _SENTENCE_SPLIT_RE.split(text):
+        sent = sent.strip()
+        if not sent:
+            continue
+        n = count_tokens(sent, model)
+        if used + n > max_tokens:
+            break
+        out.append(sent)
+        used += n
+    return " ".join(out)
+
+
+def _fit(text: str, n_tokens: int, remaining: int, model: str) -> Optional[str]:
+    if n_tokens <= remaining:
+        return text
+    if remaining < _MIN_TRUNCATED_TOKENS:
+        return None
+    return truncate_to_tokens(text, remaining, model) or None
+
+
+# ---------- آمار کلی ----------
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "requests": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0,
+    "duplicates_dropped": 0, "blocks_truncated": 0, "blocks_dropped": 0,
+}
+
+
+def _record(report: Dict[str, Any]) -> None:
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["tokens_in"] += report["tokens_in"]
+        _stats["tokens_out"] += report["tokens_out"]
+        _stats["tokens_saved"] += report["tokens_saved"]
+        _stats["duplicates_dropped"] += report["duplicates"]
+        _stats["blocks_truncated"] += report["truncated"]
+        _stats["blocks_dropped"] += report["dropped"]
+    if CONTEXT_LOG:
+        print(
+            f"[context] tier={report['tier']} in={report['tokens_in']} out={report['tokens_out']} "
+            f"saved={report['tokens_saved']} dup={report['duplicates']} trunc={report['truncated']} "
+            f"drop={report['dropped']}"
+        )
+
+
+def context_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    out["tokenizer"] = "tiktoken" if tiktoken is not None else "approx"
+    out["budget_tokens"] = dict(CONTEXT_BUDGET_TOKENS)
+    out["history_share"] = CONTEXT_HISTORY_SHARE
+    return out
+
+
+# ---------- API ----------
+def assemble_context(
+    context: Optional[Sequence[Any]] = None,
+    history: Optional[Sequence[Dict[str, str]]] = None,
+    *,
+    tier: str = "deep",
+    model: str = "",
+    budget_tokens: Optional[int] = None,
+    history_share: float = CONTEXT_HISTORY_SHARE,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+) -> Dict[str, Any]:
+    """
+    context: تکه‌های دانش؛ یا hit های retriever (dict با text و score/distance) یا متن خام.
+             hit ها به ترتیب امتیاز مرتب می‌شن؛ متن خام (بدون امتیاز) با همون ترتیب، اول میاد.
+    history: پیام‌های گفتگو [{"role": "user"|"assistant", "content": ...}] به ترتیب زمانی.
+
+    خروجی dict:
+      text   → بلوک نهایی برای پرامپت ("" اگر چیزی نموند)
+      blocks → متن تکه‌های دانشی که وارد شدن (برای کلید کش معنایی)
+      report → tokens_in / tokens_out / tokens_saved و تعداد حذف/کوتاه‌شده‌ها
+    """
+    budget = CONTEXT_BUDGET_TOKENS.get(tier, CONTEXT_BUDGET_TOKENS["deep"]) if budget_tokens is None else budget_tokens
+    budget = max(0, int(budget))
+    report: Dict[str, Any] = {
+        "tier": tier,
+        "budget": budget,
+        "tokens_in": 0,
+        "tokens_out": 0,
+        "tokens_saved": 0,
+        "duplicates": 0,
+        "truncated": 0,
+        "dropped": 0,
+    }
+
+    # ۱) تاریخچه: از جدیدترین پیام به عقب، تا سهم خودش از بودجه
+    turns: List[str] = []
+    for turn in list(history or [])[-CONTEXT_HISTORY_TURNS:]:
+        content = (turn.get("content") or "").strip()
+        if content:
+            turns.append(f"{_ROLE_LABELS.get(turn.get('role', ''), 'کاربر')}: {content}")
+
+    history_budget = int(budget * history_share) if turns else 0
+    kept_turns: List[str] = []
+    used_history = 0
+    for line in reversed(turns):
+        n = count_tokens(line, model)
+        report["tokens_in"] += n
+        if used_history >= history_budget:
+            report["dropped"] += 1
+            continue
+        fitted = _fit(line, n, history_budget - used_history, model)
+        if fitted is None:
+            report["dropped"] += 1
+            continue
+        if fitted is not line:
+            report["truncated"] += 1
+            n = count_tokens(fitted, model)
+        kept_turns.append(fitted)
+        used_history += n
+    kept_turns.reverse()
+
+    # ۲) دانش: تمیز، مرتب بر اساس امتیاز، بدون تکراری، تا بقیه‌ی بودجه
+    candidates = []
+    for pos, item in enumerate(context or []):
+        text = _clean(item.get("text") if isinstance(item, dict) else item)
+        if text:
+            candidates.append((_relevance(item), pos, text))
+    candidates.sort(key=lambda c: (c[0] is not None, -(c[0] or 0.0), c[1]))
+
+    remaining = budget - used_history
+    kept_blocks: List[str] = []
+    kept_shingles: List[Set[str]] = []
+    for _, _, text in candidates:
+        n = count_tokens(text, model)
+        report["tokens_in"] += n
+        sh = _shingles(text)
+        if _is_near_duplicate(sh, kept_shingles, dedup_threshold):
+            report["duplicates"] += 1
+            continue
+        fitted = _fit(text, n, remaining, model) if remaining > 0 else None
+        if fitted is None:
+            report["dropped"] += 1
+            continue
+        if fitted is not text:
+            report["truncated"] += 1
+            n = count_tokens(fitted, model)
+        kept_blocks.append(fitted)
+        kept_shingles.append(sh)
+        remaining -= n
+
+    report["tokens_out"] = budget - remaining
+    report["tokens_saved"] = report["tokens_in"] - report["tokens_out"]
+    _record(report)
+
+    parts = list(kept_blocks)
+    if kept_turns:
+        parts.append(_HISTORY_TITLE + "\n".join(kept_turns))
+    text = ""
+    if parts:
+        text = _HEADER + "\n\n---\n\n".join(parts) + "\n"
+    return {"text": text, "blocks": kept_blocks, "report": report}
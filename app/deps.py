@@ -1,9 +1,13 @@
 # app/deps.py
 from functools import lru_cache
 import os
-from openai import OpenAI
+from typing import TYPE_CHECKING
+from .llm_client import get_client
 from .retriever import Retriever
 
+if TYPE_CHECKING:
+    from openai import OpenAI
+
 # ----------------------------
 # OpenAI (ChatGPT) configuration
 # ----------------------------
@@ -15,12 +19,13 @@ def get_retriever() -> Retriever:
     return Retriever()
 
 @lru_cache(maxsize=1)
-def get_openai_client() -> OpenAI:
+def get_openai_client() -> "OpenAI":
     # اگر OPENAI_API_KEY ست نباشه، SDK خودش خطای واضح می‌ده
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("Missing OPENAI_API_KEY. Set it before running the server.")
-    return OpenAI(api_key=api_key)
+    # کلاینت مشترک process (connection pool + keep-alive)
+    return get_client(api_key)
 
 def get_model_name(default: str = "gpt-4o-mini") -> str:
     return os.getenv("OPENAI_MODEL", default)
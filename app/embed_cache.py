@@ -0,0 +1,159 @@
+# app/embed_cache.py
+# کش دائمی امبدینگ چانک‌ها روی دیسک
+#
+# کلید هر سطر: (اسم مدل، sha1 متن چانک)
+# ساختار روی دیسک (برای هر مدل یک پوشه):
+#   manifest.json          → {"model", "dim", "vectors", "hashes": [...]}
+#   vectors-<digest>.npy   → ماتریس float32 با شکل (N, dim)، به ترتیب hashes
+#
+# موقع بالا اومدن پروسه، اگر همه‌ی چانک‌ها تو کش باشن فقط یک np.load(mmap_mode="r")
+# انجام می‌شه و مدل امبدینگ اصلاً لود نمی‌شه. فقط چانک‌های جدید/تغییرکرده encode می‌شن.
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+
+
+def _atomic_write_bytes(path: Path, writer: Callable[[object], None]) -> None:
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer(f)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class EmbeddingCache:
+    """
+    کش امبدینگ محتوا-محور برای یک مدل مشخص.
+    نوشتن‌ها atomic هستن (فایل موقت + os.replace) تا چند worker هم‌زمان
+    هیچ‌وقت manifest و ماتریس ناهمخوان نبینن.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str):
+        self.model_name = model_name
+        self.dir = Path(cache_dir) / _model_slug(model_name)
+
+    # ---------- خواندن ----------
+    def _load(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        manifest_path = self.dir / MANIFEST_NAME
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            if manifest.get("model") != self.model_name:
+                return [], None
+            vectors = np.load(self.dir / manifest["vectors"], mmap_mode="r")
+            hashes = list(manifest["hashes"])
+            if vectors.ndim != 2 or vectors.shape[0] != len(hashes):
+                return [], None
+            return hashes, vectors
+        except FileNotFoundError:
+            return [], None
+        except Exception as e:
+            print(f"[embed_cache] ignoring unreadable cache in {self.dir}: {e}")
+            return [], None
+
+    # ---------- نوشتن ----------
+    def _store(self, hashes: List[str], vectors: np.ndarray) -> np.ndarray:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha1("".join(hashes).encode("ascii")).hexdigest()[:16]
+        vectors_name = f"vectors-{digest}.npy"
+        vectors_path = self.dir / vectors_name
+
+        if not vectors_path.exists():
+            _atomic_write_bytes(vectors_path, lambda f: np.save(f, np.ascontiguousarray(vectors, dtype="float32")))
+
+        manifest = {
+            "model": self.model_name,
+            "dim": int(vectors.shape[1]),
+            "vectors": vectors_name,
+            "hashes": hashes,
+        }
+        _atomic_write_bytes(
+            self.dir / MANIFEST_NAME,
+            lambda f: f.write(json.dumps(manifest, ensure_ascii=False).encode("utf-8")),
+        )
+
+        # فایل‌های ماتریس قدیمی رو پاک می‌کنیم (اگه پروسه‌ای mmapشون کرده باشه، روی لینوکس مشکلی نیست)
+        for old in self.dir.glob("vectors-*.npy"):
+            if old.name != vectors_name:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+        return np.load(vectors_path, mmap_mode="r")
+
+    # ---------- API اصلی ----------
+    def get_or_encode(
+        self,
+        texts: Sequence[str],
+        encode: Callable[[List[str]], np.ndarray],
+    ) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        امبدینگ همه‌ی texts رو به همون ترتیب برمی‌گردونه.
+        encode فقط برای متن‌هایی صدا زده می‌شه که تو کش نیستن.
+        خروجی دوم آمار کاره: {"cached": ..., "encoded": ...}
+        """
+        hashes = [chunk_hash(t) for t in texts]
+        old_hashes, old_vectors = self._load()
+
+        if old_vectors is not None and old_hashes == hashes:
+            return old_vectors, {"cached": len(hashes), "encoded": 0}
+
+        pos: Dict[str, int] = {h: i for i, h in enumerate(old_hashes)}
+
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in pos and h not in missing:
+                missing[h] = t
+
+        new_pos: Dict[str, int] = {}
+        new_vectors = None
+        if missing:
+            new_vectors = np.asarray(encode(list(missing.values())), dtype="float32")
+            new_pos = {h: i for i, h in enumerate(missing.keys())}
+
+        if old_vectors is not None:
+            dim = old_vectors.shape[1]
+        elif new_vectors is not None:
+            dim = new_vectors.shape[1]
+        else:
+            return np.zeros((0, 0), dtype="float32"), {"cached": 0, "encoded": 0}
+
+        out = np.empty((len(hashes), dim), dtype="float32")
+        for row, h in enumerate(hashes):
+            if h in new_pos:
+                out[row] = new_vectors[new_pos[h]]
+            else:
+                out[row] = old_vectors[pos[h]]
+
+        # کش رو به ترتیب فعلی چانک‌ها بازنویسی می‌کنیم تا دفعه‌ی بعد مستقیم mmap بشه
+        try:
+            out = self._store(hashes, out)
+        except Exception as e:
+            print(f"[embed_cache] could not persist cache to {self.dir}: {e}")
+
+        cached = sum(1 for h in hashes if h in pos)
+        return out, {"cached": cached, "encoded": len(missing)}
@@ -0,0 +1,193 @@
+# app/encoder.py
+# encoder مشترک با micro-batching برای کوئری‌ها
+#
+# هر درخواست /chat قبلاً جدا model.encode([query]) صدا می‌زد؛ یعنی زیر بار هم‌زمان،
+# کلی forward pass با batch=1 و threadهای torch که سر CPU با هم دعوا می‌کنن.
+# اینجا یک thread واحد کوئری‌هایی رو که در یک پنجره‌ی کوتاه (مثلاً ۳ms) یا تا سقف
+# max_batch می‌رسن جمع می‌کنه، با یک encode می‌فرسته و بردار هر کس رو بهش برمی‌گردونه.
+# QueryEmbeddingCache هم جلوی همین encoder می‌شینه تا کوئری‌های تکراری اصلاً encode نشن.
+from __future__ import annotations
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.text_norm import normalize_text
+
+
+class BatchingEncoder:
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        window_ms: float = 3.0,
+        max_batch: int = 32,
+        torch_threads: Optional[int] = None,
+    ):
+        self._encode_fn = encode_fn
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.torch_threads = torch_threads
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._items = 0
+        self._batches = 0
+        self._errors = 0
+
+    # ---------- API ----------
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """بردار یک متن؛ تا وقتی batch مربوطه encode بشه بلاک می‌کنه."""
+        return self.submit(text).result(timeout=timeout)
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window_s * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "max_batch_size_seen": max(self._batch_sizes) if self._batch_sizes else 0,
+                # {اندازه‌ی batch: تعداد دفعات}
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+            }
+
+    # ---------- worker ----------
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # پنجره تموم شده؛ فقط چیزهایی که همین الان تو صف هستن رو برمی‌داریم
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        if self.torch_threads:
+            try:
+                import torch  # type: ignore
+                torch.set_num_threads(int(self.torch_threads))
+            except Exception:
+                pass
+
+        while True:
+            batch = self._collect()
+            # کسایی که قبل از شروع cancel شدن رو کنار می‌ذاریم
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [t for t, _ in batch]
+            try:
+                vectors = self._encode_fn(texts)
+            except BaseException as e:
+                with self._stats_lock:
+                    self._errors += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+            for i, (_, fut) in enumerate(batch):
+                fut.set_result(vectors[i])
+
+
+class QueryEmbeddingCache:
+    """
+    LRU محدود (اندازه و TTL) از متن کوئری → بردار، جلوی encoder.
+    کلید متن نرمال‌شده است (فاصله‌ها، نیم‌فاصله، ی/ک عربی و اعراب یکسان می‌شن)،
+    پس "اصول  مذاكره" و "اصول مذاکره" یک ورودی هستن.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_sec: float = 3600.0):
+        self.max_size = max(0, int(max_size))
+        self.ttl_sec = float(ttl_sec)
+        self._data: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return normalize_text(text)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        if self.max_size == 0:
+            return None
+        k = self.key(text)
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(k)
+            if item is not None and (self.ttl_sec <= 0 or now - item[0] <= self.ttl_sec):
+                self._data.move_to_end(k)
+                self._hits += 1
+                return item[1]
+            if item is not None:
+                # منقضی شده
+                del self._data[k]
+                self._evictions += 1
+            self._misses += 1
+            return None
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        if self.max_size == 0:
+            return
+        vec = np.array(vector, dtype=np.float32, copy=True)
+        vec.setflags(write=False)
+        k = self.key(text)
+        with self._lock:
+            self._data[k] = (time.monotonic(), vec)
+            self._data.move_to_end(k)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_sec": self.ttl_sec,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": (self._hits / total) if total else 0.0,
+            }
@@ -0,0 +1,73 @@
+# app/executor.py
+# executor محدود برای کارهای CPU-bound / بلاک‌کننده (embedding، جست‌وجو، SQLite) از داخل کد async
+#
+# run_in_executor پیش‌فرض صف بی‌انتها داره؛ زیر بار سنگین هزاران کار منتظر جمع می‌شن و
+# latency همه بالا می‌ره. اینجا تعداد threadها ثابته و تعداد کارهای در جریان (در حال اجرا +
+# در صف) هم سقف داره؛ اگر پر باشه، coroutine صدازننده await می‌کنه (backpressure) تا جا باز بشه.
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+EXECUTOR_WORKERS = int(os.getenv("APP_EXECUTOR_WORKERS", str(min(8, (os.cpu_count() or 2)))))
+EXECUTOR_MAX_PENDING = int(os.getenv("APP_EXECUTOR_MAX_PENDING", "256"))
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_pending: int, name: str = "app-cpu"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        # asyncio.Semaphore به loop بسته است؛ برای هر loop یکی
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._waited = 0
+
+    def _sem(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sem = self._sems.get(loop)
+            if sem is None:
+                sem = self._sems[loop] = asyncio.Semaphore(self.max_pending)
+            return sem
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        sem = self._sem()
+        if sem.locked():
+            with self._lock:
+                self._waited += 1
+        async with sem:
+            with self._lock:
+                self._in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "waited_for_slot": self._waited,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_executor() -> BoundedExecutor:
+    return BoundedExecutor(EXECUTOR_WORKERS, EXECUTOR_MAX_PENDING)
@@ -0,0 +1,271 @@
+# app/faiss_backend.py
+# سرو کردن retriever از روی artifactی که ingest/build_faiss.py می‌سازه
+#
+# artifact:
+#   faiss_index/index.faiss   → ایندکس FAISS (flat / ivf_flat / ivf_pq / hnsw)
+#   faiss_index/chunks.json   → manifest انبار باینری چانک‌ها (app/chunk_store) + فایل‌های *.bin کنارش
+#   faiss_index/meta.json     → فرمت قدیمی: {"texts": [...], "sources": [{"source", "chunk_idx", "metadata"?}, ...]}
+#                                (فقط اگر chunks.json نباشه خونده می‌شه)
+#
+# ایندکس و انبار چانک‌ها هر دو با mmap خونده می‌شن تا چند worker صفحه‌های یکسان رو از page cache
+# سیستم‌عامل به اشتراک بذارن. nprobe / efSearch برای هر کوئری جدا قابل تنظیمه (بدون تغییر state مشترک).
+from __future__ import annotations
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.chunk_store import MANIFEST_NAME as STORE_FILE, ChunkStore
+
+
+@lru_cache(maxsize=1)
+def load_faiss():
+    # import تنبل: backend پیش‌فرض (numpy) هیچ‌وقت faiss رو لود نمی‌کنه
+    try:
+        import faiss  # type: ignore
+        return faiss
+    except Exception:
+        return None
+
+
+INDEX_FILE = "index.faiss"
+META_FILE = "meta.json"
+
+# پیش‌فرض‌های جست‌وجو (برای هر کوئری هم قابل override هستن)
+DEFAULT_NPROBE = int(os.getenv("FAISS_NPROBE", "8"))
+DEFAULT_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+# جست‌وجوی فیلترشده روی IVF / HNSW:
+# - اگر سهم سطرهای مجاز از کل ایندکس کمتر از این کسر باشه، مستقیم همون سطرها دقیق امتیاز می‌گیرن
+#   (هزینه با اندازه‌ی زیرمجموعه متناسبه، نه کل ایندکس)
+# - وگرنه با IDSelector و k چند برابر جست‌وجو می‌شه و کوئری‌هایی که کمتر از k نتیجه گرفتن
+#   از مسیر دقیق کامل می‌شن
+FAISS_FILTER_EXACT_FRACTION = float(os.getenv("FAISS_FILTER_EXACT_FRACTION", "0.05"))
+FAISS_FILTER_OVERSAMPLE = max(1, int(os.getenv("FAISS_FILTER_OVERSAMPLE", "2")))
+# بلاک بازسازی بردارها موقع حساب کردن نرم سطرها
+_NORM_BLOCK_ROWS = 65536
+
+_subset_lock = threading.Lock()
+
+
+def artifact_paths(index_dir: str) -> Tuple[str, str]:
+    """(مسیر ایندکس، مسیر manifest چانک‌ها)؛ اگر انبار باینری نباشه meta.json قدیمی."""
+    store_path = os.path.join(index_dir, STORE_FILE)
+    if not os.path.isfile(store_path) and os.path.isfile(os.path.join(index_dir, META_FILE)):
+        return os.path.join(index_dir, INDEX_FILE), os.path.join(index_dir, META_FILE)
+    return os.path.join(index_dir, INDEX_FILE), store_path
+
+
+def is_available(index_dir: str) -> bool:
+    index_path, meta_path = artifact_paths(index_dir)
+    return os.path.isfile(index_path) and os.path.isfile(meta_path) and load_faiss() is not None
+
+
+def remove_legacy_meta(index_dir: str) -> None:
+    """meta.json قدیمی بعد از نوشتن انبار چانک‌ها دیگه خونده نمی‌شه؛ پاکش می‌کنیم تا گیج‌کننده نباشه."""
+    try:
+        os.remove(os.path.join(index_dir, META_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def _read_index(path: str):
+    faiss = load_faiss()
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        # بعضی نوع‌های ایندکس mmap رو ساپورت نمی‌کنن؛ در این صورت معمولی می‌خونیم
+        return faiss.read_index(path)
+
+
+def load_index(index_dir: str) -> Dict[str, Any]:
+    """
+    خروجی:
+    {
+        "chunks": [...], "sources": ["file.txt[chunk:0]", ...], "metadatas": [{...}, ...],
+        "faiss": faiss.Index, "metric": "ip" | "l2",
+        "store": ChunkStore | None, "fingerprint": corpus_fingerprint چانک‌ها | None
+    }
+    با انبار باینری، chunks / sources / metadatas نماهای lazy روی mmap هستن (Sequence)، نه لیست.
+    """
+    faiss = load_faiss()
+    if faiss is None:
+        raise RuntimeError("faiss package not available in this environment")
+
+    index_path, meta_path = artifact_paths(index_dir)
+    index = _read_index(index_path)
+    if meta_path.endswith(STORE_FILE):
+        store = ChunkStore.open(index_dir)
+        idx: Dict[str, Any] = {
+            "chunks": store.texts,
+            "sources": store.sources,
+            "metadatas": store.metadatas,
+            "store": store,
+            "fingerprint": store.fingerprint,
+        }
+    else:
+        idx = _load_legacy_meta(meta_path)
+
+    if index.ntotal != len(idx["chunks"]) or len(idx["sources"]) != len(idx["chunks"]):
+        raise RuntimeError(
+            f"faiss artifact mismatch: index has {index.ntotal} vectors, meta has {len(idx['chunks'])} texts"
+        )
+
+    idx["faiss"] = index
+    idx["metric"] = "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+    return idx
+
+
+def _load_legacy_meta(meta_path: str) -> Dict[str, Any]:
+    # artifactهای قدیمی build_faiss (قبل از chunk_store): کل meta.json parse می‌شه
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    chunks = list(meta.get("texts", []))
+    sources = [
+        f"{s.get('source', '')}[chunk:{s.get('chunk_idx', i)}]" if isinstance(s, dict) else str(s)
+        for i, s in enumerate(meta.get("sources", []))
+    ]
+    metadatas = [
+        (s.get("metadata") or {}) if isinstance(s, dict) else {}
+        for s in meta.get("sources", [])
+    ]
+    return {"chunks": chunks, "sources": sources, "metadatas": metadatas, "store": None, "fingerprint": None}
+
+
+def _search_params(index, nprobe: Optional[int], ef_search: Optional[int], sel=None):
+    faiss = load_faiss()
+    extra = {} if sel is None else {"sel": sel}
+    if faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or DEFAULT_NPROBE), **extra)
+    if hasattr(faiss.downcast_index(index), "hnsw"):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or DEFAULT_EF_SEARCH), **extra)
+    if sel is not None:
+        return faiss.SearchParameters(**extra)
+    return None
+
+
+def _to_distances(idx: Dict[str, Any], scores: np.ndarray) -> np.ndarray:
+    scores = scores.astype(np.float64)
+    if idx["metric"] == "ip":
+        return 1.0 - scores
+    # برای بردارهای نرمال: ||a-b||² = 2 - 2cos  →  1 - cos = ||a-b||² / 2
+    return scores / 2.0
+
+
+def _prepare_subset(idx: Dict[str, Any]) -> None:
+    """
+    بازسازی بردار سطرها رو ممکن می‌کنه (یک بار برای هر ایندکس): IVF برای reconstruct به direct map
+    نیاز داره. برای متریک L2 نرم سطرها هم یک بار حساب و نگه داشته می‌شن.
+    """
+    if idx.get("subset_ready"):
+        return
+    faiss = load_faiss()
+    index = idx["faiss"]
+    with _subset_lock:
+        if idx.get("subset_ready"):
+            return
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+        if idx["metric"] != "ip":
+            norms = np.empty((index.ntotal,), dtype=np.float32)
+            for start in range(0, index.ntotal, _NORM_BLOCK_ROWS):
+                block = index.reconstruct_n(start, min(_NORM_BLOCK_ROWS, index.ntotal - start))
+                norms[start:start + block.shape[0]] = (block * block).sum(axis=1)
+            idx["row_sq_norms"] = norms
+        idx["subset_ready"] = True
+
+
+def _search_subset(
+    idx: Dict[str, Any],
+    q: np.ndarray,
+    top_k: int,
+    rows: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    امتیاز دقیق فقط برای سطرهای rows (بردارها از خود ایندکس بازسازی می‌شن؛ روی IVF-PQ همون
+    بردار decode‌شده). خروجی (distances, ids) با شکل (m, min(top_k, len(rows))).
+    """
+    _prepare_subset(idx)
+    ids = rows.astype(np.int64)
+    vecs = idx["faiss"].reconstruct_batch(ids)
+    sims = (q @ vecs.T).astype(np.float64)
+    if idx["metric"] == "ip":
+        distances = 1.0 - sims
+    else:
+        # ||q-v||² = ||q||² + ||v||² - 2q·v ؛ بدون آرایه‌ی موقت (m, r, d)
+        q_norms = (q.astype(np.float64) ** 2).sum(axis=1)
+        v_norms = idx["row_sq_norms"][ids].astype(np.float64)
+        distances = np.maximum(q_norms[:, None] + v_norms[None, :] - 2.0 * sims, 0.0) / 2.0
+    k = min(top_k, rows.size)
+    if k < rows.size:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(rows.size), (distances.shape[0], 1))
+    order = np.argsort(np.take_along_axis(distances, part, axis=1), axis=1, kind="stable")
+    part = np.take_along_axis(part, order, axis=1)
+    return np.take_along_axis(distances, part, axis=1), ids[part]
+
+
+def _search_selected(
+    idx: Dict[str, Any],
+    q: np.ndarray,
+    top_k: int,
+    rows: np.ndarray,
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    faiss = load_faiss()
+    index = idx["faiss"]
+    k = max(1, min(top_k, rows.size))
+    fetch = min(rows.size, k * FAISS_FILTER_OVERSAMPLE)
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(rows, dtype=np.int64))
+    ef = max(int(ef_search or DEFAULT_EF_SEARCH), fetch)
+    scores, ids = index.search(q, fetch, params=_search_params(index, nprobe, ef, sel=sel))
+    distances, ids = _to_distances(idx, scores)[:, :k], ids[:, :k]
+    # IVF (nprobe کم) و HNSW زیر فیلتر تنگ ممکنه کمتر از k سطر مجاز پیدا کنن
+    short = np.flatnonzero((ids < 0).any(axis=1))
+    if short.size:
+        distances[short], ids[short] = _search_subset(idx, q[short], k, rows)
+    return distances, ids
+
+
+def search(
+    idx: Dict[str, Any],
+    q_embs: np.ndarray,
+    top_k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    q_embs باید نرمال‌شده باشه. خروجی (distances, ids) با شکل (m, top_k)؛
+    distance همون 1 - cosine است و ids نامعتبر -1 هستن.
+    rows (شماره‌سطرهای مجاز بعد از فیلتر) جست‌وجو رو به همون زیرمجموعه محدود می‌کنه:
+    روی flat، یا وقتی فیلتر تنگ‌تر از FAISS_FILTER_EXACT_FRACTION باشه، فقط همون بردارها امتیاز
+    می‌گیرن؛ وگرنه IVF / HNSW با IDSelector و oversample جست‌وجو می‌کنن.
+    """
+    faiss = load_faiss()
+    index = idx["faiss"]
+    q = np.ascontiguousarray(q_embs, dtype="float32")
+    if rows is not None:
+        if rows.size == 0:
+            return np.zeros((q.shape[0], 0), dtype=np.float64), np.zeros((q.shape[0], 0), dtype=np.int64)
+        if (
+            isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+            or rows.size <= FAISS_FILTER_EXACT_FRACTION * index.ntotal
+        ):
+            return _search_subset(idx, q, top_k, rows)
+        return _search_selected(idx, q, top_k, rows, nprobe, ef_search)
+
+    k = max(1, min(top_k, index.ntotal))
+    params = _search_params(index, nprobe, ef_search)
+    if params is not None:
+        scores, ids = index.search(q, k, params=params)
+    else:
+        scores, ids = index.search(q, k)
+    return _to_distances(idx, scores), ids
@@ -0,0 +1,177 @@
+# app/fake_llm.py
+# provider جایگزین محلی (بدون شبکه و بدون خرج quota) برای تست بار و توسعه
+#
+# با MODEL_PROVIDER=fake فعال می‌شه و همون رابط provider های generator رو داره
+# (complete / acomplete / stream / astream). رفتارش با env تنظیم می‌شه:
+#   FAKE_LLM_LATENCY           → توزیع تأخیر تا اولین توکن (میلی‌ثانیه):
+#                                fixed:300 | uniform:100:500 | normal:300:50 | lognormal:300:0.5
+#                                (lognormal: میانه و sigma؛ دُم بلند مثل API واقعی)
+#   FAKE_LLM_TOKENS_PER_SEC    → سرعت تولید توکن بعد از اولین توکن
+#   FAKE_LLM_OUTPUT_TOKENS     → طول جواب (سقفش max_tokens درخواسته)
+#   FAKE_LLM_ERROR_RATE        → احتمال خطا قبل از اولین توکن (مثل 429 / 5xx)
+#   FAKE_LLM_STREAM_ERROR_RATE → احتمال قطع شدن وسط استریم
+#   FAKE_LLM_SEED              → برای تکرارپذیری
+from __future__ import annotations
+import asyncio
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+# خطای تزریقی قبل از اولین توکن زودتر از تأخیر کامل برمی‌گرده (مثل 429 واقعی)
+_ERROR_DELAY_SEC = 0.05
+_WORD_RE = re.compile(r"\w+")
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """رشته‌ی توزیع (میلی‌ثانیه) → تابعی که یک نمونه‌ی تأخیر به ثانیه برمی‌گردونه."""
+    kind, _, rest = (spec or "fixed:0").strip().lower().partition(":")
+    try:
+        args = [float(x) for x in rest.split(":") if x != ""]
+    except ValueError:
+        raise ValueError(f"bad latency spec: {spec!r}")
+
+    def _need(n: int) -> None:
+        if len(args) != n:
+            raise ValueError(f"latency spec {kind!r} needs {n} numbers: {spec!r}")
+
+    if kind == "fixed":
+        _need(1)
+        return lambda rng: args[0] / 1000.0
+    if kind == "uniform":
+        _need(2)
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000.0
+    if kind == "normal":
+        _need(2)
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000.0
+    if kind == "lognormal":
+        _need(2)
+        mu = math.log(max(args[0], 1e-3))
+        return lambda rng: rng.lognormvariate(mu, args[1]) / 1000.0
+    raise ValueError(f"unknown latency distribution: {kind!r}")
+
+
+class FakeLLM:
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: str = "lognormal:400:0.4",
+        tokens_per_sec: float = 40.0,
+        output_tokens: int = 120,
+        error_rate: float = 0.0,
+        stream_error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency_spec = latency
+        self._latency = parse_latency(latency)
+        self.tokens_per_sec = max(0.0, float(tokens_per_sec))
+        self.output_tokens = max(1, int(output_tokens))
+        self.error_rate = float(error_rate)
+        self.stream_error_rate = float(stream_error_rate)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"calls": 0, "errors": 0, "stream_errors": 0, "tokens": 0}
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        seed = os.getenv("FAKE_LLM_SEED", "").strip()
+        return cls(
+            latency=os.getenv("FAKE_LLM_LATENCY", "lognormal:400:0.4"),
+            tokens_per_sec=float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "40")),
+            output_tokens=int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "120")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            stream_error_rate=float(os.getenv("FAKE_LLM_STREAM_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    # ---------- برنامه‌ی هر فراخوانی ----------
+    def _draw(self, prompt: str, max_tokens: int, streaming: bool) -> Tuple[float, List[str], bool, int]:
+        """(تأخیر اولین توکن، توکن‌ها، خطا قبل از شروع؟، اندیس قطع استریم یا -1)"""
+        with self._lock:
+            self._stats["calls"] += 1
+            ttft = self._latency(self._rng)
+            fail = self._rng.random() < self.error_rate
+            n = max(1, min(self.output_tokens, int(max_tokens or self.output_tokens)))
+            cut = -1
+            if streaming and not fail and self._rng.random() < self.stream_error_rate:
+                cut = self._rng.randrange(n)
+            if fail:
+                self._stats["errors"] += 1
+            elif cut >= 0:
+                self._stats["stream_errors"] += 1
+                self._stats["tokens"] += cut
+            else:
+                self._stats["tokens"] += n
+        words = _WORD_RE.findall(prompt)[-32:] or ["پاسخ"]
+        tokens = ["(پاسخ آزمایشی)"] + [words[i % len(words)] for i in range(n - 1)]
+        return ttft, tokens, fail, cut
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    # ---------- رابط provider ----------
+    def ready(self, api_key: str) -> bool:
+        return True
+
+    def complete(self, *, prompt: str, max_tokens: int, **_: Any) -> str:
+        ttft, tokens, fail, _cut = self._draw(prompt, max_tokens, streaming=False)
+        if fail:
+            time.sleep(min(ttft, _ERROR_DELAY_SEC))
+            raise FakeLLMError("fake provider: injected error")
+        time.sleep(ttft + (len(tokens) - 1) * self._token_delay())
+        return " ".join(tokens)
+
+    async def acomplete(self, *, prompt: str, max_tokens: int, **_: Any) -> str:
+        ttft, tokens, fail, _cut = self._draw(prompt, max_tokens, streaming=False)
+        if fail:
+            await asyncio.sleep(min(ttft, _ERROR_DELAY_SEC))
+            raise FakeLLMError("fake provider: injected error")
+        await asyncio.sleep(ttft + (len(tokens) - 1) * self._token_delay())
+        return " ".join(tokens)
+
+    def stream(self, *, prompt: str, max_tokens: int, **_: Any) -> Iterator[str]:
+        ttft, tokens, fail, cut = self._draw(prompt, max_tokens, streaming=True)
+        if fail:
+            time.sleep(min(ttft, _ERROR_DELAY_SEC))
+            raise FakeLLMError("fake provider: injected error")
+        time.sleep(ttft)
+        delay = self._token_delay()
+        for i, tok in enumerate(tokens):
+            if i == cut:
+                raise FakeLLMError("fake provider: injected stream cut")
+            if i:
+                time.sleep(delay)
+            yield tok if i == 0 else " " + tok
+
+    async def astream(self, *, prompt: str, max_tokens: int, **_: Any) -> AsyncIterator[str]:
+        ttft, tokens, fail, cut = self._draw(prompt, max_tokens, streaming=True)
+        if fail:
+            await asyncio.sleep(min(ttft, _ERROR_DELAY_SEC))
+            raise FakeLLMError("fake provider: injected error")
+        await asyncio.sleep(ttft)
+        delay = self._token_delay()
+        for i, tok in enumerate(tokens):
+            if i == cut:
+                raise FakeLLMError("fake provider: injected stream cut")
+            if i:
+                await asyncio.sleep(delay)
+            yield tok if i == 0 else " " + tok
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+        out.update({
+            "latency": self.latency_spec,
+            "tokens_per_sec": self.tokens_per_sec,
+            "error_rate": self.error_rate,
+            "stream_error_rate": self.stream_error_rate,
+        })
+        return out
@@ -13,22 +13,27 @@ generator.py - Cost-Tiered LLM Routing
 ورودی اصلی از ui/web می‌آد:
     generate_answer(query=user_text, context=full_context, ...)
 
-context ترکیبیه از:
-- تکه‌های دانش داخلی (retriever)
-- خلاصه ۶ پیام آخر مکالمه ("گفتگو تا اینجا: ...")
+context: تکه‌های دانش داخلی (hit های retriever با امتیاز، یا متن خام)
+history: پیام‌های آخر مکالمه [{"role", "content"}]
+هر دو با app/context_builder در بودجه‌ی توکن همون tier جمع می‌شن.
 
 خروجی باید یک متن محاوره‌ای و یک‌تکه باشه.
 """
 
-import os, json, re
+import os, re, threading, time
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from types import MappingProxyType
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, Mapping, Optional, List
 
-try:
-    # OpenAI SDK جدید
-    from openai import OpenAI  # type: ignore
-except Exception:
-    OpenAI = None
+from app.answer_cache import AnswerCache, cache_key as _hash_key
+from app.context_builder import assemble_context
+from app.semantic_cache import SemanticCache, context_keys
+from app.singleflight import get_flight
+from app.tier_router import get_tier_router, log_decision
+
+from app import llm_client
+from app.executor import get_executor
 
 
 # -------------------------------------------------
@@ -48,14 +53,19 @@ def _read_secret_or_env(key: str, default: str = "") -> str:
     return os.getenv(key, default)
 
 
-def load_settings() -> Dict[str, Any]:
-    """
-    برمی‌گردونه تنظیمات runtime شامل مدل‌ها، api key و مسیر کش.
-    """
+def _semantic_cache_enabled(value: str) -> bool:
+    value = value.strip().lower()
+    if value == "auto":
+        return os.getenv("RETRIEVER_MODE", "dense").strip().lower() != "lexical"
+    return value not in ("0", "false", "no")
+
+
+def _build_settings() -> Dict[str, Any]:
     base_dir = Path(__file__).resolve().parents[1]
     data_dir = base_dir / "data"
     data_dir.mkdir(parents=True, exist_ok=True)
     cache_path = data_dir / "cache.json"
+    answer_cache_path = data_dir / "answer_cache.sqlite3"
 
     return {
         "MODEL_PROVIDER": _read_secret_or_env("MODEL_PROVIDER", "openai").strip().lower(),
@@ -71,29 +81,124 @@ def load_settings() -> Dict[str, Any]:
         # برای سازگاری با نسخه‌های قبلی (HuggingFace و ...)، اینجا فقط نگه داشته شده:
         "HF_TOKEN": _read_secret_or_env("HF_TOKEN", ""),
 
-        # مسیر کش برای کاهش هزینه سؤالات تکراری
+        # کش قدیمی JSON؛ فقط یک بار به کش SQLite منتقل می‌شه
         "CACHE_PATH": str(cache_path),
+
+        # کش پاسخ‌ها برای کاهش هزینه سؤالات تکراری (SQLite در حالت WAL، امن برای چند worker)
+        "ANSWER_CACHE_PATH": _read_secret_or_env("ANSWER_CACHE_PATH", str(answer_cache_path)),
+        "ANSWER_CACHE_MAX_ENTRIES": int(_read_secret_or_env("ANSWER_CACHE_MAX_ENTRIES", "10000")),
+        "ANSWER_CACHE_TTL_SEC": float(_read_secret_or_env("ANSWER_CACHE_TTL_SEC", str(30 * 24 * 3600))),
+
+        # کش معنایی: سؤال‌های هم‌معنی با کانتکست مشابه جواب قبلی رو می‌گیرن.
+        # auto یعنی روشن، جز با RETRIEVER_MODE=lexical (اونجا مدل MiniLM اصلاً نباید لود بشه)
+        "SEMANTIC_CACHE_ENABLED": _semantic_cache_enabled(_read_secret_or_env("SEMANTIC_CACHE_ENABLED", "auto")),
+        "SEMANTIC_CACHE_THRESHOLD": float(_read_secret_or_env("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        "SEMANTIC_CACHE_MIN_OVERLAP": float(_read_secret_or_env("SEMANTIC_CACHE_MIN_OVERLAP", "0.5")),
+        "SEMANTIC_CACHE_MAX_ENTRIES": int(_read_secret_or_env("SEMANTIC_CACHE_MAX_ENTRIES", "100000")),
     }
 
 
-def _load_cache(path: str) -> Dict[str, Any]:
+# snapshot تنظیمات: قبلاً هر درخواست چند بار load_settings رو صدا می‌زد و هر بار
+# streamlit رو import، ۱۰ تا کلید secret رو می‌خوند و mkdir می‌کرد. حالا یک بار ساخته
+# می‌شه و فقط‌خواندنیه؛ تغییر env یا secret فقط با reload_settings() اعمال می‌شه.
+_settings_lock = threading.Lock()
+_settings: Optional[Mapping[str, Any]] = None
+
+
+def load_settings() -> Mapping[str, Any]:
+    """
+    برمی‌گردونه تنظیمات runtime شامل مدل‌ها، api key و مسیر کش (snapshot غیرقابل تغییر).
+    """
+    global _settings
+    snap = _settings
+    if snap is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = MappingProxyType(_build_settings())
+            snap = _settings
+    return snap
+
+
+def reload_settings() -> Mapping[str, Any]:
+    """
+    تنظیمات رو از env / secrets دوباره می‌خونه. provider و مسیریاب tier هم دور ریخته
+    می‌شن تا با تنظیمات جدید ساخته بشن؛ کش‌ها با کلید مسیر/پارامترشون cache شدن و
+    خودشون عوض می‌شن. درخواست‌های در حال اجرا با snapshot قبلی تموم می‌شن.
+    """
+    global _settings
+    with _settings_lock:
+        _settings = MappingProxyType(_build_settings())
+        snap = _settings
+    get_provider.cache_clear()
+    get_tier_router.cache_clear()
+    return snap
+
+
+@lru_cache(maxsize=4)
+def _get_answer_cache(path: str, legacy_json: str, max_entries: int, ttl_sec: float) -> Optional[AnswerCache]:
     try:
-        p = Path(path)
-        if p.exists():
-            return json.loads(p.read_text(encoding="utf-8"))
+        return AnswerCache(path, max_entries=max_entries, ttl_sec=ttl_sec, legacy_json=legacy_json)
     except Exception:
-        pass
-    return {}
+        # کش نباید جلوی جواب دادن رو بگیره
+        return None
 
 
-def _save_cache(path: str, data: Dict[str, Any]) -> None:
+@lru_cache(maxsize=4)
+def _get_semantic_cache(
+    path: str, threshold: float, min_overlap: float, max_entries: int, ttl_sec: float
+) -> Optional[SemanticCache]:
     try:
-        Path(path).write_text(
-            json.dumps(data, ensure_ascii=False, indent=2),
-            encoding="utf-8"
+        return SemanticCache(
+            path,
+            threshold=threshold,
+            min_context_overlap=min_overlap,
+            max_entries=max_entries,
+            ttl_sec=ttl_sec,
         )
     except Exception:
-        pass
+        return None
+
+
+def _semantic_cache_path(s: Mapping[str, Any]) -> str:
+    # مثل پیشوند کلید کش دقیق: جواب‌های provider آزمایشی (fake و ...) فایل جدای خودشون رو دارن،
+    # وگرنه بعد از تست بار، سؤال‌های هم‌معنی کاربرای واقعی جواب ساختگی می‌گرفتن
+    path = s["ANSWER_CACHE_PATH"]
+    if s["MODEL_PROVIDER"] == "openai":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{s['MODEL_PROVIDER']}{ext}"
+
+
+def _semantic_cache_for(s: Mapping[str, Any]) -> Optional[SemanticCache]:
+    if not s["SEMANTIC_CACHE_ENABLED"]:
+        return None
+    return _get_semantic_cache(
+        _semantic_cache_path(s),
+        s["SEMANTIC_CACHE_THRESHOLD"],
+        s["SEMANTIC_CACHE_MIN_OVERLAP"],
+        s["SEMANTIC_CACHE_MAX_ENTRIES"],
+        s["ANSWER_CACHE_TTL_SEC"],
+    )
+
+
+def _embed_query(query: str):
+    # همون مدل MiniLM و کش بردار کوئری retriever؛ import اینجاست تا generator به retriever وابسته نشه
+    try:
+        from app.retriever import encode_query
+        return encode_query(query)
+    except Exception:
+        return None
+
+
+def answer_cache_stats() -> Dict[str, Any]:
+    s = load_settings()
+    cache = _get_answer_cache(
+        s["ANSWER_CACHE_PATH"], s["CACHE_PATH"], s["ANSWER_CACHE_MAX_ENTRIES"], s["ANSWER_CACHE_TTL_SEC"]
+    )
+    out = cache.stats() if cache is not None else {"error": "answer cache unavailable"}
+    semantic = _semantic_cache_for(s)
+    out["semantic"] = semantic.stats() if semantic is not None else None
+    return out
 
 
 # -------------------------------------------------
@@ -142,36 +247,26 @@ def _is_smalltalk_or_simple(query: str) -> bool:
     return False
 
 
-def _clean_context_blocks(context_list: Optional[List[str]]) -> str:
+def _choose_tier(query: str):
     """
-    ورودی context (لیست تکه‌های دانش/گفتگو) رو تمیز و یکی می‌کنیم
-    تا مدل راحت‌تر ازش استفاده کنه.
+    (tier, بردار کوئری). اگر مدل app/tier_router آموزش داده شده باشه، تصمیم از روی بردار
+    کوئری گرفته می‌شه (همون بردار retriever، از کش LRU)؛ وگرنه قانون‌های _is_smalltalk_or_simple
+    و بردار None است (بدون مدل، encode فقط بعد از miss کش دقیق و برای کش معنایی انجام می‌شه).
+    تصمیم همراه با جواب قانون‌ها ثبت می‌شه تا صرفه‌جویی deep اندازه‌گیری بشه.
     """
-    if not context_list:
-        return ""
-
-    cleaned_blocks: List[str] = []
-    for block in context_list:
-        if not block:
-            continue
-        # پاک کردن چیزهایی که نباید مستقیماً کاربر ببیند
-        txt = re.sub(r"\(منبع:[^)]+\)", "", block)
-        txt = re.sub(r"\[[^\]]+\]", "", txt)
-        txt = txt.strip()
-        if txt:
-            cleaned_blocks.append(txt)
-
-    if not cleaned_blocks:
-        return ""
-
-    merged = "\n\n---\n\n".join(cleaned_blocks)
-    final = (
-        "یادداشت کمکی (سابقه گفتگو و دانش داخلی):\n"
-        "از این اطلاعات فقط برای اینکه بهتر و دقیق‌تر جواب بدی استفاده کن. "
-        "این متن رو مستقیم تکرار نکن مگر لازم باشد.\n\n"
-        f"{merged}\n"
-    )
-    return final
+    heuristic = "cheap" if _is_smalltalk_or_simple(query) else "deep"
+    router = get_tier_router()
+    query_emb = _embed_query(query) if router is not None else None
+
+    if router is not None and query_emb is not None and query_emb.shape[-1] == router.dim:
+        t0 = time.perf_counter()
+        score = router.score(query_emb)
+        tier = router.tier_for(score)
+        log_decision(query, tier, "router", heuristic, score, (time.perf_counter() - t0) * 1e6)
+    else:
+        tier = heuristic
+        log_decision(query, tier, "heuristic", heuristic)
+    return tier, query_emb
 
 
 #DEO
@@ -185,24 +280,47 @@ def _call_openai(
     prompt: str,
     max_tokens: int,
     temperature: float,
+    tier: str = "deep",
 ) -> str:
     """
     صدا زدن OpenAI Responses API.
     ما انتظار داریم مدل‌هایی مثل gpt-4o / gpt-4o-mini این را ساپورت کنند.
     خروجی را به یک متن تمیز تبدیل می‌کنیم.
+    کلاینت مشترک llm_client استفاده می‌شه (keep-alive، timeout همون tier، retry روی 429/5xx).
     """
-    if not OpenAI:
-        raise RuntimeError("openai package not available in this environment")
+    response = llm_client.responses_create(
+        api_key,
+        tier=tier,
+        model=model_name,
+        input=prompt,
+        max_output_tokens=max_tokens,
+        temperature=temperature,
+    )
+    return _response_text(response)
 
-    client = OpenAI(api_key=api_key)
 
-    response = client.responses.create(
+async def _acall_openai(
+    *,
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    tier: str = "deep",
+) -> str:
+    """نسخه‌ی async از _call_openai (event loop بلاک نمی‌شه)."""
+    response = await llm_client.aresponses_create(
+        api_key,
+        tier=tier,
         model=model_name,
         input=prompt,
         max_output_tokens=max_tokens,
         temperature=temperature,
     )
+    return _response_text(response)
+
 
+def _response_text(response: Any) -> str:
     # استخراج متن از ساختار response
     text_out = None
 
@@ -247,56 +365,338 @@ def _call_openai(
     return text_out
 
 
+def _stream_openai(
+    *,
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    tier: str = "deep",
+) -> Iterator[str]:
+    """
+    نسخه‌ی استریم Responses API: فقط deltaهای متن خروجی رو yield می‌کنه.
+    """
+    stream = llm_client.responses_create(
+        api_key,
+        tier=tier,
+        model=model_name,
+        input=prompt,
+        max_output_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    for event in stream:
+        etype = getattr(event, "type", "")
+        if etype == "response.output_text.delta":
+            delta = getattr(event, "delta", "")
+            if delta:
+                yield delta
+        elif etype in ("response.failed", "error"):
+            raise RuntimeError(f"openai stream failed: {etype}")
+
+
+async def _astream_openai(
+    *,
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    tier: str = "deep",
+) -> AsyncIterator[str]:
+    stream = await llm_client.aresponses_create(
+        api_key,
+        tier=tier,
+        model=model_name,
+        input=prompt,
+        max_output_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    async for event in stream:
+        etype = getattr(event, "type", "")
+        if etype == "response.output_text.delta":
+            delta = getattr(event, "delta", "")
+            if delta:
+                yield delta
+        elif etype in ("response.failed", "error"):
+            raise RuntimeError(f"openai stream failed: {etype}")
+
+
+# -------------------------------------------------
+# provider ها (openai یا جایگزین محلی برای تست بار)
+# -------------------------------------------------
+class LLMProvider:
+    """
+    رابط provider مدل. هر چهار متد همین آرگومان‌های keyword رو می‌گیرن:
+    api_key, model_name, prompt, max_tokens, temperature, tier
+    """
+    name = ""
+
+    def ready(self, api_key: str) -> bool:
+        return True
+
+    def complete(self, **request: Any) -> str:
+        raise NotImplementedError
+
+    async def acomplete(self, **request: Any) -> str:
+        raise NotImplementedError
+
+    def stream(self, **request: Any) -> Iterator[str]:
+        raise NotImplementedError
+
+    def astream(self, **request: Any) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def ready(self, api_key: str) -> bool:
+        return bool(api_key)
+
+    def complete(self, **request: Any) -> str:
+        return _call_openai(**request)
+
+    async def acomplete(self, **request: Any) -> str:
+        return await _acall_openai(**request)
+
+    def stream(self, **request: Any) -> Iterator[str]:
+        return _stream_openai(**request)
+
+    def astream(self, **request: Any) -> AsyncIterator[str]:
+        return _astream_openai(**request)
+
+
+def _fake_provider() -> LLMProvider:
+    # import اینجاست تا تو production ماژول fake اصلاً لود نشه
+    from app.fake_llm import FakeLLM
+    return FakeLLM.from_env()
+
+
+_PROVIDER_FACTORIES: Dict[str, Callable[[], LLMProvider]] = {
+    "openai": OpenAIProvider,
+    "fake": _fake_provider,
+}
+
+
+def register_provider(name: str, factory: Callable[[], LLMProvider]) -> None:
+    """provider جدید (هر شیئی با متدهای LLMProvider) با اسمی که تو MODEL_PROVIDER میاد."""
+    _PROVIDER_FACTORIES[name.strip().lower()] = factory
+    get_provider.cache_clear()
+
+
+@lru_cache(maxsize=8)
+def get_provider(name: str) -> Optional[LLMProvider]:
+    factory = _PROVIDER_FACTORIES.get((name or "").strip().lower())
+    return factory() if factory is not None else None
+
+
+def provider_stats() -> Dict[str, Any]:
+    name = load_settings()["MODEL_PROVIDER"]
+    provider = get_provider(name)
+    stats = getattr(provider, "stats", None)
+    return {"name": name, "available": provider is not None, **(stats() if callable(stats) else {})}
+
+
+def warm_up() -> Dict[str, Any]:
+    """
+    برای warm-up استارت اپ: کش پاسخ (SQLite)، کش معنایی (ایندکس بردارها)، provider،
+    مسیریاب tier و کلاینت pooled OpenAI (همون import سنگین SDK) رو از قبل می‌سازه.
+    """
+    s = load_settings()
+    cache = _get_answer_cache(
+        s["ANSWER_CACHE_PATH"], s["CACHE_PATH"], s["ANSWER_CACHE_MAX_ENTRIES"], s["ANSWER_CACHE_TTL_SEC"]
+    )
+    semantic = _semantic_cache_for(s)
+    provider = get_provider(s["MODEL_PROVIDER"])
+    if s["MODEL_PROVIDER"] == "openai" and s["OPENAI_API_KEY"]:
+        llm_client.get_client(s["OPENAI_API_KEY"])
+    return {
+        "answer_cache": cache is not None,
+        "semantic_cache": semantic is not None,
+        "provider": s["MODEL_PROVIDER"] if provider is not None else None,
+        "tier_router": get_tier_router() is not None,
+    }
+
+
+def _llm_request(plan: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "api_key": plan["api_key"],
+        "model_name": plan["model"],
+        "prompt": plan["prompt"],
+        "max_tokens": plan["max_tokens"],
+        "temperature": plan["temperature"],
+        "tier": plan["tier"],
+    }
+
+
+def _plan_provider(plan: Dict[str, Any]) -> Optional[LLMProvider]:
+    provider = get_provider(plan["provider"])
+    if provider is None or not provider.ready(plan["api_key"]):
+        return None
+    return provider
+
+
 # -------------------------------------------------
 # تابع اصلی پاسخ‌دهی
 # -------------------------------------------------
-def generate_answer(
+_FALLBACK_LLM_ERROR = (
+    "الان نتونستم جواب هوشمند رو از مدل بگیرم. "
+    "یه بار دیگه بپرس یا واضح‌تر بگو دقیقا دنبال چی هستی."
+)
+_FALLBACK_NO_KEY = "در حال حاضر به مدل متصل نیستم. کلید API یا سطح دسترسی موجود نیست."
+
+
+def _plan_answer(
     query: str,
-    *,
-    context: Optional[List[str]] = None,
-    temperature_simple: float = 0.2,
-    temperature_deep: float = 0.3,
-    max_tokens_simple: int = 128,
-    max_tokens_deep: int = 512,
-    force_new: bool = False,   # 👈 جدید: اگر True باشد، کش را نادیده می‌گیریم
-) -> str:
+    context: Optional[List[Any]],
+    temperature_simple: float,
+    temperature_deep: float,
+    max_tokens_simple: int,
+    max_tokens_deep: int,
+    force_new: bool,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Dict[str, Any]:
     """
-    همیشه مدل رو صدا می‌زنیم.
-    ولی:
-      - اگر سوال ساده‌ست → مدل ارزون‌تر، توکن کم
-      - اگر سوال جدی‌تره → مدل قوی‌تر، توکن بیشتر
-      - اگر force_new == True → کش را نادیده می‌گیریم و حتی اگر این سؤال تکراری است، جواب جدید می‌گیریم
+    بخش مشترک generate_answer و generate_answer_stream: کش‌ها، انتخاب مدل و ساخت پرامپت.
+    اگر جواب از کش بیاد، plan["cached"] پره و مدل صدا زده نمی‌شه.
+    """
+    plan = _new_plan(query, context, history)
+    cache = plan["cache"]
 
-    خروجی: یک متن محاوره‌ای، یک‌تکه، بدون سرفصل‌های خشک.
+    # اگر force_new=False و این سؤال قبلا جواب داده شده، همان پاسخ را بده
+    if (not force_new) and cache is not None:
+        plan["cached"] = _safe_cache_get(cache, plan["cache_key"])
+        if plan["cached"] is not None:
+            return plan
+
+    # لایه‌ی دوم: سؤال هم‌معنی با کانتکست مشابه (بردار کوئری فقط اینجا، بعد از miss کش دقیق؛
+    # با force_new هم لازمه چون جواب تازه به کش معنایی اضافه می‌شه)
+    semantic = plan["semantic"]
+    if semantic is not None and plan["query_emb"] is None:
+        plan["query_emb"] = _embed_query(query)
+    query_emb = plan["query_emb"]
+    if (not force_new) and semantic is not None and query_emb is not None:
+        plan["cached"] = _safe_semantic_lookup(semantic, query_emb, plan["ctx_keys"])
+        if plan["cached"] is not None:
+            return plan
+
+    _plan_prompt(plan, query, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep)
+    return plan
+
+
+async def _aplan_answer(
+    query: str,
+    context: Optional[List[Any]],
+    temperature_simple: float,
+    temperature_deep: float,
+    max_tokens_simple: int,
+    max_tokens_deep: int,
+    force_new: bool,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Dict[str, Any]:
+    """
+    نسخه‌ی async از _plan_answer: کارهای بلاک‌کننده (انتخاب tier، SQLite، encode) روی executor
+    اجرا می‌شن. بردار کوئری مثل نسخه‌ی sync فقط بعد از miss کش دقیق ساخته می‌شه: خوندن کش دقیق
+    یک lookup روی کلید اصلیه و هم‌پوشونی‌ش با encode کمتر از یک میلی‌ثانیه صرفه‌جویی داشت، ولی
+    encode ِ روی executor بعد از شروع دیگه کنسل نمی‌شه و روی هر hit هدر می‌رفت.
     """
+    executor = get_executor()
+    plan = await executor.run(_new_plan, query, context, history)
+    cache, semantic = plan["cache"], plan["semantic"]
 
+    if (not force_new) and cache is not None:
+        plan["cached"] = await executor.run(_safe_cache_get, cache, plan["cache_key"])
+        if plan["cached"] is not None:
+            return plan
+
+    if semantic is not None and plan["query_emb"] is None:
+        plan["query_emb"] = await executor.run(_embed_query, query)
+
+    if (not force_new) and semantic is not None and plan["query_emb"] is not None:
+        plan["cached"] = await executor.run(_safe_semantic_lookup, semantic, plan["query_emb"], plan["ctx_keys"])
+        if plan["cached"] is not None:
+            return plan
+
+    _plan_prompt(plan, query, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep)
+    return plan
+
+
+def _safe_cache_get(cache: AnswerCache, key: str) -> Optional[str]:
+    try:
+        return cache.get(key)
+    except Exception:
+        return None
+
+
+def _safe_semantic_lookup(semantic: SemanticCache, query_emb: Any, ctx_keys: Any) -> Optional[str]:
+    try:
+        return semantic.lookup(query_emb, ctx_keys)
+    except Exception:
+        return None
+
+
+def _new_plan(
+    query: str,
+    context: Optional[List[Any]],
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Dict[str, Any]:
     s = load_settings()
 
-    provider = s["MODEL_PROVIDER"]
-    api_key = s["OPENAI_API_KEY"]
-    model_cheap = s["OPENAI_MODEL_CHEAP"]
-    model_deep = s["OPENAI_MODEL_DEEP"]
+    cache = _get_answer_cache(
+        s["ANSWER_CACHE_PATH"], s["CACHE_PATH"], s["ANSWER_CACHE_MAX_ENTRIES"], s["ANSWER_CACHE_TTL_SEC"]
+    )
 
-    cache_path = s["CACHE_PATH"]
-    cache = _load_cache(cache_path)
+    # تصمیم بگیریم که این سوال "ساده/کوتاه" است یا "جدی/عمیق" (بودجه‌ی کانتکست به tier بستگی داره)
+    semantic = _semantic_cache_for(s)
+    tier, query_emb = _choose_tier(query)
 
-    # context رو تمیز کنیم
-    ctx_block = _clean_context_blocks(context)
+    # context رو تمیز و در بودجه‌ی توکن همین tier جمع کنیم
+    assembled = assemble_context(
+        context,
+        history,
+        tier=tier,
+        model=s["OPENAI_MODEL_CHEAP"] if tier == "cheap" else s["OPENAI_MODEL_DEEP"],
+    )
+    ctx_block = assembled["text"]
 
     # کلید کش: سؤال کاربر + کانتکست
     cache_key = f"{query.strip()}##{ctx_block.strip()}"
+    if s["MODEL_PROVIDER"] != "openai":
+        # جواب‌های provider آزمایشی نباید به جای جواب واقعی از کش برگردن
+        cache_key = f"{s['MODEL_PROVIDER']}::{cache_key}"
 
-    # اگر force_new=False و این سؤال قبلا جواب داده شده، همان پاسخ را بده
-    if (not force_new) and cache_key in cache:
-        return cache[cache_key]
+    return {
+        "settings": s,
+        "cache": cache,
+        "cache_key": cache_key,
+        "semantic": semantic,
+        "query": query.strip(),
+        "query_emb": query_emb,
+        "tier": tier,
+        "ctx_block": ctx_block,
+        "ctx_keys": context_keys(assembled["blocks"]),
+        "context_report": assembled["report"],
+        "cached": None,
+    }
 
-    # تصمیم بگیریم که این سوال "ساده/کوتاه" است یا "جدی/عمیق"
-    simple = _is_smalltalk_or_simple(query)
 
-    if simple:
-        chosen_model = model_cheap
-        chosen_temp = temperature_simple
-        chosen_max_tokens = max_tokens_simple
+def _plan_prompt(
+    plan: Dict[str, Any],
+    query: str,
+    temperature_simple: float,
+    temperature_deep: float,
+    max_tokens_simple: int,
+    max_tokens_deep: int,
+) -> None:
+    s = plan["settings"]
+
+    if plan["tier"] == "cheap":
+        plan["model"] = s["OPENAI_MODEL_CHEAP"]
+        plan["temperature"] = temperature_simple
+        plan["max_tokens"] = max_tokens_simple
         style_instruction = (
             "خیلی خلاصه و خودمانی جواب بده. "
             "یک پاراگراف یا چند جمله کوتاه کافیه. "
@@ -304,9 +704,9 @@ def generate_answer(
             "واضح و مستقیم باش."
         )
     else:
-        chosen_model = model_deep
-        chosen_temp = temperature_deep
-        chosen_max_tokens = max_tokens_deep
+        plan["model"] = s["OPENAI_MODEL_DEEP"]
+        plan["temperature"] = temperature_deep
+        plan["max_tokens"] = max_tokens_deep
         style_instruction = (
             "مثل یک منتور کسب‌وکار فارسی رفتار کن. "
             "جواب رو کاربردی، مشخص و مرحله‌ای بده، ولی خشک و رسمی نباش. "
@@ -314,41 +714,217 @@ def generate_answer(
         )
 
     # پرامپت نهایی که مدل باید بگیره
-    prompt = (
+    plan["prompt"] = (
         f"{style_instruction}\n\n"
         f"سوال کاربر:\n{query.strip()}\n\n"
-        f"{ctx_block}"
+        f"{plan['ctx_block']}"
+    )
+
+    # MODEL_PROVIDER: openai (پیش‌فرض) یا fake برای تست بار بدون خرج quota
+    plan["provider"] = s["MODEL_PROVIDER"]
+    plan["api_key"] = s["OPENAI_API_KEY"]
+
+
+def _finish_answer(plan: Dict[str, Any], answer_text: str, llm_ok: bool) -> None:
+    """ذخیره‌ی جواب نهایی (کامل) در کش دقیق و، اگر از مدل اومده، در کش معنایی."""
+    cache = plan["cache"]
+    if cache is not None:
+        try:
+            cache.put(plan["cache_key"], answer_text)
+        except Exception:
+            pass
+    # پیام‌های خطا وارد کش معنایی نمی‌شن، وگرنه به سؤال‌های مشابه هم پخش می‌شدن
+    semantic = plan["semantic"]
+    if llm_ok and semantic is not None and plan["query_emb"] is not None:
+        try:
+            semantic.add(plan["query"], plan["query_emb"], plan["ctx_keys"], answer_text)
+        except Exception:
+            pass
+
+
+def generate_answer(
+    query: str,
+    *,
+    context: Optional[List[Any]] = None,
+    temperature_simple: float = 0.2,
+    temperature_deep: float = 0.3,
+    max_tokens_simple: int = 128,
+    max_tokens_deep: int = 512,
+    force_new: bool = False,   # 👈 جدید: اگر True باشد، کش را نادیده می‌گیریم
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
+    """
+    همیشه مدل رو صدا می‌زنیم.
+    ولی:
+      - اگر سوال ساده‌ست → مدل ارزون‌تر، توکن کم
+      - اگر سوال جدی‌تره → مدل قوی‌تر، توکن بیشتر
+      - اگر force_new == True → کش را نادیده می‌گیریم و حتی اگر این سؤال تکراری است، جواب جدید می‌گیریم
+      - context و history به اندازه‌ی بودجه‌ی توکن همون tier بریده می‌شن (app/context_builder)
+
+    خروجی: یک متن محاوره‌ای، یک‌تکه، بدون سرفصل‌های خشک.
+    """
+    plan = _plan_answer(
+        query, context, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep, force_new,
+        history,
     )
+    if plan["cached"] is not None:
+        return plan["cached"]
+
+    # درخواست‌های هم‌زمان با همین کلید منتظر همین یک فراخوانی مدل می‌مونن
+    return _ANSWER_FLIGHT.do(_flight_key(plan, force_new), lambda: _generate_uncached(plan))
+
 
-    # enforce اینکه فعلاً فقط openai ساپورت می‌شه
-    if provider != "openai":
-        provider = "openai"
+# یکی‌کردن miss های هم‌زمان روی کلید کش؛ thread ها (ui.py) و task های async (/chat) با هم
+_ANSWER_FLIGHT = get_flight("answer")
 
+
+def _flight_key(plan: Dict[str, Any], force_new: bool) -> str:
+    # force_new یعنی «جواب تازه»؛ با درخواست‌های معمولی یکی نمی‌شه
+    return ("new:" if force_new else "") + _hash_key(plan["cache_key"])
+
+
+def _generate_uncached(plan: Dict[str, Any]) -> str:
     # درخواست به LLM
-    if provider == "openai" and api_key:
+    llm_ok = False
+    provider = _plan_provider(plan)
+    if provider is not None:
         try:
-            answer_text = _call_openai(
-                api_key=api_key,
-                model_name=chosen_model,
-                prompt=prompt,
-                max_tokens=chosen_max_tokens,
-                temperature=chosen_temp,
-            )
+            answer_text = provider.complete(**_llm_request(plan))
+            llm_ok = True
         except Exception:
-            answer_text = (
-                "الان نتونستم جواب هوشمند رو از مدل بگیرم. "
-                "یه بار دیگه بپرس یا واضح‌تر بگو دقیقا دنبال چی هستی."
-            )
+            answer_text = _FALLBACK_LLM_ERROR
     else:
-        answer_text = (
-            "در حال حاضر به مدل متصل نیستم. کلید API یا سطح دسترسی موجود نیست."
-        )
+        answer_text = _FALLBACK_NO_KEY
+
+    # پاسخ جدید رو در کش ذخیره کن (قبل از اینکه منتظرها جواب بگیرن)
+    _finish_answer(plan, answer_text, llm_ok)
+    return answer_text
+
+
+def generate_answer_stream(
+    query: str,
+    *,
+    context: Optional[List[Any]] = None,
+    temperature_simple: float = 0.2,
+    temperature_deep: float = 0.3,
+    max_tokens_simple: int = 128,
+    max_tokens_deep: int = 512,
+    force_new: bool = False,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Iterator[str]:
+    """
+    مثل generate_answer ولی تکه‌های متن (delta) رو همون لحظه که از مدل می‌رسن yield می‌کنه.
+    جواب کش‌شده یک‌جا yield می‌شه. جواب کامل بعد از آخرین توکن وارد کش می‌شه؛
+    اگر استریم وسط راه قطع بشه، جواب ناقص کش نمی‌شه.
+    """
+    plan = _plan_answer(
+        query, context, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep, force_new,
+        history,
+    )
+    if plan["cached"] is not None:
+        yield plan["cached"]
+        return
+
+    provider = _plan_provider(plan)
+    if provider is None:
+        yield _FALLBACK_NO_KEY
+        _finish_answer(plan, _FALLBACK_NO_KEY, llm_ok=False)
+        return
+
+    parts: List[str] = []
+    try:
+        for delta in provider.stream(**_llm_request(plan)):
+            parts.append(delta)
+            yield delta
+    except Exception:
+        if not parts:
+            yield _FALLBACK_LLM_ERROR
+            _finish_answer(plan, _FALLBACK_LLM_ERROR, llm_ok=False)
+        return
+
+    _finish_answer(plan, "".join(parts).strip(), llm_ok=True)
 
-    # پاسخ جدید رو در کش ذخیره کن
-    cache[cache_key] = answer_text
-    _save_cache(cache_path, cache)
 
+async def agenerate_answer(
+    query: str,
+    *,
+    context: Optional[List[Any]] = None,
+    temperature_simple: float = 0.2,
+    temperature_deep: float = 0.3,
+    max_tokens_simple: int = 128,
+    max_tokens_deep: int = 512,
+    force_new: bool = False,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
+    """
+    نسخه‌ی async از generate_answer برای FastAPI: کش و encode روی executor محدود،
+    فراخوانی مدل با کلاینت async؛ پس یک worker می‌تونه صدها چت در جریان رو نگه داره.
+    """
+    plan = await _aplan_answer(
+        query, context, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep, force_new,
+        history,
+    )
+    if plan["cached"] is not None:
+        return plan["cached"]
+
+    return await _ANSWER_FLIGHT.ado(_flight_key(plan, force_new), lambda: _agenerate_uncached(plan))
+
+
+async def _agenerate_uncached(plan: Dict[str, Any]) -> str:
+    llm_ok = False
+    provider = _plan_provider(plan)
+    if provider is not None:
+        try:
+            answer_text = await provider.acomplete(**_llm_request(plan))
+            llm_ok = True
+        except Exception:
+            answer_text = _FALLBACK_LLM_ERROR
+    else:
+        answer_text = _FALLBACK_NO_KEY
+
+    await get_executor().run(_finish_answer, plan, answer_text, llm_ok)
     return answer_text
 
+
+async def agenerate_answer_stream(
+    query: str,
+    *,
+    context: Optional[List[Any]] = None,
+    temperature_simple: float = 0.2,
+    temperature_deep: float = 0.3,
+    max_tokens_simple: int = 128,
+    max_tokens_deep: int = 512,
+    force_new: bool = False,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> AsyncIterator[str]:
+    """نسخه‌ی async از generate_answer_stream."""
+    plan = await _aplan_answer(
+        query, context, temperature_simple, temperature_deep, max_tokens_simple, max_tokens_deep, force_new,
+        history,
+    )
+    if plan["cached"] is not None:
+        yield plan["cached"]
+        return
+
+    executor = get_executor()
+    provider = _plan_provider(plan)
+    if provider is None:
+        yield _FALLBACK_NO_KEY
+        await executor.run(_finish_answer, plan, _FALLBACK_NO_KEY, False)
+        return
+
+    parts: List[str] = []
+    try:
+        async for delta in provider.astream(**_llm_request(plan)):
+            parts.append(delta)
+            yield delta
+    except Exception:
+        if not parts:
+            yield _FALLBACK_LLM_ERROR
+            await executor.run(_finish_answer, plan, _FALLBACK_LLM_ERROR, False)
+        return
+
+    await executor.run(_finish_answer, plan, "".join(parts).strip(), True)
+
 #FEYZ
 #DEO
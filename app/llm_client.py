@@ -0,0 +1,213 @@
+# app/llm_client.py
+# کلاینت مشترک OpenAI (sync و async) با connection pool، timeout هر tier و retry با backoff
+#
+# قبلاً هر فراخوانی یک OpenAI(api_key=...) تازه می‌ساخت؛ یعنی هر درخواست یک TLS handshake
+# جدید، بدون سقف زمانی و بدون سیاست retry. اینجا برای هر process یک کلاینت (و برای هر
+# event loop یک کلاینت async) ساخته می‌شه که اتصال‌ها رو keep-alive نگه می‌داره.
+#
+# تنظیمات (env):
+#   OPENAI_BASE_URL        → مثلاً http://127.0.0.1:9000/v1 برای سرور جایگزین محلی
+#   LLM_POOL_SIZE          → حداکثر اتصال هم‌زمان (و keep-alive) هر کلاینت
+#   LLM_TIMEOUT_CHEAP_SEC  → سقف زمان هر درخواست tier ارزون
+#   LLM_TIMEOUT_DEEP_SEC   → سقف زمان هر درخواست tier عمیق
+#   LLM_MAX_RETRIES        → تعداد تلاش دوباره روی 429 / 5xx / خطای اتصال
+#   LLM_BACKOFF_BASE_SEC / LLM_BACKOFF_MAX_SEC → backoff نمایی با jitter کامل
+from __future__ import annotations
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+
+T = TypeVar("T")
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "").strip() or None
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))
+LLM_CONNECT_TIMEOUT_SEC = float(os.getenv("LLM_CONNECT_TIMEOUT_SEC", "5"))
+TIER_TIMEOUTS_SEC = {
+    "cheap": float(os.getenv("LLM_TIMEOUT_CHEAP_SEC", "20")),
+    "deep": float(os.getenv("LLM_TIMEOUT_DEEP_SEC", "60")),
+}
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SEC = float(os.getenv("LLM_BACKOFF_BASE_SEC", "0.5"))
+LLM_BACKOFF_MAX_SEC = float(os.getenv("LLM_BACKOFF_MAX_SEC", "8"))
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"calls": 0, "retries": 0, "failures": 0}
+
+
+def _bump(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def client_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    out.update({
+        "pool_size": LLM_POOL_SIZE,
+        "base_url": OPENAI_BASE_URL,
+        "timeouts_sec": dict(TIER_TIMEOUTS_SEC),
+        "max_retries": LLM_MAX_RETRIES,
+    })
+    return out
+
+
+def tier_timeout(tier: Optional[str]) -> float:
+    return TIER_TIMEOUTS_SEC.get(tier or "deep", TIER_TIMEOUTS_SEC["deep"])
+
+
+@lru_cache(maxsize=1)
+def _load_sdk():
+    # import تنبل: SDK openai به تنهایی نیم ثانیه به import اپ اضافه می‌کرد
+    try:
+        import httpx  # type: ignore
+        import openai  # type: ignore
+        return openai, httpx
+    except Exception:
+        return None
+
+
+def _require_sdk():
+    sdk = _load_sdk()
+    if sdk is None:
+        raise RuntimeError("openai package not available in this environment")
+    return sdk
+
+
+def _limits(httpx):
+    return httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)
+
+
+# ---------- کلاینت‌ها ----------
+@lru_cache(maxsize=8)
+def get_client(api_key: str) -> "OpenAI":
+    """کلاینت sync مشترک (thread-safe) برای این api_key."""
+    openai, httpx = _require_sdk()
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        # retry رو خودمون با backoff و jitter انجام می‌دیم
+        max_retries=0,
+        timeout=TIER_TIMEOUTS_SEC["deep"],
+        http_client=openai.DefaultHttpxClient(limits=_limits(httpx)),
+    )
+
+
+# کلاینت async به event loop بسته است؛ برای هر loop یکی نگه می‌داریم
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+_async_lock = threading.Lock()
+
+
+def get_async_client(api_key: str) -> "AsyncOpenAI":
+    """کلاینت async مشترک برای event loop جاری و این api_key."""
+    openai, httpx = _require_sdk()
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(api_key)
+        if client is None:
+            client = per_loop[api_key] = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=OPENAI_BASE_URL,
+                max_retries=0,
+                timeout=TIER_TIMEOUTS_SEC["deep"],
+                http_client=openai.DefaultAsyncHttpxClient(limits=_limits(httpx)),
+            )
+    return client
+
+
+# ---------- retry ----------
+def _is_retryable(exc: BaseException) -> bool:
+    sdk = _load_sdk()
+    if sdk is None:
+        return False
+    openai = sdk[0]
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def _backoff_delay(attempt: int, exc: BaseException) -> float:
+    # اگر سرور Retry-After داده، همون رو رعایت می‌کنیم (تا سقف backoff)
+    response = getattr(exc, "response", None)
+    retry_after = None
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is not None:
+        return min(retry_after, LLM_BACKOFF_MAX_SEC)
+    # full jitter: عدد تصادفی بین صفر و سقف نمایی
+    return random.uniform(0.0, min(LLM_BACKOFF_MAX_SEC, LLM_BACKOFF_BASE_SEC * (2 ** attempt)))
+
+
+def call_with_retries(fn: Callable[[], T], max_retries: Optional[int] = None) -> T:
+    retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    _bump("calls")
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not _is_retryable(e):
+                _bump("failures")
+                raise
+            _bump("retries")
+            time.sleep(_backoff_delay(attempt, e))
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retries(fn: Callable[[], Awaitable[T]], max_retries: Optional[int] = None) -> T:
+    retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    _bump("calls")
+    for attempt in range(retries + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= retries or not _is_retryable(e):
+                _bump("failures")
+                raise
+            _bump("retries")
+            await asyncio.sleep(_backoff_delay(attempt, e))
+    raise AssertionError("unreachable")
+
+
+# ---------- فراخوانی‌های آماده ----------
+def responses_create(api_key: str, tier: Optional[str] = None, **kwargs: Any) -> Any:
+    """
+    client.responses.create با کلاینت مشترک، timeout همون tier و retry.
+    با stream=True فقط ساختن استریم retry می‌شه (قبل از اولین توکن).
+    """
+    client = get_client(api_key)
+    timeout = tier_timeout(tier)
+    return call_with_retries(lambda: client.responses.create(timeout=timeout, **kwargs))
+
+
+async def aresponses_create(api_key: str, tier: Optional[str] = None, **kwargs: Any) -> Any:
+    client = get_async_client(api_key)
+    timeout = tier_timeout(tier)
+    return await acall_with_retries(lambda: client.responses.create(timeout=timeout, **kwargs))
+
+
+def chat_completions_create(api_key: str, tier: Optional[str] = None, **kwargs: Any) -> Any:
+    client = get_client(api_key)
+    timeout = tier_timeout(tier)
+    return call_with_retries(lambda: client.chat.completions.create(timeout=timeout, **kwargs))
+
+
+async def achat_completions_create(api_key: str, tier: Optional[str] = None, **kwargs: Any) -> Any:
+    client = get_async_client(api_key)
+    timeout = tier_timeout(tier)
+    return await acall_with_retries(lambda: client.chat.completions.create(timeout=timeout, **kwargs))
@@ -0,0 +1,328 @@
+"""
+loadtest.py
+-----------
+تست بار end-to-end برای /chat و /chat/stream (قبل از هر release برای تعیین تعداد worker).
+
+یک corpus از سؤال‌ها رو با هم‌زمانی ثابت (--concurrency، حلقه‌ی بسته) یا نرخ ثابت
+(--rps، حلقه‌ی باز) به API می‌فرسته و throughput، صدک‌های latency (و برای استریم،
+زمان تا اولین توکن) و نرخ خطا رو گزارش می‌ده.
+
+دو حالت هدف:
+  --app app.main:app      → همون process، با httpx.ASGITransport (بدون شبکه؛ هزینه‌ی خود اپ)
+  --url http://host:8000  → سرور واقعی uvicorn/gunicorn (برای اندازه‌گیری worker ها)
+
+برای اینکه quota خرج نشه، سرور (یا همین process در حالت --app) رو با MODEL_PROVIDER=fake
+اجرا کنید؛ رفتار مدل با FAKE_LLM_* تنظیم می‌شه (app/fake_llm.py).
+
+خطاها به تفکیک نوع شمرده می‌شن: http_<code>، خطای شبکه/timeout، {"error": ...} در بدنه،
+event: error یا نرسیدن event: done در استریم، و جواب fallback ژنراتور (یعنی فراخوانی مدل
+شکست خورده).
+
+در حالت حلقه‌ی باز، latency از زمان *برنامه‌ریزی‌شده‌ی* ارسال حساب می‌شه تا صف شدن
+درخواست‌ها پشت سرور کند پنهان نمونه (coordinated omission).
+
+نکته: ASGITransport پاسخ رو کامل بافر می‌کنه، پس زمان اولین توکن فقط با --url معنا داره.
+
+مثال:
+    MODEL_PROVIDER=fake FAKE_LLM_LATENCY=lognormal:600:0.5 \\
+        python -m app.loadtest --app app.main:app --endpoint /chat --concurrency 64 --duration 30
+    python -m app.loadtest --url http://127.0.0.1:8000 --endpoint /chat/stream --rps 50 --duration 60
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+DEFAULT_QUERIES = [
+    "سلام",
+    "اصول مذاکره رو بگو",
+    "تعریف تمرکز چیه؟",
+    "چطور برای محصول جدیدم قیمت تعیین کنم؟",
+    "وقتی مشتری میگه گرونه چی جواب بدم؟",
+    "برای رشد یک کسب‌وکار کوچک آنلاین از کجا شروع کنم؟",
+    "چند تا نکته برای مدیریت زمان بگو",
+    "تیمم انگیزه نداره، چیکار کنم؟",
+    "فرق استراتژی و تاکتیک چیه؟",
+    "چطور اولین مشتری‌هامو پیدا کنم؟",
+    "بهره‌وری یعنی چی",
+    "برای مذاکره‌ی حقوق با کارفرما چطور آماده بشم؟",
+]
+
+# env هایی که رفتار اجرا رو تعیین می‌کنن؛ کنار نتیجه ذخیره می‌شن
+_ENV_KEYS = ("MODEL_PROVIDER", "APP_EXECUTOR_WORKERS", "SEMANTIC_CACHE_ENABLED")
+_ENV_PREFIXES = ("FAKE_LLM_", "CONTEXT_BUDGET_")
+
+
+# ---------- corpus ----------
+def load_queries(path: Optional[str]) -> List[str]:
+    """فایل txt (هر خط یک سؤال) یا jsonl (کلید message / query / question)."""
+    if not path:
+        return list(DEFAULT_QUERIES)
+    out: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                text = obj.get("message") or obj.get("query") or obj.get("question") if isinstance(obj, dict) else None
+                if text:
+                    out.append(str(text))
+            else:
+                out.append(line)
+    if not out:
+        raise SystemExit(f"no queries in {path}")
+    return out
+
+
+def _fallback_answers() -> List[str]:
+    try:
+        from app.generator import _FALLBACK_LLM_ERROR, _FALLBACK_NO_KEY
+        return [_FALLBACK_LLM_ERROR, _FALLBACK_NO_KEY]
+    except Exception:
+        return []
+
+
+# ---------- کلاینت ----------
+def make_client(args: argparse.Namespace):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits)
+    module_name, _, attr = args.app.partition(":")
+    app = getattr(importlib.import_module(module_name), attr or "app")
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://loadtest",
+        timeout=args.timeout,
+        limits=limits,
+    )
+
+
+async def _one(client, args: argparse.Namespace, message: str, t0: float, fallbacks: List[str]) -> Dict[str, Any]:
+    body = dict(args.payload)
+    body["message"] = message
+    rec: Dict[str, Any] = {"status": None, "error": None, "ttft_ms": None}
+    answer = ""
+    try:
+        if args.stream:
+            event = ""
+            done = False
+            parts: List[str] = []
+            async with client.stream("POST", args.endpoint, json=body) as resp:
+                rec["status"] = resp.status_code
+                async for line in resp.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        if event == "token":
+                            if rec["ttft_ms"] is None:
+                                rec["ttft_ms"] = (time.perf_counter() - t0) * 1000.0
+                            parts.append(json.loads(line[5:]).get("delta", ""))
+                        elif event == "error":
+                            rec["error"] = "sse_error"
+                        elif event == "done":
+                            done = True
+            answer = "".join(parts).strip()
+            if rec["error"] is None and not done and 200 <= resp.status_code < 300:
+                rec["error"] = "sse_incomplete"
+        else:
+            resp = await client.post(args.endpoint, json=body)
+            rec["status"] = resp.status_code
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {}
+            if isinstance(data, dict):
+                if data.get("error"):
+                    rec["error"] = "app_error"
+                answer = str(data.get("answer") or data.get("response") or "").strip()
+    except Exception as e:
+        rec["error"] = type(e).__name__
+    rec["latency_ms"] = (time.perf_counter() - t0) * 1000.0
+
+    if rec["error"] is None:
+        if rec["status"] is not None and not (200 <= rec["status"] < 300):
+            rec["error"] = f"http_{rec['status']}"
+        elif answer in fallbacks:
+            rec["error"] = "llm_fallback"
+    return rec
+
+
+# ---------- حلقه‌های بار ----------
+async def run_closed(client, args, queries: List[str], fallbacks: List[str]) -> List[Dict[str, Any]]:
+    """concurrency تا کاربر، هر کدوم بلافاصله بعد از جواب درخواست بعدی رو می‌فرسته."""
+    results: List[Dict[str, Any]] = []
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    counter = {"sent": 0}
+
+    async def _user() -> None:
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if args.requests and counter["sent"] >= args.requests:
+                return
+            counter["sent"] += 1
+            msg = rng.choice(queries) if args.shuffle else queries[counter["sent"] % len(queries)]
+            results.append(await _one(client, args, msg, time.perf_counter(), fallbacks))
+
+    await asyncio.gather(*[_user() for _ in range(args.concurrency)])
+    return results
+
+
+async def run_open(client, args, queries: List[str], fallbacks: List[str]) -> List[Dict[str, Any]]:
+    """درخواست‌ها با نرخ ثابت (یا پواسون) فرستاده می‌شن، مستقل از سرعت جواب دادن سرور."""
+    rng = random.Random(args.seed)
+    total = args.requests or int(args.rps * (args.duration or 10))
+    tasks = []
+    start = time.perf_counter()
+    scheduled = start
+    for i in range(total):
+        scheduled += rng.expovariate(args.rps) if args.poisson else 1.0 / args.rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        msg = rng.choice(queries) if args.shuffle else queries[i % len(queries)]
+        tasks.append(asyncio.ensure_future(_one(client, args, msg, scheduled, fallbacks)))
+    return list(await asyncio.gather(*tasks))
+
+
+# ---------- گزارش ----------
+def _percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    import numpy as np
+
+    if not samples_ms:
+        return {}
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+        "mean_ms": round(float(arr.mean()), 3),
+    }
+
+
+def summarize(results: List[Dict[str, Any]], wall_sec: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["error"] is None]
+    errors: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    n = len(results)
+    return {
+        "requests": n,
+        "succeeded": len(ok),
+        "wall_sec": round(wall_sec, 3),
+        "throughput_rps": round(n / wall_sec, 3) if wall_sec > 0 else 0.0,
+        "goodput_rps": round(len(ok) / wall_sec, 3) if wall_sec > 0 else 0.0,
+        "error_rate": round((n - len(ok)) / n, 4) if n else 0.0,
+        "errors": errors,
+        "status_codes": statuses,
+        "latency": _percentiles([r["latency_ms"] for r in ok]),
+        "latency_all": _percentiles([r["latency_ms"] for r in results]),
+        "ttft": _percentiles([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    queries = load_queries(args.corpus)
+    fallbacks = _fallback_answers()
+    async with make_client(args) as client:
+        if args.warmup:
+            await asyncio.gather(*[
+                _one(client, args, queries[i % len(queries)], time.perf_counter(), fallbacks)
+                for i in range(args.warmup)
+            ])
+        t0 = time.perf_counter()
+        if args.rps:
+            results = await run_open(client, args, queries, fallbacks)
+        else:
+            results = await run_closed(client, args, queries, fallbacks)
+        wall = time.perf_counter() - t0
+
+    env = {k: v for k, v in os.environ.items() if k in _ENV_KEYS or k.startswith(_ENV_PREFIXES)}
+    return {
+        "target": args.url or args.app,
+        "endpoint": args.endpoint,
+        "load": {"rps": args.rps, "poisson": args.poisson} if args.rps else {"concurrency": args.concurrency},
+        "corpus_size": len(queries),
+        "env": env,
+        "summary": summarize(results, wall),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="تست بار end-to-end برای /chat و /chat/stream")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default=None, help="آدرس سرور در حال اجرا")
+    target.add_argument("--app", default="app.main:app", help="ماژول:متغیر اپ ASGI برای اجرای درون process")
+    parser.add_argument("--endpoint", default="/chat")
+    parser.add_argument("--corpus", default=None, help="فایل سؤال‌ها (.txt یا .jsonl)")
+    parser.add_argument("--payload", default="{}", help='فیلدهای اضافه‌ی بدنه، مثلاً {"mode": "deep"}')
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rps", type=float, default=0.0, help="اگر داده بشه، حلقه‌ی باز با این نرخ")
+    parser.add_argument("--poisson", action="store_true", help="فاصله‌ی ورود نمایی (به جای ثابت)")
+    parser.add_argument("--duration", type=float, default=30.0, help="ثانیه؛ 0 یعنی فقط --requests")
+    parser.add_argument("--requests", type=int, default=0, help="سقف تعداد درخواست")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--out", default=os.path.join("bench_results", "loadtest.json"))
+    parser.add_argument("--max-error-rate", type=float, default=None, help="بالاتر از این، exit code 1")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="بالاتر از این، exit code 1")
+    args = parser.parse_args(argv)
+
+    args.payload = json.loads(args.payload)
+    args.stream = args.endpoint.rstrip("/").endswith("/stream")
+    if not args.duration and not args.requests:
+        parser.error("one of --duration or --requests is required")
+
+    report = asyncio.run(run(args))
+    summary = report["summary"]
+    failures = []
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        failures.append(f"error_rate {summary['error_rate']} > {args.max_error_rate}")
+    p95 = summary["latency"].get("p95_ms")
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 {p95} ms > {args.max_p95_ms} ms")
+    report["failures"] = failures
+
+    out_path = Path(args.out)
+    if not out_path.is_absolute():
+        out_path = ROOT / out_path
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"[loadtest] results written to {out_path}")
+    for msg in failures:
+        print(f"[loadtest] FAIL: {msg}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
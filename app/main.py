@@ -1,20 +1,42 @@
 #FEYZ
 #DEO
+# warmup اول از همه import می‌شه تا زمان import بقیه‌ی اپ رو اندازه بگیره
+from app import warmup
+
 import os
+from contextlib import asynccontextmanager
 from typing import Literal
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from app.generator import get_provider
+from app.llm_client import achat_completions_create
+from app.singleflight import get_flight
+
+from app.retriever import start_index_watcher
+from app.router_admin import router as admin_router
+from app.router_chat import router as chat_router
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai").strip().lower()
 MODEL_CHEAP = os.getenv("OPENAI_MODEL_CHEAP", "gpt-4o-mini")
 MODEL_DEEP = os.getenv("OPENAI_MODEL_DEEP", "gpt-4o")
 
-app = FastAPI(title="Amin Mentor API", version="2.0.0")
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # اگر RETRIEVER_WATCH_INTERVAL (ثانیه) ست باشه، تغییر فایل‌های data/ خودکار وارد ایندکس می‌شه
+    start_index_watcher(float(os.getenv("RETRIEVER_WATCH_INTERVAL", "0") or 0))
+    # مدل، ایندکس و کش‌ها قبل از اولین کاربر لود می‌شن (WARMUP_ON_STARTUP=0 خاموشش می‌کنه)
+    warmup.start_warmup()
+    yield
+
+
+app = FastAPI(title="Amin Mentor API", version="2.0.0", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,30 +46,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(admin_router)
+
+
 @app.get("/")
 def root():
     return {"status": "ok", "message": "Amin Mentor API is running successfully 🚀"}
 
+@app.get("/ready")
+def ready():
+    # liveness همون / هست؛ این یکی تا تموم شدن warm-up ‏503 می‌ده
+    state = warmup.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
 class ChatRequest(BaseModel):
     message: str
     mode: Literal["cheap", "deep"] = "cheap"
 
+
+_CHAT_FLIGHT = get_flight("chat")
+
+async def _provider_chat(request: ChatRequest, model_name: str) -> dict:
+    # MODEL_PROVIDER=fake و ... (تست بار): همون provider های generator، بدون کلید OpenAI
+    provider = get_provider(MODEL_PROVIDER)
+    if provider is None:
+        return {"error": f"Unknown MODEL_PROVIDER: {MODEL_PROVIDER}"}
+    try:
+        answer = await _CHAT_FLIGHT.ado(
+            f"{MODEL_PROVIDER}::{request.mode}##{request.message.strip()}",
+            lambda: provider.acomplete(
+                api_key=OPENAI_API_KEY or "",
+                model_name=model_name,
+                prompt=request.message,
+                max_tokens=512,
+                temperature=0.3,
+                tier=request.mode,
+            ),
+        )
+        warmup.mark_first_answer()
+        return {"response": answer}
+    except Exception as e:
+        return {"error": str(e)}
+
+
 @app.post("/chat")
 async def chat(request: ChatRequest):
+    model_name = MODEL_DEEP if request.mode == "deep" else MODEL_CHEAP
+    if MODEL_PROVIDER != "openai":
+        return await _provider_chat(request, model_name)
+
     if not OPENAI_API_KEY:
         return {"error": "Missing OPENAI_API_KEY in Render Environment"}
-    
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    model_name = MODEL_DEEP if request.mode == "deep" else MODEL_CHEAP
 
     try:
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": request.message}],
+        # کلاینت async مشترک: event loop بلاک نمی‌شه و اتصال‌ها keep-alive می‌مونن.
+        # پیام‌های یکسانِ هم‌زمان (همون mode) فقط یک فراخوانی مدل می‌فرستن.
+        completion = await _CHAT_FLIGHT.ado(
+            f"{request.mode}##{request.message.strip()}",
+            lambda: achat_completions_create(
+                OPENAI_API_KEY,
+                tier=request.mode,
+                model=model_name,
+                messages=[{"role": "user", "content": request.message}],
+            ),
         )
         answer = completion.choices[0].message.content
+        warmup.mark_first_answer()
         return {"response": answer}
     except Exception as e:
         return {"error": str(e)}
 
+
+# /chat/stream (SSE) از router_chat میاد
+app.include_router(chat_router)
+
+warmup.mark_imported()
+
 #DEO
@@ -0,0 +1,88 @@
+# app/quantize.py
+# فشرده‌سازی بردارهای corpus برای امتیازدهی اولیه (float16 یا int8 با scale جدا برای هر بُعد)
+#
+# ایده: امتیاز تقریبی همه‌ی چانک‌ها از روی نسخه‌ی فشرده (۲ یا ۴ برابر کم‌حجم‌تر) حساب می‌شه،
+# بعد فقط یک shortlist کوتاه با بردارهای float32 اصلی (که روی دیسک mmap شدن) دوباره امتیاز می‌گیره.
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+# برای اینکه موقع ضرب، کپی float32 کل ماتریس ساخته نشه، بلاک‌بلاک جلو می‌ریم
+_ROW_BLOCK = 16384
+
+
+class CompressedVectors:
+    def __init__(
+        self,
+        dtype: str,
+        codes: np.ndarray,
+        scale: Optional[np.ndarray] = None,
+        offset: Optional[np.ndarray] = None,
+    ):
+        self.dtype = dtype
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, dtype: str) -> "CompressedVectors":
+        if dtype == "float16":
+            return cls("float16", np.asarray(vectors, dtype=np.float16))
+        if dtype == "int8":
+            # کوانتیزه‌سازی خطی هر بُعد به 256 سطح: x ≈ (code + 128) * scale + offset
+            vmin = np.asarray(vectors.min(axis=0), dtype=np.float32)
+            vmax = np.asarray(vectors.max(axis=0), dtype=np.float32)
+            scale = (vmax - vmin) / 255.0
+            scale[scale == 0] = 1.0
+            codes = np.empty(vectors.shape, dtype=np.int8)
+            for start in range(0, vectors.shape[0], _ROW_BLOCK):
+                block = np.asarray(vectors[start:start + _ROW_BLOCK], dtype=np.float32)
+                q = np.rint((block - vmin) / scale) - 128.0
+                codes[start:start + _ROW_BLOCK] = np.clip(q, -128, 127).astype(np.int8)
+            return cls("int8", codes, scale=scale, offset=vmin)
+        raise ValueError(f"unknown vector dtype {dtype!r}; expected one of {VECTOR_DTYPES}")
+
+    @property
+    def nbytes(self) -> int:
+        extra = 0
+        if self.scale is not None:
+            extra += self.scale.nbytes + self.offset.nbytes
+        return int(self.codes.nbytes + extra)
+
+    def scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        امتیاز تقریبی (ضرب داخلی) برای هر کوئری در برابر همه‌ی سطرها (یا فقط rows)؛
+        خروجی (m, n) با float32.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        codes = self.codes if rows is None else self.codes[rows]
+        n = codes.shape[0]
+        out = np.empty((queries.shape[0], n), dtype=np.float32)
+
+        if self.dtype == "int8":
+            # q·x = (q*scale)·code + 128 * Σ(q*scale) + q·offset
+            qs = queries * self.scale
+            bias = 128.0 * qs.sum(axis=1) + queries @ self.offset
+            for start in range(0, n, _ROW_BLOCK):
+                block = codes[start:start + _ROW_BLOCK].astype(np.float32)
+                out[:, start:start + _ROW_BLOCK] = qs @ block.T + bias[:, None]
+            return out
+
+        for start in range(0, n, _ROW_BLOCK):
+            block = codes[start:start + _ROW_BLOCK].astype(np.float32)
+            out[:, start:start + _ROW_BLOCK] = queries @ block.T
+        return out
+
+    def describe(self, full_dtype_bytes: int = 4) -> Dict[str, Any]:
+        full = int(self.codes.shape[0] * self.codes.shape[1] * full_dtype_bytes)
+        return {
+            "dtype": self.dtype,
+            "float32_bytes": full,
+            "compressed_bytes": self.nbytes,
+            "saved_bytes": full - self.nbytes,
+            "ratio": (full / self.nbytes) if self.nbytes else 0.0,
+        }
@@ -2,13 +2,29 @@
 from __future__ import annotations
 import os
 import glob
+import hashlib
+import json
+import threading
+import time
 from functools import lru_cache
-from typing import List, Dict, Any, Tuple
+from typing import TYPE_CHECKING, Awaitable, List, Dict, Any, Optional, Tuple
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from numpy.linalg import norm
 
+from app import faiss_backend, pgvector_backend
+from app.bm25 import BM25Index, corpus_fingerprint
+from app.chunk_store import ChunkStore, ChunkStoreWriter, is_chunk_store, split_source_label
+from app.embed_cache import EmbeddingCache
+from app.encoder import BatchingEncoder, QueryEmbeddingCache
+from app.executor import get_executor
+from app.quantize import VECTOR_DTYPES, CompressedVectors
+from app.singleflight import get_flight
+from app.text_norm import normalize_text
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 
 # ========== ۱. مسیرهای ممکن برای داده‌ها ==========
 # ما سعی می‌کنیم داده‌ها رو از این پوشه‌ها بخونیم:
@@ -25,137 +41,896 @@ CHUNK_SEPARATOR = "\n\n"  # یعنی پاراگراف‌ها با خط خالی
 TOP_K_DEFAULT = 5
 EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
+# کش دائمی امبدینگ‌ها (کلید: مدل + hash چانک) تا هر بار بالا اومدن worker کل corpus encode نشه
+EMBED_CACHE_DIR = os.getenv(
+    "EMBED_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "faiss_index", "emb_cache"),
+)
+
+# backend جست‌وجو:
+# - "numpy": امبدینگ چانک‌های data/ و جست‌وجوی دقیق با ضرب ماتریسی (پیش‌فرض)
+# - "faiss": سرو از artifact ساخته‌شده با ingest/build_faiss.py (flat / ivf / hnsw)
+# - "pgvector": بردارها در Postgres (PGVECTOR_DSN، جدول infra/init.sql)، مشترک بین همه‌ی node ها؛
+#   با ingest/index.py --pgvector-dsn پر می‌شه. nprobe همون ivfflat.probes است
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "numpy").strip().lower()
+FAISS_INDEX_DIR = os.getenv(
+    "FAISS_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "faiss_index"),
+)
+
+# حالت بازیابی:
+# - "dense":   فقط امبدینگ (رفتار قبلی)
+# - "lexical": فقط BM25 روی متن نرمال‌شده‌ی فارسی؛ مدل امبدینگ اصلاً لود نمی‌شه
+# - "hybrid":  ترکیب هر دو با reciprocal-rank fusion
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "dense").strip().lower()
+RRF_K = 60  # ثابت استاندارد RRF
+BM25_FILE = "bm25.npz"
+# انبار باینری چانک‌های data/ (backend numpy) کنار کش امبدینگ؛ وقتی hash فایل‌ها عوض نشده
+# باشه متن‌ها دیگه parse نمی‌شن و همه‌ی worker ها همون فایل‌ها رو mmap می‌کنن
+CHUNK_STORE_DIR = os.path.join(EMBED_CACHE_DIR, "chunks")
+# آینه‌ی محلی متن‌ها / متادیتای جدول pgvector (برای BM25، facet ها و ساختن hit)
+PGVECTOR_MIRROR_DIR = os.path.join(EMBED_CACHE_DIR, "pgvector")
+
+# micro-batching کوئری‌ها: کوئری‌هایی که در این پنجره (میلی‌ثانیه) یا تا این سقف می‌رسن
+# با یک forward pass encode می‌شن. پنجره‌ی 0 یعنی بدون batching (مستقیم model.encode).
+ENCODER_BATCH_WINDOW_MS = float(os.getenv("ENCODER_BATCH_WINDOW_MS", "3"))
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", "32"))
+ENCODER_TORCH_THREADS = int(os.getenv("ENCODER_TORCH_THREADS", "0")) or None
+
+# کش LRU بردار کوئری‌ها (کلید: متن نرمال‌شده‌ی فارسی). اندازه‌ی 0 یعنی غیرفعال.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_SEC = float(os.getenv("QUERY_CACHE_TTL_SEC", "3600"))
+
+# نگهداری بردارهای corpus در حافظه (backend numpy):
+# - "float32": همون ماتریس mmapشده، جست‌وجوی دقیق
+# - "float16" / "int8": امتیاز اولیه روی نسخه‌ی فشرده، بعد rerank دقیق فقط روی
+#   top_k * RETRIEVER_RERANK_MULTIPLIER کاندید با بردارهای float32 (که روی دیسک می‌مونن)
+RETRIEVER_VECTOR_DTYPE = os.getenv("RETRIEVER_VECTOR_DTYPE", "float32").strip().lower()
+RETRIEVER_RERANK_MULTIPLIER = int(os.getenv("RETRIEVER_RERANK_MULTIPLIER", "10"))
+
+# فیلدهای متادیتای رکوردهای JSONL (خروجی data/convert_abzaar_to_jsonl.py) که برای فیلتر
+# ایندکس می‌شن؛ برای هر مقدار، آرایه‌ی مرتب شماره‌سطرها از قبل ساخته می‌شه.
+FACETS = ("domain", "skill", "level", "chapter", "language")
+
 
 def _debug(msg: str):
     # اگر لازم شد می‌تونی این رو silent کنی برای Cloud
     print(f"[retriever] {msg}")
 
 
-# ========== ۳. خواندن همه فایل‌های .txt از مسیرهای معتبر ==========
-def _load_raw_chunks_from_dirs() -> List[Tuple[str, str]]:
+# ========== ۳. خواندن همه فایل‌های .txt / .jsonl از مسیرهای معتبر ==========
+def _list_data_files() -> List[str]:
+    paths: List[str] = []
+    for candidate_dir in CANDIDATE_DATA_DIRS:
+        if not os.path.isdir(candidate_dir):
+            continue
+        paths.extend(sorted(glob.glob(os.path.join(candidate_dir, "*.txt"))))
+        paths.extend(sorted(glob.glob(os.path.join(candidate_dir, "*.jsonl"))))
+    return paths
+
+
+def _read_jsonl_records(path: str) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    هر خط {"text": ..., "metadata": {...}}؛ خط‌هایی که text ندارن (مثل summary آخر فایل) رد می‌شن.
     """
-    خروجی: لیست تاپل‌های (chunk_text, source_info)
+    records: List[Tuple[str, str, Dict[str, Any]]] = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                text = (rec.get("text") or "").strip() if isinstance(rec, dict) else ""
+                if not text:
+                    continue
+                meta = rec.get("metadata") if isinstance(rec.get("metadata"), dict) else {}
+                records.append((text, f"{os.path.basename(path)}[chunk:{len(records)}]", meta))
+    except Exception as e:
+        _debug(f"failed reading {path}: {e}")
+    return records
+
+
+def _read_file_chunks(path: str) -> List[Tuple[str, str, Dict[str, Any]]]:
+    if path.endswith(".jsonl"):
+        return _read_jsonl_records(path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            full_text = f.read().strip()
+    except Exception as e:
+        _debug(f"failed reading {path}: {e}")
+        return []
+
+    # بر اساس خط خالی split می‌کنیم تا پاراگراف‌های معنادار بسازیم
+    raw_chunks = [c.strip() for c in full_text.split(CHUNK_SEPARATOR) if c.strip()]
+    return [(ch, f"{os.path.basename(path)}[chunk:{idx}]", {}) for idx, ch in enumerate(raw_chunks)]
+
+
+def _load_raw_chunks_from_dirs(paths: Optional[List[str]] = None) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    خروجی: لیست تاپل‌های (chunk_text, source_info, metadata)
     - chunk_text: متن هر تکه
     - source_info: منبع (نام فایل و شماره‌ی چانک)
+    - metadata: متادیتای رکورد (فقط برای .jsonl؛ برای .txt خالی)
     """
-    chunks: List[Tuple[str, str]] = []
+    if paths is None:
+        paths = _list_data_files()
 
-    for candidate_dir in CANDIDATE_DATA_DIRS:
-        if not os.path.isdir(candidate_dir):
-            continue
+    chunks: List[Tuple[str, str, Dict[str, Any]]] = []
+    for path in paths:
+        chunks.extend(_read_file_chunks(path))
+    return chunks
 
-        _debug(f"checking data dir: {candidate_dir}")
-        txt_files = glob.glob(os.path.join(candidate_dir, "*.txt"))
 
-        for path in txt_files:
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    full_text = f.read().strip()
-            except Exception as e:
-                _debug(f"failed reading {path}: {e}")
-                continue
+def _file_hash(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
 
-            # بر اساس خط خالی split می‌کنیم تا پاراگراف‌های معنادار بسازیم
-            raw_chunks = [c.strip() for c in full_text.split(CHUNK_SEPARATOR) if c.strip()]
 
-            for idx, ch in enumerate(raw_chunks):
-                source_info = f"{os.path.basename(path)}[chunk:{idx}]"
-                chunks.append((ch, source_info))
+def _use_faiss() -> bool:
+    if RETRIEVER_BACKEND != "faiss":
+        return False
+    if not faiss_backend.is_available(FAISS_INDEX_DIR):
+        _debug(f"faiss backend requested but no usable artifact in {FAISS_INDEX_DIR}; falling back to numpy")
+        return False
+    return True
 
-    return chunks
+
+def _use_pgvector() -> bool:
+    if RETRIEVER_BACKEND != "pgvector":
+        return False
+    if not pgvector_backend.is_available(pgvector_backend.PGVECTOR_DSN):
+        _debug("pgvector backend requested but database/driver unavailable; falling back to numpy")
+        return False
+    return True
+
+
+def _watched_files() -> List[str]:
+    # با backend faiss، خود artifact منبع ایندکسه؛ در غیر این صورت فایل‌های data/
+    if _use_faiss():
+        return list(faiss_backend.artifact_paths(FAISS_INDEX_DIR))
+    return _list_data_files()
+
+
+def _scan_files(previous: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    وضعیت فعلی فایل‌های منبع ایندکس: {path: {"mtime_ns", "size", "sha1"}}
+    اگر mtime و size عوض نشده باشن hash قبلی رو دوباره استفاده می‌کنیم تا فایل دوباره خونده نشه.
+    """
+    previous = previous or {}
+    key = f"pgvector://{pgvector_backend.PGVECTOR_TABLE}"
+    # وقتی ایندکس فعلی از pgvector است، قطعی موقت دیتابیس خطا می‌ده (watcher ایندکس قبلی رو
+    # نگه می‌داره) نه اینکه بی‌صدا به numpy برگرده
+    if key in previous or _use_pgvector():
+        # منبع ایندکس خود جدوله؛ امضای (تعداد، بزرگ‌ترین id) جای hash فایل
+        return {key: {"mtime_ns": 0, "size": 0, "sha1": pgvector_backend.table_signature()}}
+    state: Dict[str, Dict[str, Any]] = {}
+    for path in _watched_files():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        old = previous.get(path)
+        if old and old["mtime_ns"] == st.st_mtime_ns and old["size"] == st.st_size:
+            state[path] = old
+            continue
+        try:
+            digest = _file_hash(path)
+        except OSError as e:
+            _debug(f"failed hashing {path}: {e}")
+            continue
+        state[path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": digest}
+    return state
 
 
 # ========== ۴. ساخت امبدینگ‌ها (lazy, cache) ==========
 @lru_cache(maxsize=1)
-def _get_model() -> SentenceTransformer:
+def _get_model() -> "SentenceTransformer":
+    # import اینجاست تا حالت lexical اصلاً torch / sentence_transformers رو لود نکنه
+    from sentence_transformers import SentenceTransformer
+
     _debug(f"loading embedding model: {EMBED_MODEL_NAME}")
     return SentenceTransformer(EMBED_MODEL_NAME)
 
 
-@lru_cache(maxsize=1)
-def _get_index() -> Dict[str, Any]:
+def _encode_chunks(texts: List[str]) -> np.ndarray:
+    # فقط برای چانک‌هایی صدا زده می‌شه که تو کش دیسک نیستن
+    model = _get_model()
+    _debug(f"embedding {len(texts)} chunks...")
+    embs = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+    # یک بار موقع ساخت ایندکس نرمال می‌کنیم تا موقع جست‌وجو فقط ضرب داخلی لازم باشه
+    return _normalize_rows(embs)
+
+
+def _load_or_build_bm25(chunks: List[str], store_dir: str, fingerprint: Optional[str] = None) -> BM25Index:
+    """
+    ایندکس BM25 رو اگر برای همین corpus قبلاً ساخته شده باشه از دیسک می‌خونه، وگرنه می‌سازه و ذخیره می‌کنه.
+    fingerprint آماده (مثلاً از manifest انبار چانک‌ها) از hash دوباره‌ی همه‌ی متن‌ها جلوگیری می‌کنه.
+    """
+    fingerprint = fingerprint or corpus_fingerprint(chunks)
+    path = os.path.join(store_dir, BM25_FILE)
+    try:
+        if os.path.isfile(path):
+            bm25 = BM25Index.load(path)
+            if bm25.fingerprint == fingerprint:
+                return bm25
+    except Exception as e:
+        _debug(f"ignoring unreadable bm25 index {path}: {e}")
+
+    bm25 = BM25Index.build(chunks, fingerprint=fingerprint)
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        bm25.save(tmp)
+        os.replace(tmp, path)
+    except Exception as e:
+        _debug(f"could not persist bm25 index to {path}: {e}")
+    return bm25
+
+
+_EMBED_LOCK = threading.Lock()
+
+
+def _ensure_embeddings(idx: Dict[str, Any]) -> np.ndarray:
+    """
+    امبدینگ چانک‌ها (backend numpy) فقط وقتی ساخته می‌شن که واقعاً جست‌وجوی dense لازم باشه؛
+    در حالت lexical هیچ‌وقت به اینجا نمی‌رسیم و مدل لود نمی‌شه.
+    """
+    embs = idx.get("embeddings")
+    if embs is not None:
+        return embs
+    with _EMBED_LOCK:
+        if idx.get("embeddings") is None:
+            embs, stats = EmbeddingCache(EMBED_CACHE_DIR, EMBED_MODEL_NAME).get_or_encode(
+                idx["chunks"], _encode_chunks
+            )
+            _debug(f"embeddings ready: {stats['cached']} chunks from cache, {stats['encoded']} newly embedded")
+            if RETRIEVER_VECTOR_DTYPE != "float32" and len(idx["chunks"]) > 0:
+                if RETRIEVER_VECTOR_DTYPE not in VECTOR_DTYPES:
+                    raise ValueError(f"unknown RETRIEVER_VECTOR_DTYPE {RETRIEVER_VECTOR_DTYPE!r}")
+                compressed = CompressedVectors.build(embs, RETRIEVER_VECTOR_DTYPE)
+                idx["compressed"] = compressed
+                _debug(f"compressed vectors: {compressed.describe()}")
+            idx["embeddings"] = embs
+        return idx["embeddings"]
+
+
+def _facet_values(value: Any) -> List[str]:
+    # چانک ادغام‌شده از چند تکراری (ingest/dedup) برای یک facet لیست مقدار داره
+    values = value if isinstance(value, list) else [value]
+    return list(dict.fromkeys(normalize_text(str(v)) for v in values if v is not None and v != ""))
+
+
+def _build_facets(
+    metadatas: List[Dict[str, Any]],
+    store: Optional[ChunkStore] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    {facet: {value: آرایه‌ی مرتب int32 از شماره‌سطرها}}
+    value نرمال‌شده است (normalize_text) تا "هدف‌گذاری" و "هدفگذاری" یک فیلتر باشن.
+    موقع جست‌وجو فیلترها با اشتراک همین آرایه‌ها حل می‌شن، بدون اسکن متادیتا.
+    با انبار چانک، فقط متادیتاهای یکتا بررسی می‌شن و سطرها از ستون meta_ids درمیان.
+    """
+    if store is not None:
+        return _build_facets_from_store(store)
+    lists: Dict[str, Dict[str, List[int]]] = {f: {} for f in FACETS}
+    for row, meta in enumerate(metadatas):
+        for facet in FACETS:
+            for value in _facet_values(meta.get(facet)):
+                lists[facet].setdefault(value, []).append(row)
+    return {
+        facet: {value: np.asarray(rows, dtype=np.int32) for value, rows in values.items()}
+        for facet, values in lists.items()
+    }
+
+
+def _build_facets_from_store(store: ChunkStore) -> Dict[str, Dict[str, np.ndarray]]:
+    ids: Dict[str, Dict[str, List[int]]] = {f: {} for f in FACETS}
+    for meta_id, meta in enumerate(store.metadata_values):
+        for facet in FACETS:
+            for value in _facet_values(meta.get(facet)):
+                ids[facet].setdefault(value, []).append(meta_id)
+    meta_ids = np.asarray(store.meta_ids)
+    return {
+        facet: {value: np.flatnonzero(np.isin(meta_ids, wanted)).astype(np.int32) for value, wanted in values.items()}
+        for facet, values in ids.items()
+    }
+
+
+def _files_key(files: Dict[str, Dict[str, Any]]) -> str:
+    h = hashlib.sha1()
+    for path in sorted(files):
+        h.update(f"{os.path.basename(path)}\0{files[path]['sha1']}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _load_or_build_store(files: Dict[str, Dict[str, Any]]) -> ChunkStore:
+    """
+    انبار mmap چانک‌های data/؛ فقط وقتی فایل‌ها (hash) عوض شده باشن دوباره parse و نوشته می‌شه.
+    """
+    key = _files_key(files)
+    try:
+        if is_chunk_store(CHUNK_STORE_DIR):
+            store = ChunkStore.open(CHUNK_STORE_DIR)
+            if store.manifest.get("files_key") == key:
+                return store
+    except Exception as e:
+        _debug(f"ignoring unreadable chunk store {CHUNK_STORE_DIR}: {e}")
+
+    data_pairs = _load_raw_chunks_from_dirs(list(files.keys()))
+    with ChunkStoreWriter(CHUNK_STORE_DIR, extra={"files_key": key}) as writer:
+        for text, source, meta in data_pairs:
+            # "file.txt[chunk:3]" → ("file.txt", 3) تا جدول اسم منبع‌ها به اندازه‌ی تعداد فایل‌ها بمونه
+            name, chunk_idx = split_source_label(source)
+            writer.add(text, name, chunk_idx, meta)
+    _debug(f"chunk store written: {len(data_pairs)} chunks in {CHUNK_STORE_DIR}")
+    return writer.store
+
+
+def _build_index(files: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
     """
     خروجی این تابع:
     {
         "chunks": [ "متن چانک۱", "متن چانک۲", ...],
         "sources": [ "file.txt[chunk:0]", ...],
-        "embeddings": ndarray(float32) با شکل (N, dim)
+        "embeddings": ndarray(float32) با شکل (N, dim)، سطرها نرمال‌شده (طول ۱)
+        "bm25": BM25Index روی همین چانک‌ها
+        "metadatas": [ {"skill": ..., "level": ...}, {}, ...],
+        "facets": {facet: {value: row ids}} برای فیلتر
+        "store": ChunkStore که chunks / sources / metadatas نماهای روی اونن
+        "files": وضعیت فایل‌هایی که ایندکس ازشون ساخته شده (برای refresh)
     }
+    متن‌ها از انبار باینری (mmap) خونده می‌شن، نه لیست پایتونی جدا در هر worker.
+    امبدینگ‌ها از کش دیسک (mmap) میان و فقط چانک‌های جدید encode می‌شن.
+    با backend faiss به جای "embeddings" کلید "faiss" (ایندکس mmapشده) وجود داره و با pgvector
+    کلیدهای "pg" / "pg_ids" (بردارها فقط تو دیتابیس).
+    در حالت lexical امبدینگ‌ها ساخته نمی‌شن (تا اولین جست‌وجوی dense).
     """
-    data_pairs = _load_raw_chunks_from_dirs()
-    if not data_pairs:
-        _debug("no data found in either data/ or ingest/data/")
-        return {"chunks": [], "sources": [], "embeddings": np.zeros((0, 384), dtype="float32")}
+    if any(key.startswith("pgvector://") for key in files):
+        idx = pgvector_backend.load_index(PGVECTOR_MIRROR_DIR)
+        idx["files"] = files
+        idx["bm25"] = _load_or_build_bm25(idx["chunks"], PGVECTOR_MIRROR_DIR, idx["fingerprint"])
+        idx["facets"] = _build_facets(idx["metadatas"], idx["store"])
+        _debug(f"pgvector index ready: {len(idx['chunks'])} chunks ({idx['pg_signature']})")
+        return idx
 
-    chunks = [p[0] for p in data_pairs]
-    sources = [p[1] for p in data_pairs]
+    if _use_faiss():
+        idx = faiss_backend.load_index(FAISS_INDEX_DIR)
+        idx["files"] = files
+        idx["bm25"] = _load_or_build_bm25(idx["chunks"], FAISS_INDEX_DIR, idx.get("fingerprint"))
+        idx["facets"] = _build_facets(idx["metadatas"], idx.get("store"))
+        _debug(f"faiss index ready: {len(idx['chunks'])} chunks ({type(idx['faiss']).__name__})")
+        return idx
 
-    model = _get_model()
-    _debug(f"embedding {len(chunks)} chunks...")
-    embs = model.encode(chunks, convert_to_numpy=True, show_progress_bar=False).astype("float32")
+    store = _load_or_build_store(files) if files else None
+    if store is None or len(store) == 0:
+        _debug("no data found in either data/ or ingest/data/")
+        return {
+            "chunks": [],
+            "sources": [],
+            "embeddings": np.zeros((0, 384), dtype="float32"),
+            "bm25": BM25Index.build([]),
+            "metadatas": [],
+            "facets": _build_facets([]),
+            "files": files,
+        }
 
-    return {
-        "chunks": chunks,
-        "sources": sources,
-        "embeddings": embs,
+    idx: Dict[str, Any] = {
+        "chunks": store.texts,
+        "sources": store.sources,
+        "bm25": _load_or_build_bm25(store.texts, EMBED_CACHE_DIR, store.fingerprint),
+        "metadatas": store.metadatas,
+        "facets": _build_facets(store.metadatas, store),
+        "store": store,
+        "files": files,
     }
+    if RETRIEVER_MODE != "lexical":
+        _ensure_embeddings(idx)
+    return idx
+
+
+# ایندکس فعلی. خواننده‌ها فقط یک بار این reference رو می‌خونن و قفل نمی‌گیرن؛
+# refresh ایندکس جدید رو کنار می‌سازه و با یک assignment (اتمیک) جایگزین می‌کنه.
+_INDEX: Optional[Dict[str, Any]] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def _get_index() -> Dict[str, Any]:
+    idx = _INDEX
+    if idx is not None:
+        return idx
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _swap_index(_build_index(_scan_files()))
+        return _INDEX
+
+
+def _swap_index(new_index: Dict[str, Any]) -> None:
+    global _INDEX
+    _INDEX = new_index
+
+
+def refresh_index(force: bool = False) -> Dict[str, Any]:
+    """
+    فایل‌های CANDIDATE_DATA_DIRS رو با وضعیت ایندکس فعلی مقایسه می‌کنه (mtime و بعد hash).
+    اگر چیزی اضافه/حذف/عوض شده باشه، ایندکس جدید کنار ساخته می‌شه (فقط چانک‌های
+    تغییرکرده encode می‌شن) و بعد جای ایندکس قبلی می‌شینه. کوئری‌های در جریان
+    همون ایندکس قبلی رو تا آخر استفاده می‌کنن.
+    """
+    with _INDEX_LOCK:
+        current = _INDEX
+        old_files = current["files"] if current is not None else {}
+        new_files = _scan_files(old_files)
+
+        added = sorted(set(new_files) - set(old_files))
+        removed = sorted(set(old_files) - set(new_files))
+        changed = sorted(
+            p for p in set(new_files) & set(old_files)
+            if new_files[p]["sha1"] != old_files[p]["sha1"]
+        )
+
+        report: Dict[str, Any] = {
+            "added": [os.path.basename(p) for p in added],
+            "removed": [os.path.basename(p) for p in removed],
+            "changed": [os.path.basename(p) for p in changed],
+            "swapped": False,
+        }
+        if current is not None and not (force or added or removed or changed):
+            # حتی اگه محتوا عوض نشده، mtimeهای جدید رو نگه می‌داریم تا دفعه‌ی بعد hash لازم نشه
+            current["files"] = new_files
+            report["chunks"] = len(current["chunks"])
+            return report
+
+        t0 = time.time()
+        new_index = _build_index(new_files)
+        _swap_index(new_index)
+
+        report["swapped"] = True
+        report["chunks"] = len(new_index["chunks"])
+        report["took_ms"] = int((time.time() - t0) * 1000)
+        _debug(f"index swapped: {report}")
+        return report
+
+
+_WATCHER: Optional[threading.Thread] = None
+
+
+def start_index_watcher(interval_sec: float) -> None:
+    """
+    یک thread پس‌زمینه که هر interval_sec ثانیه refresh_index رو صدا می‌زنه.
+    فقط یک بار در هر پروسه راه می‌افته.
+    """
+    global _WATCHER
+    if interval_sec <= 0 or _WATCHER is not None:
+        return
+
+    def _loop():
+        while True:
+            time.sleep(interval_sec)
+            try:
+                refresh_index()
+            except Exception as e:
+                _debug(f"index watcher refresh failed: {e}")
+
+    _WATCHER = threading.Thread(target=_loop, name="retriever-index-watcher", daemon=True)
+    _WATCHER.start()
+    _debug(f"index watcher started (every {interval_sec}s)")
+
+
+def _backend_name(idx: Dict[str, Any]) -> str:
+    if "pg" in idx:
+        return "pgvector"
+    return "faiss" if "faiss" in idx else "numpy"
+
+
+def warm_up(encode: bool = True) -> Dict[str, Any]:
+    """
+    برای warm-up استارت اپ: ایندکس (mmap بردارها / faiss و BM25) رو لود می‌کنه و اگر encode،
+    مدل رو بالا میاره و یک جست‌وجوی dense ساختگی می‌زنه تا صفحه‌های mmap و kernelهای
+    torch قبل از اولین کاربر گرم بشن.
+    """
+    idx = _get_index()
+    out: Dict[str, Any] = {"chunks": len(idx["chunks"]), "backend": _backend_name(idx)}
+    if encode and idx["chunks"]:
+        t0 = time.perf_counter()
+        _dense_search(idx, ["warm-up"], 1)
+        out["dummy_search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return out
 
 
 # ========== ۵. شباهت کسینوسی و رتبه‌بندی ==========
-def _cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    # safe cosine similarity
-    denom = (norm(a) * norm(b))
-    if denom == 0:
-        return 0.0
-    return float(np.dot(a, b) / denom)
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """
+    هر سطر رو به طول ۱ می‌رسونیم تا شباهت کسینوسی بشه یک ضرب داخلی ساده.
+    سطرهای صفر همون صفر می‌مونن (مثل قبل که denom == 0 یعنی sim = 0).
+    """
+    mat = np.asarray(mat, dtype="float32")
+    if mat.ndim == 1:
+        mat = mat[None, :]
+    norms = norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (mat / norms).astype("float32", copy=False)
 
 
-def _search(query: str, top_k: int = TOP_K_DEFAULT) -> List[Dict[str, Any]]:
+def _top_k(distances: np.ndarray, top_k: int) -> np.ndarray:
     """
-    ورودی: query (سوال کاربر)
-    خروجی: لیست دیکشنری مثل:
-    {
-        "text": "...",
-        "source": "d.txt[chunk:0]",
-        "distance": 0.123  # هر چی کمتر باشه یعنی نزدیک‌تر؟
+    اندیس k تا کمترین distance، مرتب‌شده.
+    به جای sort کامل از argpartition استفاده می‌کنیم؛ برای تساوی‌ها
+    (مثل sort پایدار قبلی) اندیس کوچک‌تر جلوتر میاد.
+    """
+    n = distances.shape[0]
+    if top_k <= 0 or n == 0:
+        return np.zeros((0,), dtype=np.int64)
+    if top_k < n:
+        part = np.argpartition(distances, top_k - 1)[:top_k]
+        # همه‌ی اندیس‌هایی که با مرز k برابرن رو هم نگه می‌داریم تا tie-break دقیق باشه
+        cand = np.flatnonzero(distances <= distances[part].max())
+    else:
+        cand = np.arange(n)
+    order = np.lexsort((cand, distances[cand]))
+    return cand[order][:top_k]
+
+
+def _model_encode(texts: List[str]) -> np.ndarray:
+    return _get_model().encode(texts, convert_to_numpy=True, show_progress_bar=False)
+
+
+@lru_cache(maxsize=1)
+def _get_encoder() -> BatchingEncoder:
+    return BatchingEncoder(
+        _model_encode,
+        window_ms=ENCODER_BATCH_WINDOW_MS,
+        max_batch=ENCODER_MAX_BATCH,
+        torch_threads=ENCODER_TORCH_THREADS,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_query_cache() -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(max_size=QUERY_CACHE_SIZE, ttl_sec=QUERY_CACHE_TTL_SEC)
+
+
+def _encode_uncached(queries: List[str]) -> np.ndarray:
+    # کوئری تکی (مسیر /chat) از encoder مشترک رد می‌شه تا با درخواست‌های هم‌زمان batch بشه؛
+    # retrieve_many خودش batch هست و مستقیم encode می‌کنه.
+    if len(queries) == 1 and ENCODER_BATCH_WINDOW_MS > 0:
+        q_embs = _get_encoder().encode(queries[0])
+    else:
+        q_embs = _model_encode(queries)
+    return _normalize_rows(q_embs)
+
+
+def _encode_queries(queries: List[str]) -> np.ndarray:
+    """بردار نرمال‌شده‌ی کوئری‌ها؛ اول از کش LRU، بقیه با یک encode."""
+    cache = _get_query_cache()
+    cached = [cache.get(q) for q in queries]
+    missing = [i for i, v in enumerate(cached) if v is None]
+    if missing:
+        fresh = _encode_uncached([queries[i] for i in missing])
+        for row, i in enumerate(missing):
+            cache.put(queries[i], fresh[row])
+            cached[i] = fresh[row]
+    return np.vstack(cached).astype("float32", copy=False)
+
+
+def encode_query(query: str) -> np.ndarray:
+    """بردار نرمال‌شده‌ی یک کوئری (با کش و micro-batching)؛ برای ماژول‌های دیگه که همین بردار رو لازم دارن."""
+    return _encode_queries([query])[0]
+
+
+def query_cache_stats() -> Dict[str, Any]:
+    """hit / miss و اندازه‌ی کش بردار کوئری‌ها."""
+    return _get_query_cache().stats()
+
+
+def encoder_stats() -> Dict[str, Any]:
+    """آمار micro-batching encoder کوئری (اندازه‌ی batchهای دیده‌شده و ...)."""
+    return _get_encoder().stats()
+
+
+def _make_hit(idx: Dict[str, Any], i: int, distance: Optional[float]) -> Dict[str, Any]:
+    hit = {
+        "text": idx["chunks"][i],
+        "source": idx["sources"][i],
+        "distance": None if distance is None else float(distance),
     }
+    metadatas = idx.get("metadatas")
+    if metadatas and metadatas[i]:
+        hit["metadata"] = metadatas[i]
+    return hit
 
-    نکته: ما از شباهت کسینوسی استفاده می‌کنیم
-    ولی برای سازگاری با قبلی "distance" رو 1 - sim می‌ذاریم.
+
+def _filter_rows(idx: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """
+    filters مثل {"skill": "مذاکره و تصمیم‌گیری", "level": ["پایه", "متوسط"]} رو به آرایه‌ی مرتب
+    شماره‌سطرهای مجاز تبدیل می‌کنه (لیست = OR داخل یک facet، facetهای مختلف = AND).
+    None یعنی فیلتری نیست.
+    """
+    if not filters:
+        return None
+    facets = idx.get("facets") or {}
+    per_facet: List[np.ndarray] = []
+    for facet, wanted in filters.items():
+        if facet not in FACETS:
+            raise ValueError(f"unknown filter facet {facet!r}; expected one of {FACETS}")
+        values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+        arrays = [facets.get(facet, {}).get(normalize_text(str(v))) for v in values]
+        arrays = [a for a in arrays if a is not None]
+        if not arrays:
+            return np.zeros((0,), dtype=np.int32)
+        per_facet.append(arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays)))
+
+    # از کوچک‌ترین آرایه شروع می‌کنیم تا اشتراک‌ها ارزون‌تر بشن
+    per_facet.sort(key=len)
+    rows = per_facet[0]
+    for other in per_facet[1:]:
+        rows = np.intersect1d(rows, other, assume_unique=True)
+    return rows
+
+
+def _hits_for_row(
+    idx: Dict[str, Any],
+    distances: np.ndarray,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    # اگر rows داده شده، distances فقط برای همون زیرمجموعه است و موقعیت‌ها باید به شماره‌ی سطر برگردن
+    positions = _top_k(distances, top_k)
+    if rows is None:
+        return [_make_hit(idx, int(i), distances[i]) for i in positions]
+    return [_make_hit(idx, int(rows[p]), distances[p]) for p in positions]
+
+
+def _hits_for_ids(idx: Dict[str, Any], dists: np.ndarray, ids: np.ndarray) -> List[List[Dict[str, Any]]]:
+    # خروجی faiss / pgvector: (m, k) شماره‌سطر و distance، سطر نامعتبر -1
+    return [
+        [_make_hit(idx, int(i), d) for i, d in zip(id_row, d_row) if i >= 0]
+        for id_row, d_row in zip(ids, dists)
+    ]
+
+
+# اندازه‌ی بلاک کوئری‌ها در حالت batch تا ماتریس امتیازها خیلی بزرگ نشه
+QUERY_BLOCK_SIZE = 256
+
+
+def _dense_search(
+    idx: Dict[str, Any],
+    queries: List[str],
+    top_k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    rows: Optional[np.ndarray] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    rows (خروجی _filter_rows) اگر داده بشه فقط همون سطرها امتیاز می‌گیرن؛
+    هزینه با اندازه‌ی زیرمجموعه متناسبه نه کل corpus.
     """
+    if rows is not None and rows.size == 0:
+        return [[] for _ in queries]
+
+    q_embs = _encode_queries(list(queries))
+
+    if "faiss" in idx:
+        dists, ids = faiss_backend.search(idx, q_embs, top_k, nprobe=nprobe, ef_search=ef_search, rows=rows)
+        return _hits_for_ids(idx, dists, ids)
 
+    if "pg" in idx:
+        dists, ids = pgvector_backend.search(idx, q_embs, top_k, probes=nprobe, rows=rows)
+        return _hits_for_ids(idx, dists, ids)
+
+    embs = _ensure_embeddings(idx)
+    compressed = idx.get("compressed")
+    # با فیلتر، ماتریس زیرمجموعه یک بار برای همه‌ی کوئری‌ها جدا می‌شه
+    matrix = embs if rows is None else embs[rows]
+    results: List[List[Dict[str, Any]]] = []
+    for start in range(0, q_embs.shape[0], QUERY_BLOCK_SIZE):
+        block = q_embs[start:start + QUERY_BLOCK_SIZE]
+        if compressed is not None:
+            approx = compressed.scores(block, rows=rows)
+            for q, approx_row in zip(block, approx):
+                results.append(_rerank_hits(idx, embs, q, approx_row, top_k, rows=rows))
+            continue
+        # برای تفسیر قدیمی، distance رو 1 - similarity نگه می‌داریم
+        dists = 1.0 - (block @ matrix.T).astype(np.float64)
+        for row in dists:
+            results.append(_hits_for_row(idx, row, top_k, rows=rows))
+    return results
+
+
+def _rerank_rows(
+    embs: np.ndarray,
+    q: np.ndarray,
+    approx_row: np.ndarray,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    shortlist از روی امتیاز تقریبی، بعد distance دقیق با بردارهای float32 فقط برای همون سطرها.
+    اگر rows داده بشه، approx_row روی همون زیرمجموعه است.
+    خروجی (شماره‌سطرها، distances) مرتب‌شده.
+    """
+    shortlist_size = max(top_k * RETRIEVER_RERANK_MULTIPLIER, top_k)
+    shortlist = _top_k(1.0 - approx_row.astype(np.float64), shortlist_size)
+    if rows is not None:
+        shortlist = rows[shortlist]
+    # مرتب‌کردن اندیس‌ها دسترسی به mmap رو ترتیبی‌تر می‌کنه
+    shortlist = np.sort(shortlist)
+    exact = 1.0 - (embs[shortlist] @ q).astype(np.float64)
+    order = _top_k(exact, top_k)
+    return shortlist[order], exact[order]
+
+
+def _rerank_hits(
+    idx: Dict[str, Any],
+    embs: np.ndarray,
+    q: np.ndarray,
+    approx_row: np.ndarray,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    found, dists = _rerank_rows(embs, q, approx_row, top_k, rows=rows)
+    return [_make_hit(idx, int(i), d) for i, d in zip(found, dists)]
+
+
+def compression_report(n_queries: int = 200, top_k: int = 10, seed: int = 0) -> Dict[str, Any]:
+    """
+    حافظه‌ی صرفه‌جویی‌شده و recall@k حالت فشرده (با rerank) نسبت به جست‌وجوی دقیق float32.
+    کوئری‌ها ترکیب نرمال‌شده‌ی دو چانک تصادفی هستن تا به کوئری واقعی شبیه‌تر باشن.
+    """
     idx = _get_index()
-    chunks = idx["chunks"]
-    sources = idx["sources"]
-    embs = idx["embeddings"]
+    if "faiss" in idx or "pg" in idx:
+        return {"error": "compression report applies to the numpy backend only"}
+    embs = _ensure_embeddings(idx)
+    n = embs.shape[0]
+    if n == 0:
+        return {"chunks": 0}
 
-    if len(chunks) == 0:
-        _debug("empty index, returning fallback msg")
+    compressed = idx.get("compressed")
+    if compressed is None:
+        compressed = CompressedVectors.build(embs, "int8")
+
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, n, size=(n_queries, 2))
+    queries = _normalize_rows(np.asarray(embs[pairs[:, 0]]) + np.asarray(embs[pairs[:, 1]]))
+    k = min(top_k, n)
+
+    exact = 1.0 - (queries @ embs.T).astype(np.float64)
+    approx = compressed.scores(queries)
+    hits = 0
+    for q, exact_row, approx_row in zip(queries, exact, approx):
+        truth = set(_top_k(exact_row, k).tolist())
+        got, _ = _rerank_rows(embs, q, approx_row, k)
+        hits += len(truth & set(got.tolist()))
+
+    report = compressed.describe()
+    report.update({
+        "chunks": n,
+        "dim": int(embs.shape[1]),
+        "queries": n_queries,
+        "k": k,
+        "rerank_shortlist": max(k * RETRIEVER_RERANK_MULTIPLIER, k),
+        f"recall@{k}": hits / float(n_queries * k),
+    })
+    return report
+
+
+def _lexical_search(
+    idx: Dict[str, Any],
+    query: str,
+    top_k: int,
+    rows: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    # distance برای نتیجه‌ی لغوی معنا نداره؛ امتیاز BM25 تو "score" میاد
+    ids, scores = idx["bm25"].search(query, top_k, rows=rows)
+    hits = []
+    for i, sc in zip(ids, scores):
+        hit = _make_hit(idx, int(i), None)
+        hit["score"] = float(sc)
+        hits.append(hit)
+    return hits
+
+
+def _fuse_rrf(
+    dense_hits: List[Dict[str, Any]],
+    lexical_hits: List[Dict[str, Any]],
+    top_k: int,
+) -> List[Dict[str, Any]]:
+    """
+    reciprocal-rank fusion: امتیاز هر چانک = Σ 1 / (RRF_K + rank) روی دو لیست.
+    distance نتیجه‌ی dense (اگر بود) حفظ می‌شه.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for hits in (dense_hits, lexical_hits):
+        for rank, hit in enumerate(hits):
+            entry = fused.get(hit["source"])
+            if entry is None:
+                entry = fused[hit["source"]] = dict(hit, score=0.0)
+            elif entry["distance"] is None:
+                entry["distance"] = hit.get("distance")
+            entry["score"] += 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda h: -h["score"])[:top_k]
+
+
+def _search_many(
+    queries: List[str],
+    top_k: int = TOP_K_DEFAULT,
+    mode: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    نسخه‌ی batch از _search: همه‌ی کوئری‌ها با یک encode و یک ضرب ماتریسی امتیاز می‌گیرن.
+    خروجی برای هر کوئری همون لیستیه که _search برمی‌گردونه.
+    mode یکی از RETRIEVAL_MODES است (پیش‌فرض RETRIEVER_MODE).
+    nprobe / ef_search فقط روی backend faiss (ایندکس‌های IVF / HNSW) اثر دارن.
+    filters روی facetهای FACETS اعمال می‌شه و فقط سطرهای منطبق امتیاز می‌گیرن.
+    """
+    mode = (mode or RETRIEVER_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}")
+
+    if not queries:
         return []
 
-    model = _get_model()
-    q_emb = model.encode([query], convert_to_numpy=True, show_progress_bar=False)[0].astype("float32")
+    idx = _get_index()
 
-    scored: List[Tuple[int, float]] = []
-    for i, emb in enumerate(embs):
-        sim = _cosine_sim(q_emb, emb)
-        # برای تفسیر قدیمی، distance رو 1 - similarity نگه می‌داریم
-        distance = 1.0 - sim
-        scored.append((i, distance))
+    if len(idx["chunks"]) == 0:
+        _debug("empty index, returning fallback msg")
+        return [[] for _ in queries]
 
-    # sort by distance ASC (کمتر = بهتر)
-    scored.sort(key=lambda x: x[1])
+    rows = _filter_rows(idx, filters)
+    if rows is not None and rows.size == 0:
+        return [[] for _ in queries]
 
-    top_hits = scored[: top_k]
-    results: List[Dict[str, Any]] = []
-    for i, dist in top_hits:
-        results.append({
-            "text": chunks[i],
-            "source": sources[i],
-            "distance": float(dist),
-        })
+    if mode == "lexical":
+        return [_lexical_search(idx, q, top_k, rows=rows) for q in queries]
 
-    return results
+    if mode == "dense":
+        return _dense_search(idx, queries, top_k, nprobe=nprobe, ef_search=ef_search, rows=rows)
+
+    # hybrid: از هر لیست چند برابر top_k کاندید می‌گیریم و بعد fuse می‌کنیم
+    pool = max(top_k * 4, 20)
+    dense_lists = _dense_search(idx, queries, pool, nprobe=nprobe, ef_search=ef_search, rows=rows)
+    return [
+        _fuse_rrf(dense_hits, _lexical_search(idx, q, pool, rows=rows), top_k)
+        for q, dense_hits in zip(queries, dense_lists)
+    ]
+
+
+def _search(
+    query: str,
+    top_k: int = TOP_K_DEFAULT,
+    mode: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    ورودی: query (سوال کاربر)
+    خروجی: لیست دیکشنری مثل:
+    {
+        "text": "...",
+        "source": "d.txt[chunk:0]",
+        "distance": 0.123  # هر چی کمتر باشه یعنی نزدیک‌تر؟
+    }
+
+    نکته: ما از شباهت کسینوسی استفاده می‌کنیم
+    ولی برای سازگاری با قبلی "distance" رو 1 - sim می‌ذاریم.
+    چون امبدینگ‌ها موقع ساخت ایندکس نرمال شدن، کل امتیازدهی یک ضرب ماتریس-بردار است.
+    در حالت lexical و hybrid کلید "score" هم اضافه می‌شه (و در lexical، distance = None).
+    چانک‌های JSONL کلید "metadata" هم دارن؛ filters مثل {"skill": ..., "level": ...}.
+    """
+    return _search_many(
+        [query], top_k=top_k, mode=mode, nprobe=nprobe, ef_search=ef_search, filters=filters
+    )[0]
 
 
 # ========== ۶. API اصلی که ui.py صداش می‌زنه ==========
@@ -165,10 +940,121 @@ def _get_singleton() -> "Retriever":
 
 
 class Retriever:
-    def retrieve(self, query: str, top_k: int = TOP_K_DEFAULT) -> List[Dict[str, Any]]:
-        return _search(query, top_k=top_k)
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = TOP_K_DEFAULT,
+        mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        return _search(query, top_k=top_k, mode=mode, nprobe=nprobe, ef_search=ef_search, filters=filters)
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = TOP_K_DEFAULT,
+        mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        return _search_many(
+            queries, top_k=top_k, mode=mode, nprobe=nprobe, ef_search=ef_search, filters=filters
+        )
+
+    def refresh(self, force: bool = False) -> Dict[str, Any]:
+        return refresh_index(force=force)
+
+    def facets(self) -> Dict[str, Dict[str, int]]:
+        """مقدارهای موجود هر facet و تعداد چانک‌هاشون (برای ساخت فیلتر در UI)."""
+        return {
+            facet: {value: int(rows.size) for value, rows in values.items()}
+            for facet, values in (_get_index().get("facets") or {}).items()
+        }
+
+    def encoder_stats(self) -> Dict[str, Any]:
+        return encoder_stats()
+
+    def query_cache_stats(self) -> Dict[str, Any]:
+        return query_cache_stats()
+
+    def compression_report(self, n_queries: int = 200, top_k: int = 10) -> Dict[str, Any]:
+        return compression_report(n_queries=n_queries, top_k=top_k)
 
 
 # این تابعی بود که ui.py داشت ازش استفاده می‌کرد
-def retrieve(query: str, top_k: int = TOP_K_DEFAULT) -> List[Dict[str, Any]]:
-    return _get_singleton().retrieve(query, top_k=top_k)
+# جست‌وجوهای هم‌زمانِ یکسان (همون سؤال، top_k و فیلترها) یک بار اجرا می‌شن
+_RETRIEVE_FLIGHT = get_flight("retrieve")
+
+
+def _flight_key(query: str, top_k: int, kwargs: Dict[str, Any]) -> str:
+    return json.dumps([query, top_k, kwargs], ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _copy_hits(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # نتیجه بین چند صدازننده مشترکه؛ هر کدوم dict های خودش رو می‌گیره
+    return [dict(h) for h in hits]
+
+
+def retrieve(query: str, top_k: int = TOP_K_DEFAULT, **kwargs: Any) -> List[Dict[str, Any]]:
+    hits = _RETRIEVE_FLIGHT.do(
+        _flight_key(query, top_k, kwargs),
+        lambda: _get_singleton().retrieve(query, top_k=top_k, **kwargs),
+    )
+    return _copy_hits(hits)
+
+
+def retrieve_many(queries: List[str], top_k: int = TOP_K_DEFAULT, **kwargs: Any) -> List[List[Dict[str, Any]]]:
+    return _get_singleton().retrieve_many(queries, top_k=top_k, **kwargs)
+
+
+async def _asearch_many(
+    queries: List[str],
+    top_k: int = TOP_K_DEFAULT,
+    mode: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    مثل _search_many، ولی با backend pgvector کوئری دیتابیس روی pool async منتظر می‌مونه و فقط
+    encode / BM25 (کار CPU) به executor می‌ره. بقیه‌ی backend ها کلاً روی executor اجرا می‌شن.
+    """
+    executor = get_executor()
+    idx = _INDEX if _INDEX is not None else await executor.run(_get_index)
+    mode = (mode or RETRIEVER_MODE).lower()
+    if "pg" not in idx or mode not in ("dense", "hybrid") or not queries or len(idx["chunks"]) == 0:
+        return await executor.run(_search_many, queries, top_k, mode, nprobe, ef_search, filters)
+
+    rows = _filter_rows(idx, filters)
+    if rows is not None and rows.size == 0:
+        return [[] for _ in queries]
+
+    pool = top_k if mode == "dense" else max(top_k * 4, 20)
+    q_embs = await executor.run(_encode_queries, list(queries))
+    dists, ids = await pgvector_backend.asearch(idx, q_embs, pool, probes=nprobe, rows=rows)
+    dense_lists = _hits_for_ids(idx, dists, ids)
+    if mode == "dense":
+        return dense_lists
+    lexical_lists = await executor.run(lambda: [_lexical_search(idx, q, pool, rows=rows) for q in queries])
+    return [_fuse_rrf(d, lex, top_k) for d, lex in zip(dense_lists, lexical_lists)]
+
+
+# نسخه‌های async: encode و جست‌وجو روی executor محدود اجرا می‌شن تا event loop آزاد بمونه
+# (با pgvector خود کوئری دیتابیس async است)
+async def aretrieve(query: str, top_k: int = TOP_K_DEFAULT, **kwargs: Any) -> List[Dict[str, Any]]:
+    hits = await _RETRIEVE_FLIGHT.ado(
+        _flight_key(query, top_k, kwargs),
+        lambda: _afirst(_asearch_many([query], top_k, **kwargs)),
+    )
+    return _copy_hits(hits)
+
+
+async def _afirst(coro: Awaitable[List[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    return (await coro)[0]
+
+
+async def aretrieve_many(queries: List[str], top_k: int = TOP_K_DEFAULT, **kwargs: Any) -> List[List[Dict[str, Any]]]:
+    return await _asearch_many(queries, top_k, **kwargs)
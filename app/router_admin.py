@@ -0,0 +1,60 @@
+# app/router_admin.py
+# اندپوینت‌های مدیریتی (فقط با هدر X-Admin-Token که با ADMIN_TOKEN یکی باشه)
+from __future__ import annotations
+import os
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+
+from app.context_builder import context_stats
+from app.generator import answer_cache_stats, provider_stats, reload_settings
+from app.retriever import encoder_stats, query_cache_stats, refresh_index
+from app.singleflight import flight_stats
+from app.tier_router import router_stats
+from app.warmup import readiness
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def _check_token(token: Optional[str]) -> None:
+    expected = os.getenv("ADMIN_TOKEN", "")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if token != expected:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@router.post("/reindex")
+def reindex(force: bool = False, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    فایل‌های داده رو دوباره اسکن می‌کنه و اگر چیزی عوض شده باشه ایندکس جدید رو
+    بدون قطع ترافیک جایگزین می‌کنه. sync تعریف شده تا تو threadpool اجرا بشه و event loop رو نگیره.
+    """
+    _check_token(x_admin_token)
+    return refresh_index(force=force)
+
+
+@router.post("/reload-settings")
+def reload_settings_endpoint(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    snapshot تنظیمات generator رو از env / secrets دوباره می‌سازه (مثلاً عوض کردن مدل یا
+    MODEL_PROVIDER بدون restart). کلیدها و مقدارهای غیرمحرمانه‌ی snapshot جدید برمی‌گرده.
+    """
+    _check_token(x_admin_token)
+    s = reload_settings()
+    return {k: ("***" if ("KEY" in k or "TOKEN" in k) and v else v) for k, v in s.items()}
+
+
+@router.get("/stats")
+def stats(x_admin_token: Optional[str] = Header(default=None)):
+    """آمار runtime: micro-batching encoder، کش بردار کوئری‌ها، کش پاسخ‌ها، درخواست‌های یکی‌شده و توکن‌های صرفه‌جویی‌شده‌ی کانتکست."""
+    _check_token(x_admin_token)
+    return {
+        "encoder": encoder_stats(),
+        "query_cache": query_cache_stats(),
+        "answer_cache": answer_cache_stats(),
+        "singleflight": flight_stats(),
+        "context": context_stats(),
+        "provider": provider_stats(),
+        "tier_router": router_stats(),
+        "startup": readiness(),
+    }
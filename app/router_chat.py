@@ -1,46 +1,71 @@
 # app/router_chat.py
 from __future__ import annotations
+import json
 import time
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, Optional
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.retriever import retrieve
-from app.generator import generate_answer
+from app.retriever import aretrieve
+from app.generator import agenerate_answer_stream
+from app.warmup import mark_first_answer
 
 router = APIRouter(prefix="", tags=["chat"])
 
 class ChatRequest(BaseModel):
     message: str
     top_k: int = 5
-    max_new_tokens: int = 200
+    # اگر داده بشه، سقف توکن خروجی هر دو tier رو محدود می‌کنه
+    max_new_tokens: Optional[int] = None
 
 class Snippet(BaseModel):
     text: str
-    source: dict | None = None
+    source: str | None = None
     distance: float | None = None
 
-class ChatResponse(BaseModel):
-    answer: str
-    context: List[Snippet]
-    took_ms: int
 
-@router.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    t0 = time.time()
+def _token_limits(req: ChatRequest) -> Dict[str, int]:
+    if not req.max_new_tokens:
+        return {}
+    cap = max(1, int(req.max_new_tokens))
+    return {"max_tokens_simple": min(128, cap), "max_tokens_deep": min(512, cap)}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    # data همیشه JSON یک‌خطیه تا newlineهای متن فرمت SSE رو خراب نکنن
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    بازیابی + جواب به شکل Server-Sent Events:
+      event: context → {"context": [...snippets]}   (قبل از اولین توکن)
+      event: token   → {"delta": "..."}             (به ترتیب رسیدن از مدل)
+      event: done    → {"took_ms": ...}
+      event: error   → {"detail": "..."}
+    """
     if not req.message.strip():
         raise HTTPException(status_code=400, detail="Empty message")
 
-    # 1) Retrieve
-    hits = retrieve(req.message, top_k=req.top_k)
-    ctx_texts = [h["text"] for h in hits if h.get("text")]
+    async def _events() -> AsyncIterator[str]:
+        t0 = time.time()
+        try:
+            hits = await aretrieve(req.message, top_k=req.top_k)
+            yield _sse("context", {"context": [Snippet(**h).model_dump() for h in hits]})
 
-    # 2) Generate
-    answer = generate_answer(req.message, context=ctx_texts, max_new_tokens=req.max_new_tokens)
+            async for delta in agenerate_answer_stream(req.message, context=hits, **_token_limits(req)):
+                yield _sse("token", {"delta": delta})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        mark_first_answer()
+        yield _sse("done", {"took_ms": int((time.time() - t0) * 1000)})
 
-    took = int((time.time() - t0) * 1000)
-    return ChatResponse(
-        answer=answer,
-        context=[Snippet(**h) for h in hits],
-        took_ms=took,
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        # جلوی بافر شدن پاسخ توسط پروکسی (nginx) رو می‌گیره
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
@@ -0,0 +1,245 @@
+# app/semantic_cache.py
+# کش معنایی پاسخ‌ها (لایه‌ی دوم، بعد از کش دقیق AnswerCache)
+#
+# "اصول مذاکره چیه؟" و "اصول مذاکره رو بگو" کلید دقیق متفاوت دارن ولی جوابشون یکیه.
+# اینجا بردار کوئری (همون MiniLM که retriever استفاده می‌کنه) کنار جواب ذخیره می‌شه و اگر
+# کوئری جدید با شباهت کسینوسی >= threshold به یک کوئری قبلی برسه *و* کانتکست بازیابی‌شده‌ش
+# به اندازه‌ی کافی با کانتکست اون جواب هم‌پوشانی داشته باشه، همون جواب برمی‌گرده.
+#
+# ذخیره‌سازی: جدول semantic_answers در همون فایل SQLite کش پاسخ‌ها (WAL).
+# جست‌وجو: faiss HNSW (اگر نصب باشه) یا ضرب ماتریسی numpy؛ بردارها در حافظه‌ی هر worker هستن
+# و ردیف‌هایی که workerهای دیگه اضافه کردن هر چند ثانیه یک بار از دیتابیس خونده می‌شن.
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from app.faiss_backend import load_faiss
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_answers (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    query       TEXT NOT NULL,
+    embedding   BLOB NOT NULL,
+    context     TEXT NOT NULL,
+    answer      TEXT NOT NULL,
+    created_at  REAL NOT NULL
+);
+"""
+
+# چند همسایه‌ی نزدیک بررسی بشن (اولی ممکنه کانتکست متفاوت داشته باشه)
+_CANDIDATES = 4
+# هر چند ثانیه ردیف‌های جدید workerهای دیگه رو می‌خونیم
+_SYNC_INTERVAL_SEC = 2.0
+# وقتی این نسبت از ایندکس حذف‌شده باشه، ایندکس از نو ساخته می‌شه (HNSW حذف نداره)
+_REBUILD_DEAD_RATIO = 0.25
+_HNSW_M = 32
+_HNSW_EF_SEARCH = 64
+
+
+def context_keys(blocks: Optional[Iterable[str]]) -> Set[str]:
+    """شناسه‌ی بلوک‌های کانتکست (sha1 متن تمیزشده) برای مقایسه‌ی هم‌پوشانی."""
+    return {
+        hashlib.sha1(b.strip().encode("utf-8")).hexdigest()[:16]
+        for b in (blocks or [])
+        if b and b.strip()
+    }
+
+
+def context_overlap(a: Set[str], b: Set[str]) -> float:
+    # Jaccard؛ دو کانتکست خالی یعنی کاملاً یکسان
+    if not a and not b:
+        return 1.0
+    return len(a & b) / float(len(a | b))
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        path: str,
+        threshold: float = 0.92,
+        min_context_overlap: float = 0.5,
+        max_entries: int = 100000,
+        ttl_sec: float = 30 * 24 * 3600.0,
+        use_faiss: bool = True,
+    ):
+        self.path = str(path)
+        self.threshold = float(threshold)
+        self.min_context_overlap = float(min_context_overlap)
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_sec = float(ttl_sec)
+        self.use_faiss = bool(use_faiss and load_faiss() is not None)
+
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._rejected_context = 0
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+        self._reset_memory()
+        self._sync(force=True)
+
+    # ---------- اتصال (یکی برای هر thread) ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- حالت حافظه ----------
+    def _reset_memory(self) -> None:
+        self._index = None          # faiss.Index یا None
+        self._matrix: Optional[np.ndarray] = None   # فقط برای حالت numpy (با ظرفیت اضافه)
+        self._size = 0               # تعداد سطرهای ایندکس (شامل حذف‌شده‌ها)
+        self._row_ids: List[int] = []               # سطر ایندکس → id دیتابیس
+        self._row_ctx: List[Set[str]] = []
+        self._row_created: List[float] = []
+        self._dead: Set[int] = set()
+        # idها صعودی اضافه و از قدیمی‌ترین حذف می‌شن؛ سطرهای قبل از این cursor حذف‌شده‌ان
+        self._evict_cursor = 0
+        self._last_id = 0
+        self._last_sync = 0.0
+
+    def _append(self, vecs: np.ndarray) -> None:
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        if self.use_faiss:
+            if self._index is None:
+                faiss = load_faiss()
+                self._index = faiss.IndexHNSWFlat(vecs.shape[1], _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+                self._index.hnsw.efSearch = _HNSW_EF_SEARCH
+            self._index.add(vecs)
+        else:
+            if self._matrix is None:
+                self._matrix = np.zeros((max(1024, vecs.shape[0]), vecs.shape[1]), dtype=np.float32)
+            need = self._size + vecs.shape[0]
+            if need > self._matrix.shape[0]:
+                grown = np.zeros((max(need, self._matrix.shape[0] * 2), self._matrix.shape[1]), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            self._matrix[self._size:need] = vecs
+        self._size += vecs.shape[0]
+
+    def _load_rows(self, rows: List[Any]) -> None:
+        if not rows:
+            return
+        vecs = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+        self._append(vecs)
+        for db_id, _, ctx, created_at in rows:
+            self._row_ids.append(int(db_id))
+            self._row_ctx.append(set(json.loads(ctx)))
+            self._row_created.append(float(created_at))
+            self._last_id = max(self._last_id, int(db_id))
+
+    def _sync(self, force: bool = False) -> None:
+        """ردیف‌های جدید (از همین worker یا بقیه) رو اضافه و حذف‌شده‌ها رو علامت می‌زنه."""
+        now = time.monotonic()
+        if not force and now - self._last_sync < _SYNC_INTERVAL_SEC:
+            return
+        with self._lock:
+            conn = self._conn()
+            if self._size and len(self._dead) > _REBUILD_DEAD_RATIO * self._size:
+                self._reset_memory()
+            rows = conn.execute(
+                "SELECT id, embedding, context, created_at FROM semantic_answers WHERE id > ? ORDER BY id",
+                (self._last_id,),
+            ).fetchall()
+            self._load_rows(rows)
+            if self._size:
+                oldest = conn.execute("SELECT MIN(id) FROM semantic_answers").fetchone()[0]
+                oldest = self._last_id + 1 if oldest is None else int(oldest)
+                while self._evict_cursor < self._size and self._row_ids[self._evict_cursor] < oldest:
+                    self._dead.add(self._evict_cursor)
+                    self._evict_cursor += 1
+            self._last_sync = now
+
+    def _search(self, q: np.ndarray, k: int):
+        if self._size == 0:
+            return np.zeros((0,), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+        # چند برابر می‌گیریم تا سطرهای حذف‌شده / منقضی جای کاندید واقعی رو نگیرن
+        k = min(k * 4, self._size)
+        if self._index is not None:
+            sims, rows = self._index.search(q[None, :], k)
+            return sims[0], rows[0]
+        sims = self._matrix[:self._size] @ q
+        if k < self._size:
+            rows = np.argpartition(-sims, k - 1)[:k]
+        else:
+            rows = np.arange(self._size)
+        rows = rows[np.argsort(-sims[rows], kind="stable")]
+        return sims[rows], rows
+
+    # ---------- API ----------
+    def lookup(self, query_emb: np.ndarray, context: Set[str]) -> Optional[str]:
+        self._sync()
+        q = np.ascontiguousarray(query_emb, dtype=np.float32).reshape(-1)
+        now = time.time()
+        with self._lock:
+            sims, rows = self._search(q, _CANDIDATES)
+            chosen = None
+            for sim, row in zip(sims, rows):
+                row = int(row)
+                if row < 0 or sim < self.threshold:
+                    break
+                if row in self._dead:
+                    continue
+                if self.ttl_sec > 0 and now - self._row_created[row] > self.ttl_sec:
+                    continue
+                if context_overlap(context, self._row_ctx[row]) < self.min_context_overlap:
+                    self._rejected_context += 1
+                    continue
+                chosen = self._row_ids[row]
+                break
+            if chosen is None:
+                self._misses += 1
+                return None
+
+        found = self._conn().execute("SELECT answer FROM semantic_answers WHERE id = ?", (chosen,)).fetchone()
+        with self._lock:
+            if found is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return found[0]
+
+    def add(self, query: str, query_emb: np.ndarray, context: Set[str], answer: str) -> None:
+        vec = np.ascontiguousarray(query_emb, dtype=np.float32).reshape(-1)
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO semantic_answers (query, embedding, context, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+            (query, vec.tobytes(), json.dumps(sorted(context)), answer, time.time()),
+        )
+        if self.max_entries > 0:
+            # قدیمی‌ترین‌ها (FIFO روی id) بیرون می‌رن؛ حافظه در _sync بعدی علامت می‌خوره
+            conn.execute(
+                "DELETE FROM semantic_answers WHERE id <= ("
+                " SELECT id FROM semantic_answers ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self._sync(force=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": self._size - len(self._dead),
+                "index": "faiss_hnsw" if self.use_faiss else "numpy",
+                "threshold": self.threshold,
+                "min_context_overlap": self.min_context_overlap,
+                "hits": self._hits,
+                "misses": self._misses,
+                "rejected_by_context": self._rejected_context,
+                "hit_rate": (self._hits / total) if total else 0.0,
+            }
@@ -0,0 +1,150 @@
+# app/singleflight.py
+# یکی‌کردن درخواست‌های هم‌زمانِ یکسان (single-flight)
+#
+# وقتی یک سؤال دست‌به‌دست می‌شه، ده‌ها درخواست یکسان تو یک ثانیه می‌رسن؛ هنوز چیزی تو کش
+# نوشته نشده، پس همه miss می‌خورن و هر کدوم یک فراخوانی LLM جدا می‌فرستن. اینجا اولین
+# فراخوانی (leader) کار رو انجام می‌ده و بقیه‌ی فراخوانی‌های هم‌کلید منتظر همون نتیجه می‌مونن.
+#
+# نتیجه تو یک concurrent.futures.Future نگه داشته می‌شه، پس leader و followerها می‌تونن
+# هر ترکیبی از thread (do) و task های asyncio (ado) باشن.
+#
+# کنسل شدن:
+# - follower کنسل‌شده (مثلاً کلاینتش قطع شده) فقط انتظار خودش رو ول می‌کنه؛ future مشترک
+#   پشت asyncio.shield است و برای leader و بقیه دست نمی‌خوره
+# - اگر خود leader کنسل بشه (یا KeyboardInterrupt و مشابهش)، نتیجه‌ای در کار نیست ولی خطای
+#   واقعی هم نیست: future با _Abandoned بسته می‌شه و followerها از اول join می‌کنن، یعنی
+#   یکی‌شون leader جدید می‌شه و fn رو خودش اجرا می‌کنه
+# - فقط Exception های معمولی fn بین همه پخش می‌شن
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Abandoned(Exception):
+    """leader بدون نتیجه رفت (کنسل شد)؛ followerها دوباره تلاش می‌کنن."""
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._leaders = 0
+        self._collapsed = 0
+        self._errors = 0
+        self._abandoned = 0
+        self._max_waiters = 0
+        self._waiters: Dict[str, int] = {}
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self._collapsed += 1
+                self._waiters[key] += 1
+                self._max_waiters = max(self._max_waiters, self._waiters[key])
+                return fut, False
+            fut = self._calls[key] = Future()
+            self._waiters[key] = 0
+            self._leaders += 1
+            return fut, True
+
+    def _finish(self, key: str, fut: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        # اول کلید برداشته می‌شه، بعد future بسته می‌شه: followerی که با _Abandoned برمی‌گرده
+        # نباید دوباره به همین future مرده join کنه
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+                del self._waiters[key]
+            if isinstance(error, _Abandoned):
+                self._abandoned += 1
+            elif error is not None:
+                self._errors += 1
+        if fut.done():
+            return
+        if error is None:
+            fut.set_result(result)
+        else:
+            fut.set_exception(error)
+
+    # ---------- API ----------
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """fn رو اجرا می‌کنه، مگر یک فراخوانی هم‌کلید در جریان باشه؛ در اون صورت منتظر نتیجه‌ش می‌مونه."""
+        while True:
+            fut, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return fut.result()
+            except _Abandoned:
+                continue
+        try:
+            result = fn()
+        except Exception as e:
+            self._finish(key, fut, error=e)
+            raise
+        except BaseException:
+            self._finish(key, fut, error=_Abandoned(key))
+            raise
+        self._finish(key, fut, result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """نسخه‌ی async از do؛ fn یک coroutine function است."""
+        while True:
+            fut, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: کنسل شدن این follower نباید future مشترک رو کنسل کنه
+                return await asyncio.shield(asyncio.wrap_future(fut))
+            except _Abandoned:
+                continue
+        try:
+            result = await fn()
+        except Exception as e:
+            self._finish(key, fut, error=e)
+            raise
+        except BaseException:
+            # CancelledError: بقیه‌ی منتظرها خودشون دوباره اجرا می‌کنن
+            self._finish(key, fut, error=_Abandoned(key))
+            raise
+        self._finish(key, fut, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._leaders + self._collapsed
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls),
+                "executed": self._leaders,
+                "collapsed": self._collapsed,
+                "errors": self._errors,
+                "abandoned": self._abandoned,
+                "max_waiters": self._max_waiters,
+                "collapse_rate": (self._collapsed / total) if total else 0.0,
+            }
+
+
+# ---------- رجیستری (برای /admin/stats) ----------
+_registry_lock = threading.Lock()
+_registry: Dict[str, SingleFlight] = {}
+
+
+def get_flight(name: str) -> SingleFlight:
+    with _registry_lock:
+        flight = _registry.get(name)
+        if flight is None:
+            flight = _registry[name] = SingleFlight(name)
+        return flight
+
+
+def flight_stats() -> Dict[str, Dict[str, Any]]:
+    with _registry_lock:
+        flights = list(_registry.values())
+    return {f.name: f.stats() for f in flights}
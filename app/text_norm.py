@@ -0,0 +1,53 @@
+# app/text_norm.py
+# نرمال‌سازی متن فارسی برای جست‌وجوی لغوی و کلیدهای کش
+#
+# - ي/ى → ی ، ك → ک ، ة/ۀ → ه ، أ/إ → ا ، ؤ → و
+# - حذف اعراب (فتحه، کسره، تنوین، تشدید، ...) و کشیده (ـ)
+# - نیم‌فاصله (ZWNJ) و بقیه‌ی کاراکترهای صفرعرض حذف می‌شن، تا "می‌خواهم" و "میخواهم" یکی بشن
+# - ارقام فارسی/عربی → ارقام لاتین
+import re
+from typing import List
+
+_CHAR_MAP = str.maketrans({
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "ة": "ه",
+    "ۀ": "ه",
+    "أ": "ا",
+    "إ": "ا",
+    "ٱ": "ا",
+    "ؤ": "و",
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # ۰-۹
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # ٠-٩
+})
+
+# اعراب عربی + کشیده (tatweel)
+_DIACRITICS_RE = re.compile("[\u064B-\u065F\u0670\u0640]")
+# ZWNJ، ZWJ، LRM/RLM و BOM
+_ZERO_WIDTH_RE = re.compile("[\u200c\u200d\u200e\u200f\ufeff]")
+_WS_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\w+")
+
+# کلمات خیلی پرتکرار که برای جست‌وجوی لغوی ارزشی ندارن
+STOPWORDS = frozenset({
+    "و", "در", "به", "از", "که", "را", "رو", "این", "آن", "با", "است", "هست",
+    "برای", "تا", "یک", "یه", "هم", "می", "ها", "های", "ای", "بر", "شد", "شده",
+    "کرد", "کردن", "کنید", "کنیم", "چه", "چی", "چیه", "یا", "اما", "اگر", "باید",
+})
+
+
+def normalize_text(text: str) -> str:
+    """نسخه‌ی نرمال‌شده‌ی متن (lowercase، یکسان‌سازی حروف، بدون اعراب و نیم‌فاصله، فاصله‌های یکی‌شده)."""
+    if not text:
+        return ""
+    txt = text.translate(_CHAR_MAP)
+    txt = _DIACRITICS_RE.sub("", txt)
+    txt = _ZERO_WIDTH_RE.sub("", txt)
+    txt = _WS_RE.sub(" ", txt)
+    return txt.strip().lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """توکن‌های جست‌وجوی لغوی (بعد از نرمال‌سازی، بدون stopword)."""
+    return [t for t in _TOKEN_RE.findall(normalize_text(text)) if t not in STOPWORDS]
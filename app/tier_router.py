@@ -0,0 +1,385 @@
+"""
+tier_router.py
+--------------
+انتخاب tier ارزون / عمیق از روی بردار کوئری (همون بردار MiniLM که retriever ساخته).
+
+_is_smalltalk_or_simple با لیست احوال‌پرسی، چند regex و قانون «حداکثر ۶ کلمه» تصمیم می‌گیره؛
+یعنی سؤال کوتاه ولی سخت بیزنسی ("رقیبم قیمتش رو نصف کرده، چیکار کنم؟") به مدل ارزون می‌ره و
+احوال‌پرسی طولانی به مدل عمیق. اینجا یک مدل خطی کوچیک (logistic regression یا نزدیک‌ترین
+مرکز کلاس) روی بردار کوئری تصمیم می‌گیره:
+
+    score = w · emb + b      → deep اگر score >= threshold
+
+- بردار کوئری از کش LRU retriever میاد (retriever قبلاً encodeش کرده) → encode اضافه نداره
+- تصمیم یک ضرب داخلی ۳۸۴ بُعدیه (چند میکروثانیه)
+- مدل از مثال‌های برچسب‌دار (data/tier_router/examples.jsonl؛ نه مستقیم تو data/ که retriever می‌خونه) آموزش داده می‌شه و کنار ایندکس
+  (faiss_index/tier_router.npz) ذخیره می‌شه؛ اگر فایل نباشه همون قانون‌های قبلی استفاده می‌شن
+- همه‌ی تصمیم‌ها شمرده می‌شن؛ تصمیم‌های خود مدل (با تصمیم قانون‌های قبلی برای مقایسه) در
+  data/tier_router/decisions.jsonl هم ثبت می‌شن تا معلوم بشه چند فراخوانی deep صرفه‌جویی شده.
+  نوشتن از یک صف و thread جدا انجام می‌شه و فایل با اندازه‌ی TIER_DECISION_LOG_MAX_BYTES
+  چرخشی (rotate) است، پس مسیر درخواست نه I/O فایل داره نه فایل بی‌انتها بزرگ می‌شه
+
+مثال:
+    python -m app.tier_router train --kind linear --min-deep-recall 0.9
+    python -m app.tier_router report
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+TIER_ROUTER_ENABLED = os.getenv("TIER_ROUTER_ENABLED", "1").strip() not in ("0", "false", "no")
+TIER_ROUTER_PATH = os.getenv(
+    "TIER_ROUTER_PATH",
+    os.path.join(os.getenv("FAISS_INDEX_DIR", str(ROOT / "faiss_index")), "tier_router.npz"),
+)
+TIER_EXAMPLES_PATH = os.getenv("TIER_EXAMPLES_PATH", str(ROOT / "data" / "tier_router" / "examples.jsonl"))
+# خالی یعنی تصمیم‌ها فقط شمرده می‌شن و در فایل نوشته نمی‌شن
+TIER_DECISION_LOG = os.getenv("TIER_DECISION_LOG", str(ROOT / "data" / "tier_router" / "decisions.jsonl"))
+TIER_DECISION_LOG_MAX_BYTES = int(os.getenv("TIER_DECISION_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+TIER_DECISION_LOG_BACKUPS = int(os.getenv("TIER_DECISION_LOG_BACKUPS", "3"))
+
+TIERS = ("cheap", "deep")
+
+
+# ---------- مدل ----------
+class TierRouter:
+    def __init__(self, w: np.ndarray, b: float, threshold: float = 0.0, meta: Optional[Dict[str, Any]] = None):
+        self.w = np.ascontiguousarray(w, dtype=np.float32).reshape(-1)
+        self.b = float(b)
+        self.threshold = float(threshold)
+        self.meta = dict(meta or {})
+
+    @property
+    def dim(self) -> int:
+        return int(self.w.shape[0])
+
+    def score(self, emb: np.ndarray) -> float:
+        return float(np.dot(self.w, emb)) + self.b
+
+    def tier_for(self, score: float) -> str:
+        return "deep" if score >= self.threshold else "cheap"
+
+    def route(self, emb: np.ndarray) -> str:
+        return self.tier_for(self.score(emb))
+
+    def save(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            w=self.w,
+            b=np.float64(self.b),
+            threshold=np.float64(self.threshold),
+            meta=np.array(json.dumps(self.meta, ensure_ascii=False)),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TierRouter":
+        with np.load(path, allow_pickle=False) as z:
+            return cls(z["w"], float(z["b"]), float(z["threshold"]), json.loads(str(z["meta"])))
+
+
+# ---------- آموزش ----------
+def _fit_centroid(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, float]:
+    # نزدیک‌ترین مرکز (فاصله‌ی اقلیدسی) به شکل خطی: deep اگر 2x·(cd - cc) > |cd|² - |cc|²
+    cd = x[y == 1].mean(axis=0)
+    cc = x[y == 0].mean(axis=0)
+    return cd - cc, -0.5 * float(cd @ cd - cc @ cc)
+
+
+def _fit_linear(x: np.ndarray, y: np.ndarray, l2: float = 1e-3, epochs: int = 500, lr: float = 1.0) -> Tuple[np.ndarray, float]:
+    # logistic regression با gradient descent کامل؛ وزن کلاس‌ها متوازن تا کلاس کم‌تعداد گم نشه
+    n, d = x.shape
+    pos = max(1, int(y.sum()))
+    neg = max(1, n - pos)
+    sw = np.where(y == 1, n / (2.0 * pos), n / (2.0 * neg))
+    w = np.zeros(d, dtype=np.float64)
+    b = 0.0
+    for _ in range(epochs):
+        z = x @ w + b
+        p = 1.0 / (1.0 + np.exp(-z))
+        g = sw * (p - y)
+        w -= lr * (x.T @ g / n + l2 * w)
+        b -= lr * float(g.mean())
+    return w, b
+
+
+def fit(embs: np.ndarray, labels: Sequence[str], kind: str = "linear") -> TierRouter:
+    x = np.asarray(embs, dtype=np.float64)
+    y = np.array([1.0 if t == "deep" else 0.0 for t in labels])
+    if y.min() == y.max():
+        raise ValueError("need labelled examples of both tiers")
+    if kind == "centroid":
+        w, b = _fit_centroid(x, y)
+    elif kind == "linear":
+        w, b = _fit_linear(x, y)
+    else:
+        raise ValueError(f"unknown router kind: {kind!r}")
+    return TierRouter(w, b, 0.0, {"kind": kind})
+
+
+def cross_val_scores(embs: np.ndarray, labels: Sequence[str], kind: str, folds: int = 5, seed: int = 0) -> np.ndarray:
+    """امتیاز out-of-fold هر مثال (برای انتخاب threshold و گزارش دقت)."""
+    n = len(labels)
+    order = np.random.default_rng(seed).permutation(n)
+    scores = np.zeros(n, dtype=np.float64)
+    for f in range(max(2, min(folds, n))):
+        test = order[f::max(2, min(folds, n))]
+        train = np.setdiff1d(order, test)
+        model = fit(embs[train], [labels[i] for i in train], kind)
+        scores[test] = [model.score(embs[i]) for i in test]
+    return scores
+
+
+def pick_threshold(scores: np.ndarray, labels: Sequence[str], min_deep_recall: float) -> float:
+    """بزرگ‌ترین threshold که حداقل min_deep_recall از سؤال‌های deep هنوز deep بمونن."""
+    deep = np.sort(scores[np.array([t == "deep" for t in labels])])
+    if deep.size == 0:
+        return 0.0
+    allowed_misses = int(np.floor((1.0 - min_deep_recall) * deep.size))
+    return float(deep[min(max(allowed_misses, 0), deep.size - 1)])
+
+
+def evaluate(scores: np.ndarray, labels: Sequence[str], threshold: float) -> Dict[str, float]:
+    y = np.array([t == "deep" for t in labels])
+    pred = scores >= threshold
+    return {
+        "accuracy": round(float((pred == y).mean()), 4),
+        "deep_recall": round(float(pred[y].mean()) if y.any() else 0.0, 4),
+        "cheap_recall": round(float((~pred[~y]).mean()) if (~y).any() else 0.0, 4),
+        "deep_share": round(float(pred.mean()), 4),
+    }
+
+
+def load_examples(path: str) -> Tuple[List[str], List[str]]:
+    texts: List[str] = []
+    labels: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            if obj.get("tier") in TIERS and obj.get("text"):
+                texts.append(obj["text"])
+                labels.append(obj["tier"])
+    return texts, labels
+
+
+# ---------- runtime ----------
+@lru_cache(maxsize=1)
+def get_tier_router() -> Optional[TierRouter]:
+    if not TIER_ROUTER_ENABLED or not os.path.isfile(TIER_ROUTER_PATH):
+        return None
+    try:
+        return TierRouter.load(TIER_ROUTER_PATH)
+    except Exception as e:
+        print(f"[tier_router] could not load {TIER_ROUTER_PATH}: {e}")
+        return None
+
+
+_log_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "decisions": 0, "cheap": 0, "deep": 0, "router": 0, "heuristic": 0,
+    # router ارزون گفت ولی قانون‌های قبلی deep می‌فرستادن (و برعکس)
+    "deep_avoided": 0, "deep_added": 0,
+}
+_route_us_total = 0.0
+
+
+# مسیر درخواست فقط یک خط JSON تو صف می‌ذاره؛ یک thread جدا می‌نویسه و فایل رو rotate می‌کنه
+_decision_queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+
+
+def _write_decisions(handler: RotatingFileHandler) -> None:
+    while True:
+        line = _decision_queue.get()
+        if line is None:
+            break
+        handler.handle(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+    handler.close()
+
+
+def _stop_decision_writer(thread: threading.Thread) -> None:
+    _decision_queue.put(None)
+    thread.join(timeout=2.0)
+
+
+@lru_cache(maxsize=1)
+def _decision_writer() -> bool:
+    if not TIER_DECISION_LOG:
+        return False
+    try:
+        os.makedirs(os.path.dirname(TIER_DECISION_LOG) or ".", exist_ok=True)
+        handler = RotatingFileHandler(
+            TIER_DECISION_LOG,
+            maxBytes=TIER_DECISION_LOG_MAX_BYTES,
+            backupCount=TIER_DECISION_LOG_BACKUPS,
+            encoding="utf-8",
+            delay=True,
+        )
+    except OSError as e:
+        print(f"[tier_router] decision log disabled: {e}")
+        return False
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    thread = threading.Thread(target=_write_decisions, args=(handler,), name="tier-decision-log", daemon=True)
+    thread.start()
+    atexit.register(_stop_decision_writer, thread)
+    return True
+
+
+def log_decision(
+    query: str,
+    tier: str,
+    source: str,
+    heuristic_tier: str,
+    score: Optional[float] = None,
+    route_us: float = 0.0,
+) -> None:
+    global _route_us_total
+    with _log_lock:
+        _stats["decisions"] += 1
+        _stats[tier] += 1
+        _stats[source] += 1
+        if source == "router":
+            _route_us_total += route_us
+            if tier == "cheap" and heuristic_tier == "deep":
+                _stats["deep_avoided"] += 1
+            elif tier == "deep" and heuristic_tier == "cheap":
+                _stats["deep_added"] += 1
+    # تصمیم قانون‌ها (بدون مدل) چیزی برای مقایسه نداره؛ فقط شمرده می‌شه
+    if source != "router":
+        return
+    if not _decision_writer():
+        return
+    record = {
+        "ts": round(time.time(), 3),
+        # خود متن سؤال ذخیره نمی‌شه
+        "query_sha1": hashlib.sha1(query.encode("utf-8")).hexdigest()[:16],
+        "query_chars": len(query),
+        "tier": tier,
+        "source": source,
+        "heuristic": heuristic_tier,
+        "score": None if score is None else round(score, 4),
+        "route_us": round(route_us, 2),
+    }
+    _decision_queue.put(json.dumps(record))
+
+
+def router_stats() -> Dict[str, Any]:
+    router = get_tier_router()
+    with _log_lock:
+        out: Dict[str, Any] = dict(_stats)
+        out["mean_route_us"] = round(_route_us_total / _stats["router"], 2) if _stats["router"] else None
+    out["model"] = None if router is None else {"path": TIER_ROUTER_PATH, "threshold": router.threshold, **router.meta}
+    return out
+
+
+def summarize_log(path: str) -> Dict[str, Any]:
+    counts: Dict[str, int] = {"decisions": 0, "cheap": 0, "deep": 0, "heuristic_deep": 0, "deep_avoided": 0, "deep_added": 0}
+    # فایل‌های rotateشده (decisions.jsonl.3 … .1) هم جزو همون گزارشن
+    backups = [f"{path}.{i}" for i in range(TIER_DECISION_LOG_BACKUPS, 0, -1)]
+    for log_path in [p for p in backups + [path] if os.path.isfile(p)]:
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                counts["decisions"] += 1
+                counts[r["tier"]] += 1
+                counts["heuristic_deep"] += r["heuristic"] == "deep"
+                if r["source"] == "router":
+                    counts["deep_avoided"] += r["tier"] == "cheap" and r["heuristic"] == "deep"
+                    counts["deep_added"] += r["tier"] == "deep" and r["heuristic"] == "cheap"
+    n = counts["decisions"] or 1
+    counts["deep_share"] = round(counts["deep"] / n, 4)
+    counts["heuristic_deep_share"] = round(counts["heuristic_deep"] / n, 4)
+    counts["net_deep_calls_saved"] = counts["deep_avoided"] - counts["deep_added"]
+    return counts
+
+
+# ---------- CLI ----------
+def _encode(texts: List[str]) -> np.ndarray:
+    # همون مسیر encode زمان اجرا (نرمال‌سازی + مدل retriever)
+    from app.retriever import encode_query
+    return np.vstack([encode_query(t) for t in texts]).astype(np.float32)
+
+
+def _cmd_train(args: argparse.Namespace) -> int:
+    texts, labels = load_examples(args.examples)
+    embs = _encode(texts)
+    oof = cross_val_scores(embs, labels, args.kind, folds=args.folds)
+    threshold = pick_threshold(oof, labels, args.min_deep_recall)
+    cv = evaluate(oof, labels, threshold)
+
+    router = fit(embs, labels, args.kind)
+    router.threshold = threshold
+    router.meta.update({
+        "examples": len(texts),
+        "deep_examples": labels.count("deep"),
+        "dim": int(embs.shape[1]),
+        "min_deep_recall": args.min_deep_recall,
+        "cv": cv,
+        "trained_at": int(time.time()),
+    })
+    router.save(args.out)
+
+    t0 = time.perf_counter()
+    reps = 20000
+    for i in range(reps):
+        router.score(embs[i % len(embs)])
+    per_call_us = (time.perf_counter() - t0) / reps * 1e6
+
+    print(json.dumps({"out": args.out, "threshold": round(threshold, 4), "cv": cv,
+                      "route_us": round(per_call_us, 2)}, ensure_ascii=False, indent=2))
+    return 0
+
+
+def _cmd_report(args: argparse.Namespace) -> int:
+    # درست بعد از rotate، فایل اصلی تا رکورد بعدی ساخته نمی‌شه
+    if not (os.path.isfile(args.log) or os.path.isfile(f"{args.log}.1")):
+        print(f"[tier_router] no decision log at {args.log}")
+        return 1
+    print(json.dumps(summarize_log(args.log), indent=2))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="آموزش و گزارش router انتخاب tier")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    tr = sub.add_parser("train")
+    tr.add_argument("--examples", default=TIER_EXAMPLES_PATH)
+    tr.add_argument("--kind", choices=("linear", "centroid"), default="linear")
+    tr.add_argument("--folds", type=int, default=5)
+    tr.add_argument("--min-deep-recall", type=float, default=0.9,
+                    help="threshold طوری انتخاب می‌شه که حداقل این نسبت از سؤال‌های deep به مدل قوی برن")
+    tr.add_argument("--out", default=TIER_ROUTER_PATH)
+    rp = sub.add_parser("report")
+    rp.add_argument("--log", default=TIER_DECISION_LOG)
+    args = parser.parse_args(argv)
+    return _cmd_train(args) if args.cmd == "train" else _cmd_report(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,7 +13,7 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from app.generator import generate_answer
+from app.generator import generate_answer_stream
 from app import retriever
 
 
@@ -68,49 +68,32 @@ if submitted and user_msg.strip():
     # ۱. پیام کاربر به تاریخچه اضافه شود
     _append("user", user_text)
 
-    # ۲. ساخت حافظه مکالمه برای مدل
-    convo_lines = []
-    for turn in st.session_state.history[-8:]:
-        role_label = "کاربر" if turn["role"] == "user" else "منتور"
-        convo_lines.append(f"{role_label}: {turn['content']}")
-    conversation_block = "\n".join(convo_lines).strip()
+    # ۲. حافظه مکالمه برای مدل (بدون پیام فعلی؛ context_builder از آخر به عقب تو بودجه جاش می‌ده)
+    history_turns = st.session_state.history[:-1]
 
-    # ۳. بازیابی دانش مرتبط
-    knowledge_chunks = []
+    # ۳. بازیابی دانش مرتبط (hit ها با امتیازشون، برای رتبه‌بندی در بودجه‌ی توکن)
     try:
         retrieved = retriever.retrieve(user_text, top_k=4)
-        for r in retrieved[:4]:
-            txt = r.get("text", "").strip()
-            src = r.get("source", "")
-            if txt:
-                knowledge_chunks.append(f"{txt} (منبع:{src})")
     except Exception:
-        knowledge_chunks = []
+        retrieved = []
 
-    knowledge_block = ""
-    if knowledge_chunks:
-        knowledge_block = "دانش داخلی مرتبط:\n" + "\n\n---\n\n".join(knowledge_chunks)
-
-    # ۴. ساخت context نهایی برای مدل
-    final_context_list = []
-    if knowledge_block:
-        final_context_list.append(knowledge_block)
-    if conversation_block:
-        final_context_list.append("گفتگو تا این لحظه:\n" + conversation_block)
-
-    # ۵. دریافت پاسخ از مدل
-    with st.spinner("در حال فکر کردن..."):
+    # ۴. دریافت پاسخ از مدل (توکن‌ها همون لحظه که می‌رسن نشون داده می‌شن)
+    with st.chat_message("assistant"):
         try:
-            answer_text = generate_answer(
-                query=user_text,
-                context=final_context_list,
+            answer_text = st.write_stream(
+                generate_answer_stream(
+                    query=user_text,
+                    context=retrieved,
+                    history=history_turns,
+                )
             )
         except Exception:
             answer_text = (
                 "الان اتصال من به مدل قطع شده. یک بار دیگه بپرس یا واضح‌تر بگو دنبال چی هستی."
             )
+            st.markdown(answer_text)
 
-    # ۶. نمایش و ذخیره پاسخ
+    # ۵. ذخیره پاسخ
+    if not isinstance(answer_text, str):
+        answer_text = "".join(str(part) for part in answer_text)
     _append("assistant", answer_text)
-    with st.chat_message("assistant"):
-        st.markdown(answer_text)
@@ -0,0 +1,166 @@
+# app/warmup.py
+# warm-up استارت اپ و وضعیت readiness
+#
+# قبلاً اولین کاربرِ بعد از هر deploy/restart کل هزینه‌ی سرد رو می‌داد: import SDK openai،
+# لود مدل MiniLM، ساخت/mmap ایندکس، باز کردن SQLite و ایندکس کش معنایی.
+# حالا این کارها موقع startup تو یک thread پس‌زمینه انجام می‌شن و /ready تا تموم شدنشون
+# 503 برمی‌گردونه تا load balancer ترافیک نفرسته.
+#
+# اندازه‌گیری:
+#   import_sec        → از import این ماژول (اولین خط app.main) تا آخر import اپ
+#   warmup_sec        → کل warm-up و زمان هر مرحله تو steps
+#   first_answer_sec  → از شروع import تا اولین جواب موفق /chat (time-to-first-answer)
+# همه تو /ready و /admin/stats میان؛ app/bench_startup.py همین‌ها رو از یک پروسه‌ی تازه می‌گیره.
+from __future__ import annotations
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# مرجع زمان: app.main این ماژول رو قبل از هر import سنگینی import می‌کنه
+_T0 = time.perf_counter()
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1").strip() not in ("0", "false", "no")
+# warm-up انکودر (لود مدل + یک encode ساختگی): auto یعنی فقط با retriever dense / hybrid یا
+# وقتی مدل مسیریاب tier هست (تو حالت lexical بدون مسیریاب MiniLM اصلاً لود نمی‌شه)
+WARMUP_ENCODER = os.getenv("WARMUP_ENCODER", "auto").strip().lower()
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {
+    "status": "starting",  # starting | warming | ready | failed
+    "steps": {},
+    "error": None,
+    "import_sec": None,
+    "warmup_sec": None,
+    "first_answer_sec": None,
+}
+_thread: Optional[threading.Thread] = None
+
+
+def _since_t0() -> float:
+    return round(time.perf_counter() - _T0, 3)
+
+
+def mark_imported() -> None:
+    """آخر app.main صدا زده می‌شه؛ زمان import اپ."""
+    with _lock:
+        if _state["import_sec"] is None:
+            _state["import_sec"] = _since_t0()
+
+
+def mark_first_answer() -> None:
+    """بعد از هر جواب موفق؛ فقط اولین بار ثبت می‌شه."""
+    if _state["first_answer_sec"] is not None:
+        return
+    with _lock:
+        if _state["first_answer_sec"] is None:
+            _state["first_answer_sec"] = _since_t0()
+            print(f"[warmup] first answer after {_state['first_answer_sec']}s")
+
+
+# ---------- مراحل ----------
+def _step_settings() -> Dict[str, Any]:
+    from app.generator import load_settings
+    s = load_settings()
+    return {"provider": s["MODEL_PROVIDER"]}
+
+
+def _step_caches() -> Dict[str, Any]:
+    from app.generator import warm_up
+    return warm_up()
+
+
+def _step_index() -> Dict[str, Any]:
+    from app import retriever
+    return retriever.warm_up(encode=False)
+
+
+def _encoder_needed() -> bool:
+    if WARMUP_ENCODER != "auto":
+        return WARMUP_ENCODER in ("1", "true", "yes")
+    from app import retriever
+    from app.tier_router import get_tier_router
+    return retriever.RETRIEVER_MODE in ("dense", "hybrid") or get_tier_router() is not None
+
+
+def _step_encoder() -> Dict[str, Any]:
+    if not _encoder_needed():
+        return {"skipped": True}
+    from app import retriever
+    if retriever.RETRIEVER_MODE == "lexical":
+        # فقط مسیریاب بردار کوئری می‌خواد؛ جست‌وجوی dense ساختگی کل corpus رو امبد می‌کرد
+        t0 = time.perf_counter()
+        retriever.encode_query("warm-up")
+        return {"encode_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    return retriever.warm_up(encode=True)
+
+
+# (اسم، تابع، اجباری؟) — شکست مرحله‌ی اختیاری فقط ثبت می‌شه و جلوی ready رو نمی‌گیره
+_STEPS: List[Tuple[str, Callable[[], Dict[str, Any]], bool]] = [
+    ("settings", _step_settings, True),
+    ("caches", _step_caches, False),
+    ("index", _step_index, True),
+    # مدل نبود / خراب بود → /ready همچنان 200؛ جست‌وجوی lexical و کش دقیق بدون مدل کار می‌کنن
+    ("encoder", _step_encoder, False),
+]
+
+
+def run_warmup() -> Dict[str, Any]:
+    """همه‌ی مراحل رو به ترتیب اجرا می‌کنه (blocking) و وضعیت نهایی رو برمی‌گردونه."""
+    with _lock:
+        _state["status"] = "warming"
+    t0 = time.perf_counter()
+    failed = None
+    for name, fn, required in _STEPS:
+        ts = time.perf_counter()
+        entry: Dict[str, Any] = {}
+        try:
+            entry["result"] = fn()
+            entry["ok"] = True
+        except Exception as e:
+            entry["ok"] = False
+            entry["error"] = f"{type(e).__name__}: {e}"
+            print(f"[warmup] step {name} failed: {entry['error']}")
+            if required:
+                traceback.print_exc()
+                failed = failed or f"{name}: {entry['error']}"
+        entry["sec"] = round(time.perf_counter() - ts, 3)
+        with _lock:
+            _state["steps"][name] = entry
+        if failed:
+            break
+
+    with _lock:
+        _state["warmup_sec"] = round(time.perf_counter() - t0, 3)
+        _state["status"] = "failed" if failed else "ready"
+        _state["error"] = failed
+    print(f"[warmup] {_state['status']} in {_state['warmup_sec']}s")
+    return readiness()
+
+
+def start_warmup() -> None:
+    """از startup اپ؛ warm-up رو تو پس‌زمینه راه می‌ندازه (یک بار در هر پروسه)."""
+    global _thread
+    if not WARMUP_ON_STARTUP:
+        with _lock:
+            _state["status"] = "ready"
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=run_warmup, name="app-warmup", daemon=True)
+    _thread.start()
+
+
+def is_ready() -> bool:
+    return _state["status"] == "ready"
+
+
+def readiness() -> Dict[str, Any]:
+    with _lock:
+        out = dict(_state)
+        out["steps"] = {k: dict(v) for k, v in _state["steps"].items()}
+    out["ready"] = out["status"] == "ready"
+    out["uptime_sec"] = _since_t0()
+    return out
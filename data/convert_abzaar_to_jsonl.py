@@ -1,64 +1,131 @@
 # convert_abzaar_to_jsonl.py
+# تبدیل کتاب abzaar.txt به رکوردهای JSONL (متن + متادیتا) برای retriever / ingest
+#
+# - کتاب خط به خط و جریانی خونده می‌شه؛ فصل‌ها از تیترهای «فصل N» + خط بعدش (عنوان) پیدا می‌شن
+#   و هر متن فقط یک بار چانک می‌شه (قبلاً برای هر کلیدواژه کل متنِ بعد از اولین رخدادش
+#   دوباره چانک می‌شد و هر تکه تا چهار بار تو خروجی می‌اومد)
+# - skill / level هر فصل از کلیدواژه‌های عنوان فصل میاد؛ فصل بی‌کلیدواژه فقط chapter داره
+# - چانک سر مرز جمله با هدف توکنی و هم‌پوشانی (ingest/chunk)
+# - چانک‌های تقریباً تکراری قبل از امبدینگ با MinHash حذف یا ادغام می‌شن (ingest/dedup)
+#
+# اجرا:
+#   python data/convert_abzaar_to_jsonl.py --max-tokens 200 --overlap-tokens 30 --dedup merge
+import argparse
 import json
+import os
+import re
+import sys
+import tempfile
+from itertools import groupby
 from pathlib import Path
 
-source_path = Path("data/abzaar.txt")
-output_path = Path("data/abzaar_full_clean.jsonl")
-
-# تقسیم متن به تکه‌های کوچک‌تر
-def chunk_text(text, max_chars=600):
-    sentences = text.split(" ")
-    chunks, current = [], ""
-    for s in sentences:
-        if len(current) + len(s) < max_chars:
-            current += s + " "
-        else:
-            chunks.append(current.strip())
-            current = s + " "
-    if current:
-        chunks.append(current.strip())
-    return chunks
-
-# خواندن متن
-with open(source_path, "r", encoding="utf-8") as f:
-    full_text = f.read()
-
-# تشخیص فصل‌ها با کلیدواژه‌ها
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from ingest.chunk import (  # noqa: E402
+    CHUNK_MAX_TOKENS,
+    CHUNK_MIN_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    chunk_sentences_by_tokens,
+    iter_sentences,
+)
+from ingest.clean import clean_text  # noqa: E402
+from ingest.dedup import DEDUP_MODES, DEDUP_THRESHOLD, dedup_records  # noqa: E402
+
+source_path = ROOT / "data" / "abzaar.txt"
+output_path = ROOT / "data" / "abzaar_full_clean.jsonl"
+
+# کلیدواژه‌ی عنوان فصل → (skill, level)
 chapters = {
     "هدف": ("هدف‌گذاری و مدیریت زمان", "پایه"),
     "مذاکره": ("مذاکره و تصمیم‌گیری", "پیشرفته"),
     "فروش": ("فروش و بازاریابی", "متوسط"),
+    "بازاریابی": ("فروش و بازاریابی", "متوسط"),
     "رهبری": ("رهبری و تیم‌سازی", "پیشرفته"),
+    "تیم": ("رهبری و تیم‌سازی", "پیشرفته"),
 }
 
-records = []
-for key, (skill, level) in chapters.items():
-    if key in full_text:
-        part = full_text.split(key, 1)[1]
-        chunks = chunk_text(part)
-        for c in chunks:
-            records.append({
-                "text": c,
-                "metadata": {
-                    "domain": "business",
-                    "skill": skill,
-                    "level": level,
-                    "language": "fa",
-                    "chapter": f"فصل مرتبط با {skill}"
-                }
-            })
-
-# جمع‌بندی
-summary = [
-    {"skill": s, "level": l, "paragraphs": sum(1 for r in records if r["metadata"]["skill"] == s)}
-    for _, (s, l) in chapters.items()
-]
-records.append({"summary": summary})
-
-# ذخیره فایل JSONL
-with open(output_path, "w", encoding="utf-8") as f:
-    for rec in records:
-        json.dump(rec, f, ensure_ascii=False)
+_CHAPTER_RE = re.compile(r"^\s*فصل\s*([0-9۰-۹]+)\s*$")
+PREFACE = "پیشگفتار"
+
+
+def iter_chapter_lines(path):
+    """(عنوان فصل، خط) برای هر خط کتاب؛ خط‌های قبل از اولین «فصل N» مال پیشگفتارن."""
+    chapter = PREFACE
+    pending = None  # شماره‌ی فصلی که عنوانش هنوز نیومده
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = _CHAPTER_RE.match(line)
+            if m:
+                pending = m.group(1)
+                continue
+            if pending is not None and line.strip():
+                chapter = f"فصل {pending}: {line.strip()}"
+                pending = None
+            yield chapter, line
+
+
+def chapter_metadata(chapter):
+    meta = {"domain": "business", "language": "fa", "chapter": chapter}
+    for key, (skill, level) in chapters.items():
+        if key in chapter:
+            meta.update(skill=skill, level=level)
+            break
+    return meta
+
+
+def iter_records(path, max_tokens, overlap_tokens, min_tokens):
+    # هر فصل جدا چانک می‌شه تا هیچ چانکی متادیتای دو فصل رو قاطی نکنه
+    for chapter, lines in groupby(iter_chapter_lines(path), key=lambda item: item[0]):
+        sentences = (s for _, line in lines for s in iter_sentences(clean_text(line)))
+        metadata = chapter_metadata(chapter)
+        for text in chunk_sentences_by_tokens(sentences, max_tokens, overlap_tokens, min_tokens):
+            yield {"text": text, "metadata": dict(metadata)}
+
+
+def _skills_of(record):
+    skill = record["metadata"].get("skill")
+    return skill if isinstance(skill, list) else [skill]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="abzaar.txt → JSONL چانک‌شده و بدون تکرار")
+    parser.add_argument("--source", default=str(source_path))
+    parser.add_argument("--output", default=str(output_path))
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--min-tokens", type=int, default=CHUNK_MIN_TOKENS)
+    parser.add_argument("--dedup", choices=DEDUP_MODES + ("off",), default="merge")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="Jaccard تخمینی تکراری‌ها")
+    args = parser.parse_args()
+
+    records = iter_records(args.source, args.max_tokens, args.overlap_tokens, args.min_tokens)
+    stats = {}
+    if args.dedup != "off":
+        records = dedup_records(records, mode=args.dedup, stats=stats, threshold=args.threshold)
+
+    counts = {}
+    out = Path(args.output)
+    fd, tmp = tempfile.mkstemp(dir=str(out.parent), prefix=out.name, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for rec in records:
+            for skill in _skills_of(rec):
+                counts[skill] = counts.get(skill, 0) + 1
+            json.dump(rec, f, ensure_ascii=False)
+            f.write("\n")
+
+        # جمع‌بندی (retriever و ingest رکورد بدون text رو رد می‌کنن)
+        levels = {skill: level for skill, level in chapters.values()}
+        summary = [{"skill": s, "level": l, "paragraphs": counts.get(s, 0)} for s, l in levels.items()]
+        json.dump({"summary": summary}, f, ensure_ascii=False)
         f.write("\n")
+    os.replace(tmp, out)
+
+    if stats:
+        print(f"chunks: {stats['input']}, near-duplicates ({args.dedup}): {stats['duplicates']}, kept: {stats['kept']}")
+    print(f"✅ فایل JSONL با موفقیت ساخته شد: {out} ({out.stat().st_size / 1e6:.2f} MB)")
+
 
-print(f"✅ فایل JSONL با موفقیت ساخته شد: {output_path}")
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,50 @@
 # ingest/build_faiss.py
 import os
+import sys
 import json
+import argparse
+import multiprocessing
+import shutil
+import time
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Sequence
 
-def load_documents(data_dir: str = "data/") -> List[Dict[str, str]]:
+# برای import ماژول‌های app وقتی اسکریپت مستقیم اجرا می‌شه
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.bm25 import BM25Index  # noqa: E402
+from app.chunk_store import ChunkStoreWriter  # noqa: E402
+from app.faiss_backend import remove_legacy_meta  # noqa: E402
+from ingest.chunk import CHUNK_MAX_CHARS, CHUNK_MIN_CHARS, CHUNK_OVERLAP_CHARS, chunk_text  # noqa: E402
+from ingest.clean import clean_text  # noqa: E402
+
+# نوع‌های ایندکس قابل انتخاب:
+# - flat:      جست‌وجوی دقیق (برای corpus کوچک)
+# - ivf_flat:  خوشه‌بندی + بردار کامل؛ nprobe سرعت/دقت رو تنظیم می‌کنه
+# - ivf_pq:    خوشه‌بندی + فشرده‌سازی PQ؛ کمترین حافظه برای corpus خیلی بزرگ
+# - hnsw:      گراف HNSW؛ efSearch سرعت/دقت رو تنظیم می‌کنه
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+SHARDS_DIR = "_shards"
+# ایندکس‌های IVF / PQ روی نمونه‌ای با حداکثر این تعداد بردار train می‌شن، نه کل corpus تو RAM
+MAX_TRAIN_ROWS = 100_000
+
+
+def load_documents(data_dir: str = "data/") -> List[Dict[str, Any]]:
     """
-    بارگذاری فایل‌های متنی از پوشه `data/` و تقسیم آن‌ها به چانک‌ها.
+    بارگذاری فایل‌های متنی (.txt) و رکوردهای JSONL (.jsonl، همراه metadata) از پوشه `data/`.
 
     Args:
         data_dir (str): مسیر پوشه حاوی فایل‌های متنی.
 
     Returns:
-        List[Dict[str, str]]: لیست چانک‌ها با متن و منبع.
+        List[Dict[str, Any]]: لیست چانک‌ها با متن، منبع و (برای JSONL) metadata.
     """
     documents = []
     for filename in os.listdir(data_dir):
@@ -27,50 +56,328 @@ def load_documents(data_dir: str = "data/") -> List[Dict[str, str]]:
                     "text": content,
                     "source": filename
                 })
+        elif filename.endswith(".jsonl"):
+            # خروجی convert_abzaar_to_jsonl.py: هر رکورد یک چانک با metadata (skill / level / ...)
+            filepath = os.path.join(data_dir, filename)
+            with open(filepath, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if not record.get("text"):
+                        continue
+                    documents.append({
+                        "text": record["text"],
+                        "source": filename,
+                        "metadata": record.get("metadata") or {},
+                    })
     return documents
 
-def build_index(documents: List[Dict[str, str]], output_dir: str = "faiss_index") -> None:
+
+def chunk_documents(
+    documents: List[Dict[str, Any]],
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+    min_chars: int = CHUNK_MIN_CHARS,
+) -> List[Dict[str, Any]]:
+    """
+    هر سند (کل یک فایل .txt یا یک رکورد JSONL) → چانک‌های تمیزشده‌ی سر مرز جمله.
+    قبلاً کل abzaar.txt یک بردار می‌شد و MiniLM بعد از ۲۵۶ توکن بقیه‌اش رو بی‌صدا دور می‌ریخت.
+
+    Returns:
+        List[Dict[str, Any]]: همون شکل documents (text / source / metadata) ولی یک عضو برای هر چانک.
+    """
+    chunks = []
+    for doc in documents:
+        for text in chunk_text(clean_text(doc["text"]), max_chars, overlap_chars, min_chars):
+            chunk = {"text": text, "source": doc["source"]}
+            if doc.get("metadata"):
+                chunk["metadata"] = doc["metadata"]
+            chunks.append(chunk)
+    return chunks
+
+
+def _embed_shard(
+    shard_id: int,
+    chunks: List[Dict[str, Any]],
+    shard_dir: str,
+    torch_threads: Optional[int],
+    batch_size: int,
+) -> Dict[str, Any]:
+    """
+    کار هر worker: مدل خودش رو لود می‌کنه (با سقف thread های torch تا worker ها سر هسته‌ها
+    دعوا نکنن)، چانک‌های shard رو batch به batch امبد می‌کنه و shard_<id>.npy (بردارها)
+    و shard_<id>.jsonl (متن/منبع/metadata) رو می‌نویسه.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if torch_threads:
+        try:
+            import torch  # type: ignore
+            torch.set_num_threads(int(torch_threads))
+        except Exception:
+            pass
+
+    t0 = time.perf_counter()
+    model = SentenceTransformer(EMBED_MODEL_NAME)
+    load_sec = time.perf_counter() - t0
+
+    vec_path = os.path.join(shard_dir, f"shard_{shard_id:03d}.npy")
+    out = None
+    t1 = time.perf_counter()
+    for start in range(0, len(chunks), batch_size):
+        batch = [c["text"] for c in chunks[start:start + batch_size]]
+        embs = model.encode(batch, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+        if out is None:
+            out = np.lib.format.open_memmap(vec_path, mode="w+", dtype="float32", shape=(len(chunks), embs.shape[1]))
+        out[start:start + len(batch)] = embs
+    if out is not None:
+        out.flush()
+        del out
+    encode_sec = time.perf_counter() - t1
+
+    with open(os.path.join(shard_dir, f"shard_{shard_id:03d}.jsonl"), "w", encoding="utf-8") as f:
+        for c in chunks:
+            f.write(json.dumps(c, ensure_ascii=False) + "\n")
+
+    return {
+        "shard": shard_id,
+        "rows": len(chunks),
+        "load_sec": round(load_sec, 2),
+        "encode_sec": round(encode_sec, 2),
+        "chunks_per_sec": round(len(chunks) / encode_sec, 1) if encode_sec > 0 else None,
+    }
+
+
+def embed_sharded(
+    chunks: List[Dict[str, Any]],
+    shard_dir: str,
+    workers: int = 1,
+    torch_threads: Optional[int] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> List[Dict[str, Any]]:
+    """
+    چانک‌ها به workers تکه‌ی پشت سر هم تقسیم می‌شن و هر تکه تو یک process جدا (spawn) امبد
+    می‌شه. با workers=1 همین process کار رو می‌کنه. خروجی: گزارش shard ها به ترتیب.
+    """
+    Path(shard_dir).mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(workers, len(chunks)))
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    bounds = np.linspace(0, len(chunks), workers + 1).astype(int)
+    shards = [chunks[bounds[i]:bounds[i + 1]] for i in range(workers)]
+
+    if workers == 1:
+        return [_embed_shard(0, shards[0], shard_dir, torch_threads, batch_size)]
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(_embed_shard, i, shard, shard_dir, torch_threads, batch_size)
+            for i, shard in enumerate(shards)
+        ]
+        return [f.result() for f in futures]
+
+
+def make_faiss_index(
+    dimension: int,
+    n_vectors: int,
+    index_type: str = "flat",
+    nlist: Optional[int] = None,
+    pq_m: int = 16,
+    hnsw_m: int = 32,
+) -> faiss.Index:
+    """
+    ساخت ایندکس خالی FAISS با متریک ضرب داخلی (روی بردارهای نرمال = شباهت کسینوسی).
+
+    Args:
+        dimension (int): بُعد بردارها.
+        n_vectors (int): تعداد بردارها (برای انتخاب پیش‌فرض nlist).
+        index_type (str): یکی از INDEX_TYPES.
+        nlist (Optional[int]): تعداد خوشه‌های IVF؛ پیش‌فرض حدود sqrt(N).
+        pq_m (int): تعداد زیربردارهای PQ (باید بُعد بر آن بخش‌پذیر باشد).
+        hnsw_m (int): تعداد همسایه‌های هر گره در HNSW.
+
+    Returns:
+        faiss.Index: ایندکس آماده‌ی train/add.
+    """
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        if nlist is None:
+            nlist = max(1, int(np.sqrt(n_vectors)))
+        # FAISS برای train حداقل به اندازه‌ی nlist نمونه نیاز دارد
+        nlist = max(1, min(nlist, n_vectors))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        # هر کد PQ با nbits بیت به 2^nbits نمونه‌ی train نیاز دارد؛ برای corpus کوچک کمش می‌کنیم
+        nbits = max(1, min(8, int(np.log2(max(2, n_vectors)))))
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, nbits, metric)
+
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dimension, hnsw_m, metric)
+
+    raise ValueError(f"unknown index_type {index_type!r}; expected one of {INDEX_TYPES}")
+
+
+def train_sample(parts: Sequence[np.ndarray], max_rows: int = MAX_TRAIN_ROWS, seed: int = 0) -> np.ndarray:
+    """
+    نمونه‌ی یکنواخت (بدون تکرار، به ترتیب سطرها) از سطرهای چند آرایه‌ی پشت سر هم (مثلاً shard های
+    mmapشده)؛ فقط سطرهای نمونه تو حافظه کپی می‌شن. اگر کل سطرها کمتر از max_rows باشه همه برمی‌گردن.
+    """
+    sizes = [len(p) for p in parts]
+    total = sum(sizes)
+    if total <= max_rows:
+        return np.ascontiguousarray(np.concatenate(parts) if len(parts) > 1 else parts[0])
+    pick = np.sort(np.random.default_rng(seed).choice(total, max_rows, replace=False))
+    starts = np.cumsum([0] + sizes)
+    picked = [
+        part[pick[(pick >= lo) & (pick < hi)] - lo]
+        for part, lo, hi in zip(parts, starts[:-1], starts[1:])
+    ]
+    return np.ascontiguousarray(np.concatenate(picked))
+
+
+def build_index(
+    documents: List[Dict[str, str]],
+    output_dir: str = "faiss_index",
+    index_type: str = "flat",
+    nlist: Optional[int] = None,
+    pq_m: int = 16,
+    hnsw_m: int = 32,
+    workers: int = 1,
+    torch_threads: Optional[int] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+) -> Dict[str, Any]:
     """
     ساخت ایندکس FAISS و ذخیره متادیتا.
+    خروجی همون artifactیه که app/retriever.py با RETRIEVER_BACKEND=faiss لود می‌کنه.
 
     Args:
-        documents (List[Dict[str, str]]): لیست چانک‌ها با متن و منبع.
+        documents (List[Dict[str, str]]): لیست سندها با متن و منبع (قبل از چانک).
         output_dir (str): مسیر خروجی برای ذخیره ایندکس و متادیتا.
+        index_type (str): نوع ایندکس (flat, ivf_flat, ivf_pq, hnsw).
+        nlist (Optional[int]): تعداد خوشه‌ها برای ایندکس‌های IVF.
+        pq_m (int): تعداد زیربردارهای PQ برای ivf_pq.
+        hnsw_m (int): پارامتر M برای hnsw.
+        workers (int): تعداد process های امبدینگ (هر کدوم یک کپی مدل).
+        torch_threads (Optional[int]): سقف thread های torch هر worker؛ پیش‌فرض cpu / workers.
+        batch_size (int): اندازه‌ی batch امبدینگ.
+        max_chars (int): سقف طول هر چانک.
+        overlap_chars (int): هم‌پوشانی چانک‌های پشت سر هم.
+
+    Returns:
+        Dict[str, Any]: گزارش ساخت (تعداد چانک‌ها، زمان‌ها و چانک بر ثانیه).
     """
     # ایجاد پوشه خروجی اگر وجود ندارد
     Path(output_dir).mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
 
-    # بارگذاری مدل امبدینگ
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-
-    # استخراج متن‌ها و منابع
-    texts = [doc["text"] for doc in documents]
-    sources = [{"source": doc["source"], "chunk_idx": i} for i, doc in enumerate(documents)]
+    # چانک کردن سندها (هر بردار یک چانک، نه کل فایل)
+    chunks = chunk_documents(documents, max_chars=max_chars, overlap_chars=overlap_chars)
+    if not chunks:
+        raise ValueError("no chunks to index")
 
-    # امبدینگ متن‌ها
-    embeddings = model.encode(texts)
+    # امبدینگ موازی؛ هر worker یک shard از بردارها و متادیتا می‌نویسه
+    shard_dir = os.path.join(output_dir, SHARDS_DIR)
+    t_embed = time.perf_counter()
+    shard_reports = embed_sharded(chunks, shard_dir, workers=workers, torch_threads=torch_threads, batch_size=batch_size)
+    embed_sec = time.perf_counter() - t_embed
+    del chunks
 
+    # ادغام shard ها به ترتیب (بردارها با mmap خونده می‌شن)
+    vectors = [
+        np.load(os.path.join(shard_dir, f"shard_{r['shard']:03d}.npy"), mmap_mode="r")
+        for r in shard_reports if r["rows"]
+    ]
     # ساخت ایندکس FAISS
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
+    dimension = vectors[0].shape[1]
+    index = make_faiss_index(dimension, sum(r["rows"] for r in shard_reports), index_type, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    if not index.is_trained:
+        index.train(train_sample(vectors))
+    for shard_vectors in vectors:
+        index.add(np.ascontiguousarray(shard_vectors))
+    del vectors
+
+    # ذخیره ایندکس FAISS؛ retriever همین فایل رو mmap کرده، پس اول تو .tmp و بعد rename
+    # (بازنویسی درجا فایل mmapشده‌ی API در حال اجرا رو کوتاه / نیمه‌کاره می‌کرد)
+    index_path = os.path.join(output_dir, "index.faiss")
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
 
-    # ذخیره ایندکس FAISS
-    faiss.write_index(index, os.path.join(output_dir, "index.faiss"))
+    # متن / منبع / metadata (skill / level / chapter / ... برای فیلتر در retriever) جریانی
+    # به انبار باینری چانک‌ها (app/chunk_store) نوشته می‌شن، بدون جمع کردن همه تو حافظه
+    extra = {"model": EMBED_MODEL_NAME, "index_type": index_type, "metric": "ip"}
+    rows = 0
+    with ChunkStoreWriter(output_dir, extra=extra) as writer:
+        for r in shard_reports:
+            with open(os.path.join(shard_dir, f"shard_{r['shard']:03d}.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    chunk = json.loads(line)
+                    writer.add(chunk["text"], chunk["source"], rows, chunk.get("metadata"))
+                    rows += 1
+    store = writer.store
+    remove_legacy_meta(output_dir)
 
-    # ذخیره متادیتا
-    meta = {
-        "texts": texts,
-        "sources": sources
+    # ایندکس معکوس BM25 کنار ایندکس برداری (برای حالت lexical / hybrid در retriever)
+    BM25Index.build(store.texts, fingerprint=store.fingerprint).save(os.path.join(output_dir, "bm25.npz"))
+    shutil.rmtree(shard_dir, ignore_errors=True)
+
+    return {
+        "documents": len(documents),
+        "chunks": len(store),
+        "workers": len(shard_reports),
+        "embed_sec": round(embed_sec, 2),
+        # شامل لود مدل در هر worker؛ همون عددی که با تعداد هسته باید بالا بره
+        "chunks_per_sec": round(len(store) / embed_sec, 1) if embed_sec > 0 else None,
+        "total_sec": round(time.perf_counter() - t0, 2),
+        "shards": shard_reports,
     }
-    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=4)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ساخت ایندکس FAISS برای retriever")
+    parser.add_argument("--data-dir", default="data/")
+    parser.add_argument("--output-dir", default="faiss_index")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1, help="process های امبدینگ (هر کدوم یک کپی مدل)")
+    parser.add_argument("--torch-threads", type=int, default=None, help="پیش‌فرض: تعداد هسته / workers")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--max-chars", type=int, default=CHUNK_MAX_CHARS)
+    parser.add_argument("--overlap-chars", type=int, default=CHUNK_OVERLAP_CHARS)
+    args = parser.parse_args()
+
     # بارگذاری و پردازش فایل‌ها
-    documents = load_documents()
+    documents = load_documents(args.data_dir)
 
     # ساخت ایندکس
-    build_index(documents)
+    report = build_index(
+        documents,
+        output_dir=args.output_dir,
+        index_type=args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        workers=args.workers,
+        torch_threads=args.torch_threads,
+        batch_size=args.batch_size,
+        max_chars=args.max_chars,
+        overlap_chars=args.overlap_chars,
+    )
 
+    for shard in report["shards"]:
+        print(f"  shard {shard['shard']}: {shard['rows']} chunks, model load {shard['load_sec']}s, "
+              f"encode {shard['encode_sec']}s ({shard['chunks_per_sec']} chunks/s)")
+    print(f"{report['chunks']} chunks from {report['documents']} documents, "
+          f"{report['workers']} workers: {report['chunks_per_sec']} chunks/s (embedding {report['embed_sec']}s, "
+          f"total {report['total_sec']}s)")
     print("ایندکس FAISS و متادیتا با موفقیت ساخته شدند!")
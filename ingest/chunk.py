@@ -0,0 +1,163 @@
+# ingest/chunk.py
+# مرحله‌ی سوم pipeline ingest: شکستن متن تمیز به چانک‌های هم‌اندازه سر مرز جمله
+#
+# - جمله‌ها (و پاراگراف‌ها) تا سقف max_chars کنار هم چیده می‌شن؛ جمله‌ی بلندتر از سقف
+#   سر مرز کلمه شکسته می‌شه (MiniLM بیشتر از ۲۵۶ توکن رو بی‌صدا می‌بُره)
+# - چند جمله‌ی آخر هر چانک (تا overlap_chars) اول چانک بعدی تکرار می‌شن تا جوابی که سر
+#   مرز دو چانک افتاده گم نشه
+# - همه‌چیز generator است؛ حافظه به اندازه‌ی یک چانک
+# - طول پیش‌فرض کاراکتره؛ chunk_sentences_by_tokens همین کار رو با هدف توکنی (شمارنده‌ی
+#   context_builder، یعنی tiktoken یا تخمین کاراکتری) انجام می‌ده
+from __future__ import annotations
+import os
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+from ingest.clean import clean_text
+
+CHUNK_MAX_CHARS = int(os.getenv("INGEST_CHUNK_MAX_CHARS", "800"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("INGEST_CHUNK_OVERLAP_CHARS", "120"))
+# چانک‌های کوتاه‌تر از این (تیتر تنها، شماره‌ی فصل) ارزش امبدینگ ندارن
+CHUNK_MIN_CHARS = int(os.getenv("INGEST_CHUNK_MIN_CHARS", "40"))
+# هدف‌های توکنی؛ سقف زیر پنجره‌ی ۲۵۶ توکنی MiniLM با کمی حاشیه
+CHUNK_MAX_TOKENS = int(os.getenv("INGEST_CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("INGEST_CHUNK_OVERLAP_TOKENS", "30"))
+CHUNK_MIN_TOKENS = int(os.getenv("INGEST_CHUNK_MIN_TOKENS", "12"))
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?؟…])\s+|\n+")
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    for sent in _SENTENCE_END_RE.split(text):
+        sent = sent.strip()
+        if sent:
+            yield sent
+
+
+def _split_words(sentence: str, max_chars: int, length: Callable[[str], int]) -> Iterator[str]:
+    # «کلمه»‌ی بلندتر از سقف (مثل خط نقطه‌چین جای خالی فرم‌ها) به تکه‌های هم‌اندازه بریده می‌شه
+    for w in sentence.split(" "):
+        n = length(w)
+        if n <= max_chars:
+            yield w
+            continue
+        step = max(1, len(w) * max_chars // n)
+        for start in range(0, len(w), step):
+            yield w[start:start + step]
+
+
+def _split_long(sentence: str, max_chars: int, length: Callable[[str], int] = len) -> Iterator[str]:
+    # جمله‌ی بی‌نقطه‌ی خیلی بلند → تکه‌های حداکثر max_chars سر فاصله
+    part: List[str] = []
+    size = 0
+    for w in _split_words(sentence, max_chars, length):
+        cost = length(w) + 1
+        if part and size + cost > max_chars:
+            yield " ".join(part)
+            part, size = [], 0
+        part.append(w)
+        size += cost
+    if part:
+        yield " ".join(part)
+
+
+def chunk_sentences(
+    sentences: Iterable[str],
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+    min_chars: int = CHUNK_MIN_CHARS,
+    length: Callable[[str], int] = len,
+) -> Iterator[str]:
+    """
+    جمله‌ها → چانک‌های حداکثر max_chars با هم‌پوشانی جمله‌ای حداکثر overlap_chars.
+    واحد هر سه عدد همون واحد length است (پیش‌فرض کاراکتر)؛ +1 هر جمله جای فاصله‌ی بینشونه
+    و با length توکنی یک حاشیه‌ی امن کوچیک حساب می‌شه.
+    """
+    window: List[str] = []
+    sizes: List[int] = []
+    size = 0
+    fresh = 0  # جمله‌های این چانک که تو چانک قبلی نبودن
+
+    def _flush() -> Iterator[str]:
+        nonlocal window, sizes, size, fresh
+        if fresh:
+            chunk = " ".join(window)
+            if (size if length is not len else len(chunk)) >= min_chars:
+                yield chunk
+        # جمله‌های انتهایی برای هم‌پوشانی (و فقط اگر کل چانک نباشن)
+        keep = 0
+        tail_size = 0
+        for cost in reversed(sizes[1:]):
+            if tail_size + cost > overlap_chars:
+                break
+            keep += 1
+            tail_size += cost
+        window = window[len(window) - keep:] if keep else []
+        sizes = sizes[len(sizes) - keep:] if keep else []
+        size, fresh = tail_size, 0
+
+    for sentence in sentences:
+        cost = length(sentence) + 1
+        if cost - 1 <= max_chars:
+            pieces = [(sentence, cost)]
+        else:
+            pieces = [(p, length(p) + 1) for p in _split_long(sentence, max_chars, length)]
+        for piece, cost in pieces:
+            if window and size + cost > max_chars:
+                yield from _flush()
+                if size + cost > max_chars:
+                    window, sizes, size = [], [], 0
+            window.append(piece)
+            sizes.append(cost)
+            size += cost
+            fresh += 1
+    yield from _flush()
+
+
+def chunk_sentences_by_tokens(
+    sentences: Iterable[str],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    min_tokens: int = CHUNK_MIN_TOKENS,
+    model: str = "",
+) -> Iterator[str]:
+    """مثل chunk_sentences ولی با هدف‌های توکنی (همون شمارش بودجه‌ی پرامپت در context_builder)."""
+    from app.context_builder import count_tokens
+
+    return chunk_sentences(
+        sentences, max_tokens, overlap_tokens, min_tokens, length=lambda text: count_tokens(text, model)
+    )
+
+
+def chunk_text(
+    text: str,
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+    min_chars: int = CHUNK_MIN_CHARS,
+) -> Iterator[str]:
+    return chunk_sentences(iter_sentences(text), max_chars, overlap_chars, min_chars)
+
+
+def clean_and_chunk(
+    segment: Dict[str, Any],
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+    min_chars: int = CHUNK_MIN_CHARS,
+) -> Dict[str, Any]:
+    """
+    کار هر worker در process pool: segment خام crawl → {"seq", "source", "metadata", "chunks"}.
+    رکوردهای JSONL خودشون چانک‌ان؛ فقط اگر از سقف بلندتر باشن شکسته می‌شن.
+    """
+    text = clean_text(segment["text"])
+    chunks = list(chunk_text(text, max_chars, overlap_chars, min_chars))
+    return {
+        "seq": segment["seq"],
+        "source": segment["source"],
+        "metadata": segment["metadata"],
+        "chunks": chunks,
+    }
+
+
+def clean_and_chunk_many(segments: List[Dict[str, Any]], *args: Any) -> List[Dict[str, Any]]:
+    # رکوردهای کوچیک JSONL دسته‌ای به pool فرستاده می‌شن تا هزینه‌ی IPC هر کار سرشکن بشه
+    return [clean_and_chunk(segment, *args) for segment in segments]
@@ -0,0 +1,69 @@
+# ingest/clean.py
+# مرحله‌ی دوم pipeline ingest: نرمال‌سازی و تمیزکاری متن فارسی قبل از چانک و امبدینگ
+#
+# فرقش با app/text_norm.normalize_text: اون برای کلید جست‌وجو/کش است (lowercase، حذف
+# نیم‌فاصله، یک خط). اینجا متن بعداً به کاربر و مدل نشون داده می‌شه، پس:
+# - ي/ى → ی ، ك → ک ، ارقام عربی → ارقام فارسی (نیم‌فاصله و حروف دیگه دست نمی‌خورن)
+# - اعراب و کشیده حذف، کاراکترهای کنترلی و صفرعرض غیر از ZWNJ حذف
+# - نیم‌فاصله‌های تکراری یا چسبیده به فاصله جمع می‌شن
+# - خط‌هایی که فقط شماره‌ی صفحه‌ان حذف، فاصله‌های اضافه و فاصله‌ی قبل از علائم جمع می‌شن
+# - مرز پاراگراف (خط خالی) حفظ می‌شه چون chunker ازش استفاده می‌کنه
+from __future__ import annotations
+import re
+from typing import Any, Dict
+
+_CHAR_MAP = str.maketrans({
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "\u00a0": " ",     # NBSP
+    "\u2028": "\n",    # line separator
+    "\u2029": "\n\n",  # paragraph separator
+    **{chr(0x0660 + i): chr(0x06F0 + i) for i in range(10)},  # ٠-٩ → ۰-۹
+})
+
+# اعراب عربی + کشیده (tatweel)
+_DIACRITICS_RE = re.compile("[\u064b-\u065f\u0670\u0640]")
+# ZWJ، LRM/RLM، جهت‌دهنده‌های bidi و BOM (ZWNJ جدا رسیدگی می‌شه)
+_INVISIBLE_RE = re.compile("[\u200d\u200e\u200f\u202a-\u202e\u2066-\u2069\ufeff]")
+# کنترلی‌ها به جز \t و \n
+_CONTROL_RE = re.compile("[\x00-\x08\x0b-\x1f\x7f]")
+_ZWNJ_RUN_RE = re.compile("\u200c{2,}")
+# فقط فاصله و tab؛ \s خط‌های خالی رو هم می‌خورد و پاراگراف‌ها قبل از چانک کردن یکی می‌شدن
+_ZWNJ_SPACE_RE = re.compile(r"[ \t]*\u200c[ \t]+|[ \t]+\u200c[ \t]*")
+# نیم‌فاصله‌ی اول / آخر خط به چیزی نمی‌چسبه
+_ZWNJ_EDGE_RE = re.compile("^\u200c|\u200c$", re.MULTILINE)
+_SPACES_RE = re.compile(r"[ \t\f\v]+")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r" +([.,!?:;،؛؟»)\]])")
+_PAGE_NUMBER_LINE_RE = re.compile(r"^\s*[-–—]?\s*[0-9۰-۹]{1,4}\s*[-–—]?\s*$")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def normalize_persian(text: str) -> str:
+    """یکسان‌سازی حروف و حذف کاراکترهای نامرئی/اعراب؛ بدون تغییر ساختار خط‌ها."""
+    if not text:
+        return ""
+    txt = text.replace("\r\n", "\n").replace("\r", "\n").translate(_CHAR_MAP)
+    txt = _DIACRITICS_RE.sub("", txt)
+    txt = _INVISIBLE_RE.sub("", txt)
+    txt = _CONTROL_RE.sub("", txt)
+    txt = _ZWNJ_RUN_RE.sub("\u200c", txt)
+    txt = _ZWNJ_EDGE_RE.sub("", txt)
+    # نیم‌فاصله‌ی کنار فاصله بی‌معنیه؛ فقط فاصله می‌مونه
+    return _ZWNJ_SPACE_RE.sub(" ", txt)
+
+
+def clean_text(text: str) -> str:
+    """متن تمیز برای چانک؛ پاراگراف‌ها با یک خط خالی جدا می‌مونن."""
+    lines = []
+    for line in normalize_persian(text).split("\n"):
+        if _PAGE_NUMBER_LINE_RE.match(line):
+            line = ""
+        line = _SPACES_RE.sub(" ", line).strip()
+        lines.append(_SPACE_BEFORE_PUNCT_RE.sub(r"\1", line))
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def clean_segment(segment: Dict[str, Any]) -> Dict[str, Any]:
+    """segment خروجی crawl.iter_segments با متن تمیزشده."""
+    return {**segment, "text": clean_text(segment["text"])}
@@ -0,0 +1,100 @@
+# ingest/crawl.py
+# مرحله‌ی اول pipeline ingest: پیدا کردن فایل‌های داده و خوندن تدریجی‌شون
+#
+# build_faiss.py هر فایل رو کامل با f.read() تو حافظه می‌آورد. اینجا هر فایل به «segment»
+# های حداکثر حدود SEGMENT_CHARS کاراکتری (سر مرز پاراگراف) شکسته می‌شه و به صورت generator
+# بیرون میاد؛ پس حافظه به اندازه‌ی یک segment است نه کل فایل.
+#
+# ترتیب فایل‌ها و segment ها قطعیه (مسیرهای مرتب‌شده)، تا شماره‌ی segment (seq) بین دو
+# اجرا ثابت بمونه و checkpoint بتونه از وسط ادامه بده.
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+SOURCE_EXTS = (".txt", ".jsonl")
+SEGMENT_CHARS = int(os.getenv("INGEST_SEGMENT_CHARS", "65536"))
+
+
+def list_sources(roots: Iterable[str], exts: Tuple[str, ...] = SOURCE_EXTS) -> List[str]:
+    """
+    فایل‌های داده‌ی روی سطح اول هر root (مرتب)؛ root می‌تونه خود فایل هم باشه.
+    مثل retriever زیرپوشه‌ها خونده نمی‌شن (مثلاً data/tier_router/ دانش نیست).
+    """
+    found = set()
+    for root in roots:
+        if os.path.isfile(root):
+            candidates = [root]
+        elif os.path.isdir(root):
+            candidates = [os.path.join(root, name) for name in os.listdir(root)]
+        else:
+            continue
+        for path in candidates:
+            if path.endswith(exts) and os.path.isfile(path):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+def sources_fingerprint(paths: Iterable[str]) -> str:
+    """امضای مجموعه‌ی فایل‌ها (مسیر، اندازه، mtime)؛ عوض شدنش یعنی checkpoint قبلی معتبر نیست."""
+    h = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _iter_text_file(path: str, max_chars: int) -> Iterator[str]:
+    # خط به خط؛ segment سر خط خالی (مرز پاراگراف) بسته می‌شه. اگر متن اصلاً خط خالی
+    # نداشته باشه، در دو برابر max_chars سر مرز خط می‌بُریم تا حافظه محدود بمونه.
+    buf: List[str] = []
+    size = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            buf.append(line)
+            size += len(line)
+            if (size >= max_chars and not line.strip()) or size >= 2 * max_chars:
+                yield "".join(buf)
+                buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def _iter_jsonl_file(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # رکوردهای بدون text (مثل summary آخر abzaar_full_clean.jsonl) رد می‌شن
+            if isinstance(record, dict) and record.get("text"):
+                yield record["text"], record.get("metadata") or {}
+
+
+def iter_segments(
+    paths: Iterable[str],
+    max_chars: int = SEGMENT_CHARS,
+    start_seq: int = 0,
+) -> Iterator[Dict[str, Any]]:
+    """
+    {"seq", "source", "text", "metadata"} برای هر segment، به ترتیب.
+    source اسم فایله (مثل build_faiss)؛ segment های قبل از start_seq (کارهای انجام‌شده‌ی
+    اجرای قبلی) خونده می‌شن ولی بیرون داده نمی‌شن.
+    """
+    seq = 0
+    for path in paths:
+        source = os.path.basename(path)
+        if path.endswith(".jsonl"):
+            items: Iterator[Tuple[str, Dict[str, Any]]] = _iter_jsonl_file(path)
+        else:
+            items = ((text, {}) for text in _iter_text_file(path, max_chars))
+        for text, metadata in items:
+            if seq >= start_seq:
+                yield {"seq": seq, "source": source, "text": text, "metadata": metadata}
+            seq += 1
+
@@ -0,0 +1,158 @@
+# ingest/dedup.py
+# حذف چانک‌های تقریباً تکراری قبل از امبدینگ (MinHash روی شینگل‌های کلمه‌ای + LSH)
+#
+# هر چانک تکراری یعنی زمان امبدینگ، حافظه‌ی ایندکس و توکن‌های پرامپت هدر رفته (دو تکه‌ی
+# تقریباً یکسان تو top-k جای یک تکه‌ی مفید رو می‌گیرن). مقایسه‌ی همه با همه O(N²) است، پس:
+#
+# - هر چانک → شینگل‌های سه‌کلمه‌ای روی متن نرمال‌شده (مثل context_builder)
+# - امضای MinHash با DEDUP_NUM_PERM جایگشت؛ نسبت خونه‌های برابر دو امضا تخمین Jaccard است
+# - امضا به DEDUP_BANDS باند تقسیم می‌شه؛ فقط چانک‌هایی که حداقل تو یک باند کاملاً برابرن
+#   کاندید می‌شن و بعد با تخمین Jaccard در برابر DEDUP_THRESHOLD چک می‌شن
+#
+# حالت "merge" تکراری رو دور می‌ریزه ولی متادیتاش رو با اولین نسخه یکی می‌کنه (مقدارهای
+# متفاوت یک کلید → لیست)؛ حالت "drop" فقط دور می‌ریزه. hash ها قطعی‌ان (crc32 و seed ثابت)
+# پس خروجی بین دو اجرا یکسانه.
+from __future__ import annotations
+import os
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.text_norm import normalize_text
+
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+# مثل CONTEXT_DEDUP_THRESHOLD در context_builder
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+DEDUP_SHINGLE_WORDS = 3
+DEDUP_MODES = ("merge", "drop")
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def shingle_hashes(text: str, k: int = DEDUP_SHINGLE_WORDS) -> np.ndarray:
+    words = normalize_text(text).split()
+    if len(words) < k:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def merge_metadata(base: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """اجتماع دو متادیتا؛ کلیدی که مقدارهای متفاوت داره لیست مقدارها (به ترتیب دیدن) می‌شه."""
+    merged = dict(base)
+    for key, value in other.items():
+        if key not in merged:
+            merged[key] = value
+            continue
+        current = merged[key] if isinstance(merged[key], list) else [merged[key]]
+        for v in value if isinstance(value, list) else [value]:
+            if v not in current:
+                current = current + [v]
+        merged[key] = current[0] if len(current) == 1 else current
+    return merged
+
+
+class MinHashDeduper:
+    """
+    d = MinHashDeduper()
+    for rec in records:
+        dup_of = d.add(rec["text"])   # None یعنی جدیده (شماره‌ی این رکورد d.count - 1 است)
+    """
+
+    def __init__(
+        self,
+        num_perm: int = DEDUP_NUM_PERM,
+        bands: int = DEDUP_BANDS,
+        threshold: float = DEDUP_THRESHOLD,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        rng = np.random.default_rng(seed)
+        # a*x + b با x < 2^32 و a, b < 2^31 تو uint64 سرریز نمی‌کنه
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: List[Dict[bytes, int]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+
+    @property
+    def count(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        perm = ((hashes[:, None] * self._a[None, :] + self._b[None, :]) % _PRIME) & _MAX_HASH
+        return perm.min(axis=0).astype(np.uint32)
+
+    def find(self, sig: np.ndarray) -> Optional[Tuple[int, float]]:
+        """بهترین کاندید با Jaccard تخمینی ≥ threshold: (شماره، شباهت) یا None."""
+        seen = set()
+        best: Optional[Tuple[int, float]] = None
+        for band, bucket in enumerate(self._buckets):
+            other = bucket.get(sig[band * self.rows:(band + 1) * self.rows].tobytes())
+            if other is None or other in seen:
+                continue
+            seen.add(other)
+            sim = float(np.mean(self._signatures[other] == sig))
+            if sim >= self.threshold and (best is None or sim > best[1]):
+                best = (other, sim)
+        return best
+
+    def add(self, text: str) -> Optional[int]:
+        """اگر text تکراری باشه شماره‌ی نسخه‌ی اصلی، وگرنه None (و text به عنوان اصلی ثبت می‌شه)."""
+        sig = self.signature(text)
+        match = self.find(sig)
+        if match is not None:
+            return match[0]
+        row = len(self._signatures)
+        self._signatures.append(sig)
+        for band, bucket in enumerate(self._buckets):
+            # فقط اولین نسخه‌ی هر باند نگه داشته می‌شه؛ تکراری‌ها همیشه به اصلی برمی‌گردن
+            bucket.setdefault(sig[band * self.rows:(band + 1) * self.rows].tobytes(), row)
+        return None
+
+
+def dedup_records(
+    records: Iterable[Dict[str, Any]],
+    mode: str = "merge",
+    stats: Optional[Dict[str, int]] = None,
+    **deduper_kwargs: Any,
+) -> Iterator[Dict[str, Any]]:
+    """
+    رکوردهای {"text", "metadata"} → رکوردهای یکتا به ترتیب اولین دیده‌شدن.
+    با mode="merge" خروجی تا آخر ورودی نگه داشته می‌شه (متادیتای تکراری‌های بعدی باید به
+    نسخه‌ی اصلی اضافه بشه)؛ فقط رکوردهای یکتا تو حافظه‌ان. mode="drop" کاملاً جریانیه.
+    stats (اختیاری) با input / kept / duplicates پر می‌شه.
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"unknown dedup mode {mode!r}; expected one of {DEDUP_MODES}")
+    deduper = MinHashDeduper(**deduper_kwargs)
+    stats = stats if stats is not None else {}
+    stats.update(input=0, kept=0, duplicates=0)
+    kept: List[Dict[str, Any]] = []
+    for record in records:
+        stats["input"] += 1
+        original = deduper.add(record["text"])
+        if original is not None:
+            stats["duplicates"] += 1
+            if mode == "merge":
+                kept[original]["metadata"] = merge_metadata(
+                    kept[original].get("metadata") or {}, record.get("metadata") or {}
+                )
+            continue
+        stats["kept"] += 1
+        if mode == "drop":
+            yield record
+        else:
+            kept.append(dict(record))
+    yield from kept
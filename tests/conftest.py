@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StandInServer:
+    """
+    سرور HTTP محلی به جای API اوپن‌ای‌آی (POST /v1/chat/completions).
+    script لیست (status, headers) است که به ترتیب جواب داده می‌شن؛ تموم که شد همیشه 200.
+    """
+
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        self.reply = "pong"
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def respond(self, *steps):
+        with self._lock:
+            self.script.extend((s, {}) if isinstance(s, int) else s for s in steps)
+
+    def _next(self, path, body):
+        with self._lock:
+            self.requests.append((path, body))
+            return self.script.pop(0) if self.script else (200, {})
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("content-length") or 0))
+                body = json.loads(raw or b"{}")
+                status, headers = stand_in._next(self.path, body)
+                if status == 200:
+                    payload = {
+                        "id": "chatcmpl-test",
+                        "object": "chat.completion",
+                        "created": 0,
+                        "model": body.get("model", "test"),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": stand_in.reply},
+                            "finish_reason": "stop",
+                        }],
+                    }
+                else:
+                    payload = {"error": {"message": f"stand-in {status}", "type": "test", "code": None}}
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer()
+    yield server
+    server.close()
+
+
+# ثابت‌های main / retriever / llm_client موقع import از env خونده می‌شن،
+# پس اپ هر تست تو یک پروسه‌ی جدا با env خودش بالا میاد
+_APP_SCRIPT = """
+import json, sys, time
+from fastapi.testclient import TestClient
+from app.main import app
+
+with TestClient(app) as client:
+    deadline = time.time() + 60
+    ready = client.get("/ready")
+    while ready.status_code != 200 and time.time() < deadline:
+        time.sleep(0.05)
+        ready = client.get("/ready")
+    chat = client.post("/chat", json={"message": sys.argv[1]})
+    print(json.dumps({
+        "ready_status": ready.status_code,
+        "ready": ready.json(),
+        "chat_status": chat.status_code,
+        "chat": chat.json(),
+        "modules": [m for m in ("torch", "sentence_transformers") if m in sys.modules],
+    }))
+"""
+
+
+@pytest.fixture
+def app_process(tmp_path):
+    """
+    run(message, **env): اپ رو با TestClient تو یک پروسه‌ی جدا بالا میاره، تا /ready صبر می‌کنه،
+    یک /chat می‌فرسته و خلاصه‌ی جواب‌ها رو برمی‌گردونه. کش‌ها و ایندکس تو tmp_path ساخته می‌شن.
+    """
+
+    def run(message, **env):
+        full_env = {
+            k: v for k, v in os.environ.items()
+            if not k.startswith(("OPENAI_", "MODEL_", "RETRIEVER_", "FAKE_LLM_", "WARMUP_"))
+        }
+        full_env.update(
+            PYTHONPATH=ROOT,
+            RETRIEVER_MODE="lexical",
+            EMBED_CACHE_DIR=str(tmp_path / "emb_cache"),
+            FAISS_INDEX_DIR=str(tmp_path / "faiss_index"),
+            ANSWER_CACHE_PATH=str(tmp_path / "answer_cache.sqlite3"),
+            TIER_ROUTER_ENABLED="0",
+            TIER_DECISION_LOG="",
+        )
+        full_env.update(env)
+        proc = subprocess.run(
+            [sys.executable, "-c", _APP_SCRIPT, message],
+            cwd=str(tmp_path), env=full_env, capture_output=True, text=True, timeout=120,
+        )
+        assert proc.returncode == 0, proc.stderr
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    return run
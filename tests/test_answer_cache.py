@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import answer_cache
+from app.answer_cache import AnswerCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # ساعت دستی: TTL و accessed_at بدون sleep تست می‌شن
+    now = SimpleNamespace(t=1_000_000.0)
+    monkeypatch.setattr(answer_cache, "time", SimpleNamespace(time=lambda: now.t))
+    return now
+
+
+def test_put_get_and_stats(tmp_path, clock):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    assert cache.get("سلام") is None
+    cache.put("سلام", "جواب")
+    assert cache.get("سلام") == "جواب"
+    stats = cache.stats()
+    assert stats["size"] == 1 and stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), ttl_sec=60)
+    cache.put("q", "a")
+    clock.t += 59
+    assert cache.get("q") == "a"
+    # hit عمر ورودی رو تمدید نمی‌کنه؛ TTL از created_at حساب می‌شه
+    clock.t += 2
+    assert cache.get("q") is None
+    assert cache.evict() == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_zero_ttl_never_expires(tmp_path, clock):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), ttl_sec=0)
+    cache.put("q", "a")
+    clock.t += 10 * 365 * 24 * 3600
+    assert cache.get("q") == "a"
+
+
+def test_evict_keeps_most_recently_accessed(tmp_path, clock):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), max_entries=3, ttl_sec=0)
+    for i in range(5):
+        clock.t += 1
+        cache.put(f"q{i}", f"a{i}")
+    # q0 و q1 قدیمی‌ترین‌ها هستن؛ q0 بعد از _TOUCH_INTERVAL_SEC دوباره خونده می‌شه
+    clock.t += answer_cache._TOUCH_INTERVAL_SEC + 1
+    assert cache.get("q0") == "a0"
+    assert cache.evict() == 2
+    assert [cache.get(f"q{i}") for i in range(5)] == ["a0", None, None, "a3", "a4"]
+
+
+def test_put_evicts_periodically(tmp_path, clock):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), max_entries=10, ttl_sec=0)
+    for i in range(answer_cache._EVICT_EVERY):
+        clock.t += 1
+        cache.put(f"q{i}", "a")
+    # eviction روی put اول و بعد هر _EVICT_EVERY تا اجرا می‌شه، نه روی هر put
+    assert cache.stats()["size"] == answer_cache._EVICT_EVERY
+    clock.t += 1
+    cache.put("last", "a")
+    assert cache.stats()["size"] == 10
+    assert cache.get("last") == "a"
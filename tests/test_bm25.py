@@ -0,0 +1,81 @@
+import math
+from collections import Counter
+
+import numpy as np
+
+from app.bm25 import BM25Index, corpus_fingerprint
+from app.text_norm import normalize_text, tokenize
+
+DOCS = [
+    "هدف‌گذاری فروش برای تیم فروش",
+    "مذاکره با مشتری و تصمیم‌گیری سریع",
+    "برنامه‌ریزی مالی و بودجه‌ی تیم",
+    "فروش فروش فروش در بازار رقابتی",
+    "مديريت زمان و تمركز",  # ي و ك عربی
+    "",
+]
+
+
+def _reference_scores(texts, query, k1=1.5, b=0.75):
+    docs = [tokenize(t) for t in texts]
+    n = len(docs)
+    avgdl = sum(len(d) for d in docs) / n
+    out = []
+    for d in docs:
+        tf = Counter(d)
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(1 for other in docs if term in other)
+            if df == 0 or term not in tf:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(d) / avgdl))
+        out.append(score)
+    return np.asarray(out)
+
+
+def test_scores_match_reference_bm25():
+    index = BM25Index.build(DOCS)
+    for query in ["فروش", "تیم فروش", "مذاکره مشتری", "بودجه", "کلمه‌ای که نیست"]:
+        np.testing.assert_allclose(index.scores(query), _reference_scores(DOCS, query), rtol=1e-5, atol=1e-6)
+
+
+def test_persian_normalization():
+    assert normalize_text("هدف‌گذاری") == normalize_text("هدفگذاری")
+    assert normalize_text("مديريت") == normalize_text("مدیریت")
+    assert normalize_text("تمركز") == "تمرکز"
+    assert normalize_text("فُروشِ ۱۲") == "فروش 12"
+
+    index = BM25Index.build(DOCS)
+    assert list(index.search("هدفگذاری", 5)[0]) == [0]
+    assert list(index.search("مدیریت تمرکز", 5)[0]) == [4]
+
+
+def test_search_orders_and_skips_zero_scores():
+    index = BM25Index.build(DOCS)
+    ids, scores = index.search("فروش", 10)
+    # فقط سندهایی که ترم رو دارن، از بیشترین امتیاز
+    assert list(ids) == [3, 0]
+    assert scores[0] > scores[1] > 0
+    assert list(index.search("فروش", 1)[0]) == [3]
+    assert index.search("ناموجود", 5)[0].size == 0
+    assert index.search("فروش", 0)[0].size == 0
+
+
+def test_search_restricted_to_rows():
+    index = BM25Index.build(DOCS)
+    ids, _ = index.search("فروش تیم", 10, rows=np.asarray([0, 2], dtype=np.int32))
+    assert sorted(ids.tolist()) == [0, 2]
+    assert index.search("فروش", 10, rows=np.zeros((0,), dtype=np.int32))[0].size == 0
+
+
+def test_save_load_roundtrip(tmp_path):
+    fingerprint = corpus_fingerprint(DOCS)
+    index = BM25Index.build(DOCS, fingerprint=fingerprint)
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.fingerprint == fingerprint
+    assert loaded.vocab == index.vocab
+    for query in ["فروش", "مذاکره تصمیم‌گیری", "مدیریت"]:
+        np.testing.assert_array_equal(loaded.scores(query), index.scores(query))
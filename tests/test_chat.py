@@ -0,0 +1,25 @@
+QUESTION = "چطور برای تیم فروش هدف‌گذاری کنم؟"
+
+
+def test_chat_retries_against_stand_in(app_process, stand_in):
+    stand_in.reply = "جواب تستی"
+    stand_in.respond((429, {"retry-after": "0"}), 503)
+    out = app_process(
+        QUESTION,
+        MODEL_PROVIDER="openai",
+        OPENAI_API_KEY="test-key",
+        OPENAI_BASE_URL=stand_in.url,
+        LLM_BACKOFF_BASE_SEC="0.01",
+    )
+    assert out["chat"] == {"response": "جواب تستی"}
+    assert len(stand_in.requests) == 3
+    path, body = stand_in.requests[-1]
+    assert path == "/v1/chat/completions"
+    assert body["messages"][0]["content"] == QUESTION
+
+
+def test_chat_router_does_not_shadow_main_chat():
+    from app.router_chat import router
+
+    # /chat مال app/main است؛ router_chat فقط استریم رو اضافه می‌کنه
+    assert [r.path for r in router.routes] == ["/chat/stream"]
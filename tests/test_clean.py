@@ -0,0 +1,25 @@
+import pytest
+
+from ingest.clean import clean_text, normalize_persian
+
+
+@pytest.mark.parametrize("raw", [
+    "پاراگراف اول\u200c\n\nپاراگراف دوم",
+    "پاراگراف اول\n\n\u200cپاراگراف دوم",
+    "پاراگراف اول \u200c\n\n\u200c پاراگراف دوم",
+    "پاراگراف اول\u200c\u200c\n\nپاراگراف دوم",
+])
+def test_zwnj_at_paragraph_edge_keeps_the_break(raw):
+    # قبلاً \s خط خالی رو هم می‌خورد و دو پاراگراف یکی می‌شدن
+    assert clean_text(raw) == "پاراگراف اول\n\nپاراگراف دوم"
+
+
+def test_zwnj_at_line_edge_keeps_the_line():
+    assert clean_text("خط اول\u200c\nخط دوم") == "خط اول\nخط دوم"
+
+
+def test_zwnj_next_to_spaces_becomes_a_space():
+    assert normalize_persian("می \u200cخواهم") == "می خواهم"
+    assert normalize_persian("می\u200c\tخواهم") == "می خواهم"
+    assert normalize_persian("می\u200c\u200cخواهم") == "می\u200cخواهم"
+    assert normalize_persian("نیم\u200cفاصله") == "نیم\u200cفاصله"
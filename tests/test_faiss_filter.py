@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app import faiss_backend
+
+DIM = 16
+N = 4000
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((N, DIM)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    q = rng.standard_normal((6, DIM)).astype("float32")
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return x, q
+
+
+def _idx(index, x, metric="ip"):
+    if not index.is_trained:
+        index.train(x)
+    index.add(x)
+    return {"faiss": index, "metric": metric}
+
+
+def _brute(x, q, rows, k, metric="ip"):
+    sub = x[rows]
+    if metric == "ip":
+        d = 1.0 - q @ sub.T
+    else:
+        d = ((q[:, None, :] - sub[None, :, :]) ** 2).sum(axis=2) / 2.0
+    order = np.argsort(d, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(d, order, axis=1), rows[order]
+
+
+@pytest.mark.parametrize("metric", ["ip", "l2"])
+def test_flat_subset_matches_brute_force(vectors, metric):
+    x, q = vectors
+    index = faiss.IndexFlatIP(DIM) if metric == "ip" else faiss.IndexFlatL2(DIM)
+    idx = _idx(index, x, metric)
+    rows = np.arange(0, N, 7, dtype=np.int32)
+    dists, ids = faiss_backend.search(idx, q, 5, rows=rows)
+    want_d, want_ids = _brute(x, q, rows, 5, metric)
+    np.testing.assert_array_equal(ids, want_ids)
+    np.testing.assert_allclose(dists, want_d, atol=1e-5)
+
+
+def test_narrow_filter_on_ann_index_is_exact(vectors):
+    x, q = vectors
+    idx = _idx(faiss.IndexHNSWFlat(DIM, 8, faiss.METRIC_INNER_PRODUCT), x)
+    rows = np.arange(0, N, 50, dtype=np.int32)  # ۲٪ → زیر FAISS_FILTER_EXACT_FRACTION
+    assert rows.size <= faiss_backend.FAISS_FILTER_EXACT_FRACTION * N
+    dists, ids = faiss_backend.search(idx, q, 5, ef_search=1, rows=rows)
+    want_d, want_ids = _brute(x, q, rows, 5)
+    np.testing.assert_array_equal(ids, want_ids)
+    np.testing.assert_allclose(dists, want_d, atol=1e-5)
+
+
+@pytest.mark.parametrize("kind", ["ivf", "ivf_pq", "hnsw"])
+def test_broad_filter_returns_k_allowed_hits(vectors, kind):
+    x, q = vectors
+    if kind == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(DIM), DIM, 32, faiss.METRIC_INNER_PRODUCT)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(DIM), DIM, 32, 4, 6, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexHNSWFlat(DIM, 8, faiss.METRIC_INNER_PRODUCT)
+    idx = _idx(index, x)
+    rows = np.arange(0, N, 10, dtype=np.int32)  # ۱۰٪ → مسیر IDSelector
+    assert rows.size > faiss_backend.FAISS_FILTER_EXACT_FRACTION * N
+    # nprobe=1 یعنی بیشتر کوئری‌ها کمتر از k سطر مجاز پیدا می‌کنن و باید کامل بشن
+    dists, ids = faiss_backend.search(idx, q, 20, nprobe=1, ef_search=1, rows=rows)
+    assert ids.shape == (q.shape[0], 20)
+    assert (ids >= 0).all()
+    assert np.isin(ids, rows).all()
+    assert all(len(set(r)) == 20 for r in ids.tolist())
+    assert (np.diff(dists, axis=1) >= -1e-6).all()
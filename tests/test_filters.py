@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from app.bm25 import BM25Index
+from app.chunk_store import ChunkStoreWriter
+from app.retriever import _build_facets, _filter_rows, _lexical_search
+
+CHUNKS = [
+    ("فروش به مشتری سازمانی", {"skill": "فروش", "level": "پایه", "language": "fa"}),
+    ("مذاکره‌ی فروش با مشتری", {"skill": ["فروش", "مذاکره و تصمیم‌گیری"], "level": "متوسط"}),
+    ("تصمیم‌گیری در مذاکره", {"skill": "مذاكره و تصميم‌گيري", "level": "پیشرفته"}),
+    ("هدف‌گذاری تیم فروش", {"skill": "هدف‌گذاری", "level": "پایه", "chapter": 3}),
+    ("متن بدون متادیتا درباره‌ی فروش", {}),
+]
+
+
+def _index(store=None):
+    metadatas = [meta for _, meta in CHUNKS]
+    texts = [text for text, _ in CHUNKS]
+    return {
+        "chunks": texts,
+        "sources": [f"doc.txt[chunk:{i}]" for i in range(len(CHUNKS))],
+        "metadatas": metadatas,
+        "bm25": BM25Index.build(texts),
+        "facets": _build_facets(metadatas, store=store),
+    }
+
+
+def _rows(idx, filters):
+    rows = _filter_rows(idx, filters)
+    return None if rows is None else rows.tolist()
+
+
+def test_no_filters_means_all_rows():
+    assert _rows(_index(), None) is None
+    assert _rows(_index(), {}) is None
+
+
+def test_single_value_and_list_valued_metadata():
+    idx = _index()
+    assert _rows(idx, {"skill": "فروش"}) == [0, 1]
+    # متادیتای لیستی (چانک ادغام‌شده) زیر هر دو مقدار پیدا می‌شه
+    assert _rows(idx, {"skill": "مذاکره و تصمیم‌گیری"}) == [1, 2]
+
+
+def test_values_are_normalized():
+    idx = _index()
+    # ي/ك عربی و نیم‌فاصله فرقی نمی‌کنن
+    assert _rows(idx, {"skill": "هدفگذاری"}) == [3]
+    assert _rows(idx, {"skill": "مذاكره و تصميمگيري"}) == [1, 2]
+    assert _rows(idx, {"chapter": "3"}) == [3]
+
+
+def test_list_is_or_and_facets_are_and():
+    idx = _index()
+    assert _rows(idx, {"level": ["پایه", "متوسط"]}) == [0, 1, 3]
+    assert _rows(idx, {"skill": "فروش", "level": ["پایه", "پیشرفته"]}) == [0]
+    assert _rows(idx, {"skill": "فروش", "level": "پیشرفته"}) == []
+
+
+def test_unknown_value_matches_nothing():
+    idx = _index()
+    assert _rows(idx, {"skill": "آشپزی"}) == []
+    assert _rows(idx, {"skill": ["آشپزی", "هدف‌گذاری"]}) == [3]
+
+
+def test_unknown_facet_raises():
+    with pytest.raises(ValueError):
+        _filter_rows(_index(), {"author": "x"})
+
+
+def test_store_facets_match_list_facets(tmp_path):
+    with ChunkStoreWriter(str(tmp_path / "store")) as writer:
+        for i, (text, meta) in enumerate(CHUNKS):
+            writer.add(text, "doc.txt", i, meta)
+    from_store = _build_facets([], store=writer.store)
+    from_list = _build_facets([meta for _, meta in CHUNKS])
+    assert from_store.keys() == from_list.keys()
+    for facet in from_list:
+        assert from_store[facet].keys() == from_list[facet].keys()
+        for value, rows in from_list[facet].items():
+            np.testing.assert_array_equal(from_store[facet][value], rows)
+
+
+def test_lexical_search_respects_filters():
+    idx = _index()
+    unfiltered = _lexical_search(idx, "فروش", 10)
+    assert {h["source"] for h in unfiltered} == {f"doc.txt[chunk:{i}]" for i in (0, 1, 3, 4)}
+
+    hits = _lexical_search(idx, "فروش", 10, rows=_filter_rows(idx, {"level": "پایه"}))
+    assert sorted(h["source"] for h in hits) == ["doc.txt[chunk:0]", "doc.txt[chunk:3]"]
+    assert all(h["metadata"]["level"] == "پایه" and h["score"] > 0 and h["distance"] is None for h in hits)
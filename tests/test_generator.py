@@ -0,0 +1,85 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app import generator, tier_router
+
+
+@pytest.fixture
+def gen(tmp_path, monkeypatch):
+    """
+    generator با کش‌های تو tmp_path، provider fake بدون تأخیر و بدون مسیریاب tier.
+    بردار کوئری ثابته، پس هر دو سؤالی برای کش معنایی «هم‌معنی»‌اند؛ embeds تعداد encodeها رو می‌شمره.
+    """
+    monkeypatch.setenv("ANSWER_CACHE_PATH", str(tmp_path / "answer_cache.sqlite3"))
+    monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "1")
+    monkeypatch.setenv("MODEL_PROVIDER", "fake")
+    monkeypatch.setenv("OPENAI_API_KEY", "")
+    monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0")
+    monkeypatch.setenv("FAKE_LLM_TOKENS_PER_SEC", "0")
+    monkeypatch.setattr(tier_router, "TIER_ROUTER_ENABLED", False)
+
+    embeds = []
+    vec = np.ones((8,), dtype=np.float32) / np.sqrt(8)
+
+    def fake_embed(query):
+        embeds.append(query)
+        return vec
+
+    monkeypatch.setattr(generator, "_embed_query", fake_embed)
+    generator.reload_settings()
+    yield embeds
+    monkeypatch.undo()
+    generator.reload_settings()
+
+
+def test_exact_hit_does_not_encode(gen):
+    first = generator.generate_answer("اصول مذاکره چیه؟")
+    assert len(gen) == 1
+    assert generator.generate_answer("اصول مذاکره چیه؟") == first
+    assert len(gen) == 1
+
+
+def test_async_exact_hit_does_not_encode(gen):
+    first = asyncio.run(generator.agenerate_answer("اصول مذاکره چیه؟"))
+    assert len(gen) == 1
+
+    async def hit():
+        answer = await generator.agenerate_answer("اصول مذاکره چیه؟")
+        # encodeی که پس‌زمینه روی executor راه افتاده باشه تا اینجا اجرا شده
+        await asyncio.sleep(0.1)
+        return answer
+
+    assert asyncio.run(hit()) == first
+    assert len(gen) == 1
+
+
+class _StubOpenAI:
+    # جای OpenAIProvider واقعی؛ فقط مسیر کش‌ها مهمه، نه فراخوانی شبکه
+    name = "openai"
+
+    def ready(self, api_key):
+        return True
+
+    def complete(self, **request):
+        return "جواب واقعی"
+
+    async def acomplete(self, **request):
+        return "جواب واقعی"
+
+
+def test_fake_answers_are_never_served_to_openai(gen, monkeypatch):
+    fake = generator.generate_answer("اصول مذاکره چیه؟")
+    # بردار ثابت: سؤال دوم برای کش معنایی هم‌معنی سؤال اوله
+    assert generator.generate_answer("اصول مذاکره رو بگو") == fake
+
+    monkeypatch.setenv("MODEL_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setitem(generator._PROVIDER_FACTORIES, "openai", _StubOpenAI)
+    generator.reload_settings()
+
+    assert generator.generate_answer("اصول مذاکره چیه؟") == "جواب واقعی"
+    assert generator.generate_answer("اصول مذاکره رو بگو") == "جواب واقعی"
+    assert generator.generate_answer("اصول مذاکره رو توضیح بده") == "جواب واقعی"
+    assert asyncio.run(generator.agenerate_answer("اصول مذاکره چطوریه؟")) == "جواب واقعی"
@@ -0,0 +1,100 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from app import llm_client
+
+
+@pytest.fixture
+def client(stand_in, monkeypatch):
+    # همون کاری که OPENAI_BASE_URL موقع import می‌کنه؛ کلاینت‌های کش‌شده دوباره ساخته می‌شن
+    monkeypatch.setattr(llm_client, "OPENAI_BASE_URL", stand_in.url)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SEC", 0.01)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX_SEC", 0.05)
+    llm_client.get_client.cache_clear()
+    yield stand_in
+    llm_client.get_client.cache_clear()
+
+
+def _chat(**kw):
+    return llm_client.chat_completions_create(
+        "test-key", tier="cheap", model="m", messages=[{"role": "user", "content": "ping"}], **kw
+    )
+
+
+def test_retries_429_until_success(client):
+    client.respond(429, 429)
+    before = llm_client.client_stats()
+    completion = _chat()
+    after = llm_client.client_stats()
+    assert completion.choices[0].message.content == "pong"
+    assert len(client.requests) == 3
+    assert client.requests[0][0] == "/v1/chat/completions"
+    assert after["retries"] - before["retries"] == 2
+    assert after["failures"] == before["failures"]
+
+
+def test_retries_5xx_until_success(client):
+    client.respond(500, 502, 503)
+    assert _chat().choices[0].message.content == "pong"
+    assert len(client.requests) == 4
+
+
+def test_gives_up_after_max_retries(client):
+    client.respond(*[503] * (llm_client.LLM_MAX_RETRIES + 2))
+    before = llm_client.client_stats()
+    with pytest.raises(openai.InternalServerError):
+        _chat()
+    assert len(client.requests) == llm_client.LLM_MAX_RETRIES + 1
+    assert llm_client.client_stats()["failures"] - before["failures"] == 1
+
+
+def test_client_errors_are_not_retried(client):
+    client.respond(400)
+    with pytest.raises(openai.BadRequestError):
+        _chat()
+    assert len(client.requests) == 1
+
+
+def test_retry_after_header_is_honoured(client, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX_SEC", 5.0)
+    client.respond((429, {"retry-after": "0.3"}))
+    t0 = time.perf_counter()
+    assert _chat().choices[0].message.content == "pong"
+    assert time.perf_counter() - t0 >= 0.3
+    assert len(client.requests) == 2
+
+
+def test_async_client_retries(client):
+    client.respond(502, 429)
+
+    async def main():
+        return await llm_client.achat_completions_create(
+            "test-key", tier="deep", model="m", messages=[{"role": "user", "content": "ping"}]
+        )
+
+    assert asyncio.run(main()).choices[0].message.content == "pong"
+    assert len(client.requests) == 3
+
+
+def test_backoff_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SEC", 0.5)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX_SEC", 8.0)
+    random.seed(0)
+    no_header = SimpleNamespace(response=None)
+    for attempt in range(8):
+        ceiling = min(8.0, 0.5 * 2 ** attempt)
+        delays = [llm_client._backoff_delay(attempt, no_header) for _ in range(200)]
+        assert all(0.0 <= d <= ceiling for d in delays)
+        # jitter: تأخیرها ثابت نیستن و تا نزدیک سقف پخش می‌شن
+        assert max(delays) > 0.8 * ceiling and min(delays) < 0.2 * ceiling
+
+    # Retry-After رعایت می‌شه ولی از سقف بالاتر نمی‌ره
+    with_header = SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "2"}))
+    assert llm_client._backoff_delay(0, with_header) == 2.0
+    with_header.response.headers["retry-after"] = "120"
+    assert llm_client._backoff_delay(0, with_header) == 8.0
@@ -0,0 +1,27 @@
+def test_lexical_mode_is_ready_without_encoder(app_process):
+    out = app_process(
+        "چطور برای تیم فروش هدف‌گذاری کنم؟",
+        MODEL_PROVIDER="fake",
+        FAKE_LLM_LATENCY="fixed:10",
+        FAKE_LLM_OUTPUT_TOKENS="8",
+    )
+    assert out["ready_status"] == 200 and out["ready"]["ready"] is True
+    steps = out["ready"]["steps"]
+    assert steps["index"]["ok"] is True
+    assert steps["encoder"]["result"] == {"skipped": True}
+    # مدل امبدینگ تو حالت lexical اصلاً import نمی‌شه
+    assert out["modules"] == []
+    assert out["chat_status"] == 200
+    assert "error" not in out["chat"] and out["chat"]["response"]
+
+
+def test_warmup_starts_from_lifespan(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main, warmup
+
+    started = []
+    monkeypatch.setattr(warmup, "start_warmup", lambda: started.append("warmup"))
+    monkeypatch.setattr(main, "start_index_watcher", lambda interval: started.append("watcher"))
+    assert not main.app.router.on_startup
+    with TestClient(main.app):
+        assert started == ["watcher", "warmup"]
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_ado_collapses_identical_calls():
+    flight = SingleFlight("t")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*[flight.ado("k", work) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert stats["executed"] == 1 and stats["collapsed"] == 4 and stats["in_flight"] == 0
+
+
+def test_cancelled_follower_does_not_cancel_shared_result():
+    flight = SingleFlight("t")
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def work():
+            await gate.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flight.ado("k", work))
+        await asyncio.sleep(0)
+        f1 = asyncio.create_task(flight.ado("k", work))
+        f2 = asyncio.create_task(flight.ado("k", work))
+        await asyncio.sleep(0)
+        f1.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(leader, f1, f2, return_exceptions=True)
+
+    leader, f1, f2 = asyncio.run(main())
+    assert leader == "answer"
+    assert isinstance(f1, asyncio.CancelledError)
+    assert f2 == "answer"
+    assert flight.stats()["errors"] == 0
+
+
+def test_cancelled_leader_promotes_a_follower():
+    flight = SingleFlight("t")
+    calls = []
+
+    async def main():
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        leader = asyncio.create_task(flight.ado("k", work))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.ado("k", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    leader, *followers = asyncio.run(main())
+    assert isinstance(leader, asyncio.CancelledError)
+    # یکی از followerها leader جدید شده و fn فقط یک بار دیگه اجرا شده
+    assert followers == [2, 2, 2]
+    assert len(calls) == 2
+    stats = flight.stats()
+    assert stats["abandoned"] == 1 and stats["errors"] == 0 and stats["in_flight"] == 0
+
+
+def test_leader_error_is_shared():
+    flight = SingleFlight("t")
+
+    async def main():
+        async def work():
+            await asyncio.sleep(0.02)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*[flight.ado("k", work) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.stats()["errors"] == 1
+
+
+def test_sync_follower_waits_on_async_leader():
+    flight = SingleFlight("t")
+    started = threading.Event()
+    out = {}
+
+    async def work():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    def follower():
+        started.wait()
+        out["sync"] = flight.do("k", lambda: pytest.fail("follower must not run fn"))
+
+    t = threading.Thread(target=follower)
+    t.start()
+    assert asyncio.run(flight.ado("k", work)) == "answer"
+    t.join(timeout=2)
+    assert out["sync"] == "answer"